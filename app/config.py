@@ -65,15 +65,87 @@ RATELIMIT_HEADERS_ENABLED = True
 # ZMON
 KAIROSDB_URL = os.getenv('KAIROSDB_URL')
 KAIROS_QUERY_LIMIT = os.getenv('KAIROSDB_QUERY_LIMIT', 10000)
+# Keep-alive connections shared by all updater greenlets and API requests
+KAIROSDB_POOL_SIZE = int(os.getenv('SLR_KAIROSDB_POOL_SIZE', 20))
+# Assumed lifetime of the zign token used for KairosDB; it is refreshed shortly before
+KAIROSDB_TOKEN_TTL = int(os.getenv('SLR_KAIROSDB_TOKEN_TTL', 600))
+# Let KairosDB compute average/sum/min/max across entities (checks must report at most once per minute)
+KAIROSDB_AGGREGATION_PUSHDOWN = os.getenv('SLR_KAIROSDB_AGGREGATION_PUSHDOWN', 'false').lower() == 'true'
+# Query windows are split into slices of this many minutes, failing slices are halved down to the minimum
+KAIROSDB_QUERY_SLICE = int(os.getenv('SLR_KAIROSDB_QUERY_SLICE', 360))
+KAIROSDB_MIN_QUERY_SLICE = int(os.getenv('SLR_KAIROSDB_MIN_QUERY_SLICE', 10))
+KAIROSDB_QUERY_RETRIES = int(os.getenv('SLR_KAIROSDB_QUERY_RETRIES', 3))
+# Concurrent slice queries per indicator (or shared check query)
+KAIROSDB_SLICE_CONCURRENCY = int(os.getenv('SLR_KAIROSDB_SLICE_CONCURRENCY', 4))
+
+# Reduce ZMON datapoints with NumPy arrays instead of nested dicts (if NumPy is installed)
+VECTORIZED_AGGREGATION = os.getenv('SLR_VECTORIZED_AGGREGATION', 'true').lower() == 'true'
 
 # UPDATER / RETENTION
 RUN_UPDATER = os.environ.get('SLR_RUN_UPDATER', False)
 MAX_QUERY_TIME_SLICE = os.getenv('SLR_MAX_QUERY_TIME_SLICE', 1440)
 MAX_RETENTION_DAYS = os.getenv('MAX_RETENTION_DAYS', 100)
+# Downsampled tiers: hourly and daily rollups outlive the minute values (MAX_RETENTION_DAYS), 0 keeps them forever
+HOURLY_RETENTION_DAYS = int(os.getenv('SLR_HOURLY_RETENTION_DAYS', 400))
+DAILY_RETENTION_DAYS = int(os.getenv('SLR_DAILY_RETENTION_DAYS', 1825))
+# Minute values older than this many days are archived, one row per SLI and day (0 disables archiving)
+ARCHIVE_AFTER_DAYS = int(os.getenv('SLR_ARCHIVE_AFTER_DAYS', 7))
+# Monthly partitions of indicator values created ahead of time (PostgreSQL 11+)
+INDICATORVALUE_PARTITIONS_AHEAD = int(os.getenv('SLR_INDICATORVALUE_PARTITIONS_AHEAD', 3))
+# Cleanup deletes SLI values in batches (per SLI and time slice), committed one by one and paused in between
+CLEANUP_BATCH_SIZE = int(os.getenv('SLR_CLEANUP_BATCH_SIZE', 5000))
+CLEANUP_PAUSE = float(os.getenv('SLR_CLEANUP_PAUSE', 0.1))
+CLEANUP_SLICE_DAYS = int(os.getenv('SLR_CLEANUP_SLICE_DAYS', 7))
 
 # Careful with high concurrency, as we might hit rate limits on ZMON
 UPDATER_CONCURRENCY = os.getenv('SLR_UPDATER_CONCURRENCY', 20)
 UPDATER_INTERVAL = os.getenv('SLR_UPDATER_INTERVAL', 600)
+# Connections of the updater's own pool (the API uses DATABASE_POOL_SIZE), updater greenlets wait for a free one
+UPDATER_DB_POOL_SIZE = int(os.getenv('SLR_UPDATER_DB_POOL_SIZE', 20))
+
+# Updater engine: "gevent" (default) or "asyncio" (requires aiohttp and asyncpg)
+UPDATER_ENGINE = os.getenv('SLR_UPDATER_ENGINE', 'gevent')
+# asyncio engine: concurrent upstream fetches and concurrent DB writes (asyncpg pool size)
+UPDATER_FETCH_CONCURRENCY = int(os.getenv('SLR_UPDATER_FETCH_CONCURRENCY', 20))
+UPDATER_WRITE_CONCURRENCY = int(os.getenv('SLR_UPDATER_WRITE_CONCURRENCY', 5))
+
+# Updater scheduling: "cycle" updates all indicators every UPDATER_INTERVAL, "staggered" updates each
+# indicator when it is due (gevent engine only)
+UPDATER_SCHEDULER = os.getenv('SLR_UPDATER_SCHEDULER', 'cycle')
+# Staggered scheduler: random +/- fraction added to every indicator interval
+UPDATER_JITTER = float(os.getenv('SLR_UPDATER_JITTER', 0.1))
+# Staggered scheduler: upper bound of the exponential backoff of failing indicators (seconds)
+UPDATER_MAX_BACKOFF = int(os.getenv('SLR_UPDATER_MAX_BACKOFF', 3600))
+# Staggered scheduler: seconds between reloads of the indicator set and their watermarks
+UPDATER_REFRESH_INTERVAL = int(os.getenv('SLR_UPDATER_REFRESH_INTERVAL', 60))
+# Staggered scheduler: share the work between updater replicas through leases in the database
+UPDATER_LEASES = os.getenv('SLR_UPDATER_LEASES', 'false').lower() == 'true'
+# Seconds until the work units of a dead replica can be claimed by others (renewed while running)
+UPDATER_LEASE_TTL = int(os.getenv('SLR_UPDATER_LEASE_TTL', 900))
+
+# Directory of the local spool keeping fetched values while the database is unavailable, disabled if empty
+UPDATER_SPOOL_DIR = os.getenv('SLR_UPDATER_SPOOL_DIR', '')
+# Seconds between attempts to replay the spool into the database
+UPDATER_SPOOL_REPLAY_INTERVAL = int(os.getenv('SLR_UPDATER_SPOOL_REPLAY_INTERVAL', 30))
+# Spool segments failing to replay this many times (not as the database is unavailable) are quarantined
+UPDATER_SPOOL_MAX_ATTEMPTS = int(os.getenv('SLR_UPDATER_SPOOL_MAX_ATTEMPTS', 5))
+
+# Rows per multi-row INSERT ... ON CONFLICT statement when upserting indicator values
+UPDATER_INSERT_BATCH_SIZE = int(os.getenv('SLR_UPDATER_INSERT_BATCH_SIZE', 1000))
+# Results with at least this many rows (e.g. SLI query backfills) are ingested via COPY into a staging table
+BACKFILL_COPY_THRESHOLD = int(os.getenv('SLR_BACKFILL_COPY_THRESHOLD', 10000))
+
+# Upstream protection, per backend (KairosDB host, Lightstep API): concurrent queries, query rate
+# (per second, 0 is unlimited) with its burst, and the circuit breaker opening after consecutive failures
+SOURCE_CONCURRENCY = int(os.getenv('SLR_SOURCE_CONCURRENCY', 20))
+SOURCE_RATE_LIMIT = float(os.getenv('SLR_SOURCE_RATE_LIMIT', 0))
+SOURCE_RATE_BURST = int(os.getenv('SLR_SOURCE_RATE_BURST', 10))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('SLR_CIRCUIT_FAILURE_THRESHOLD', 5))
+# Seconds an open circuit rejects queries before letting a single probe through
+CIRCUIT_RESET_TIMEOUT = int(os.getenv('SLR_CIRCUIT_RESET_TIMEOUT', 60))
+
+# Port serving /metrics of an updater-only process (the API server serves /metrics itself), 0 disables
+METRICS_PORT = int(os.getenv('SLR_METRICS_PORT', 9090))
 
 # OPENTRACING
 OPENTRACING_TRACER = os.getenv('OPENTRACING_TRACER')
@@ -1,4 +1,4 @@
-from .database import db, migrate, sqlalchemy_skip_span
+from .database import db, init_updater_session, migrate, sqlalchemy_skip_span, updater_session
 from .session import session, set_token_info, get_token_info
 from .throttle import limiter
 from .cache import cache
@@ -12,8 +12,10 @@ __all__ = (
     'migrate',
     'oauth',
     'session',
+    'updater_session',
 
     'get_token_info',
+    'init_updater_session',
     'set_token_info',
     'sqlalchemy_skip_span',
 )
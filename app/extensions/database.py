@@ -1,10 +1,42 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from gevent import getcurrent
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import scoped_session, sessionmaker
 
+from app.libs.metrics import TimedQueuePool
 
-db = SQLAlchemy()
+
+class _SQLAlchemy(SQLAlchemy):
+    def apply_driver_hacks(self, app, info, options):
+        rv = super().apply_driver_hacks(app, info, options)
+        # The default pool of PostgreSQL, SQLite uses pools of its own
+        if info.drivername != 'sqlite':
+            options.setdefault('poolclass', TimedQueuePool)
+
+        return rv
+
+
+db = _SQLAlchemy()
 migrate = Migrate()
 
+# Sessions of the updater, one per greenlet, on an engine (and pool) of their own. Thus updater greenlets
+# never wait for connections checked out by API requests, and vice versa.
+updater_session = scoped_session(sessionmaker(), scopefunc=getcurrent)
+
+
+def init_updater_session(uri: str, pool_size: int) -> Engine:
+    """
+    Bind ``updater_session`` to a new engine with at most ``pool_size`` connections.
+
+    Note: Greenlets using ``updater_session`` must call ``updater_session.remove()`` when done.
+    """
+    engine = create_engine(uri, poolclass=TimedQueuePool, pool_size=pool_size, max_overflow=0)
+    updater_session.configure(bind=engine)
+
+    return engine
+
 
 def sqlalchemy_skip_span(conn, cursor, statement, parameters, context, executemany):
     return statement.lower().startswith('insert into indicatorvalue')
@@ -0,0 +1,226 @@
+"""
+Prometheus metrics of the updater and the API, served on ``/metrics``.
+
+The updater-only process has no HTTP server, it exposes the same metrics on
+``METRICS_PORT`` instead (see ``start_metrics_server``).
+"""
+import datetime
+import time
+from typing import Dict, Iterable, Optional
+
+import flask
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+# Exponential buckets from 1ms up to ~2 minutes
+_LATENCY_BUCKETS = (
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 25, 60, 120
+)
+_BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(12))  # 1KiB ... 4GiB
+_ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+_CYCLE_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+KAIROSDB_QUERY_SECONDS = Histogram(
+    'slr_kairosdb_query_seconds',
+    'KairosDB query latency, including reading the response',
+    ['outcome'],
+    buckets=_LATENCY_BUCKETS,
+)
+KAIROSDB_RESPONSE_BYTES = Histogram(
+    'slr_kairosdb_response_bytes',
+    'KairosDB query response size (as received)',
+    buckets=_BYTES_BUCKETS,
+)
+UPSERT_SECONDS = Histogram(
+    'slr_indicator_values_upsert_seconds',
+    'Time to write the values of one indicator update',
+    ['mode'],
+    buckets=_LATENCY_BUCKETS,
+)
+ROWS_WRITTEN = Histogram(
+    'slr_indicator_values_rows_written',
+    'Indicator values written per indicator update',
+    buckets=_ROWS_BUCKETS,
+)
+INDICATOR_VALUE_ROWS = Counter(
+    'slr_indicator_values_rows',
+    'Fetched indicator values, written, skipped as already stored or dropped outside the stored range',
+    ['result'],
+)
+SPOOLED_ROWS = Counter(
+    'slr_spooled_rows',
+    'Indicator values spooled while the database was unavailable, replayed or dropped (SLI deleted, expired)',
+    ['result'],
+)
+UPDATER_CYCLE_SECONDS = Histogram(
+    'slr_updater_cycle_seconds',
+    'Duration of updating all indicators (cycle scheduler) or one work unit (staggered scheduler)',
+    ['engine'],
+    buckets=_CYCLE_BUCKETS,
+)
+UPDATER_BUSY = Gauge(
+    'slr_updater_busy_greenlets',
+    'Updater greenlets currently running, compare with SLR_UPDATER_CONCURRENCY',
+)
+INGESTION_LAG_SECONDS = Gauge(
+    'slr_ingestion_lag_seconds',
+    'Age of the newest stored value of the indicators, as of the last updater (re)load',
+    ['quantile'],
+)
+SOURCE_CIRCUIT_STATE = Gauge(
+    'slr_source_circuit_state',
+    'Circuit breaker of an upstream backend: 0 closed, 1 half-open, 2 open',
+    ['backend'],
+)
+SOURCE_REJECTED_QUERIES = Counter(
+    'slr_source_rejected_queries',
+    'Upstream queries rejected without being sent, as the backend circuit is open',
+    ['backend'],
+)
+API_REQUEST_SECONDS = Histogram(
+    'slr_api_request_seconds',
+    'API request latency',
+    ['method', 'endpoint', 'status'],
+    buckets=_LATENCY_BUCKETS,
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'slr_db_pool_connections',
+    'SQLAlchemy pool connections',
+    ['pool', 'state'],
+)
+DB_POOL_CHECKOUT_WAIT_SECONDS = Histogram(
+    'slr_db_pool_checkout_wait_seconds',
+    'Time waited for a connection of the SQLAlchemy pool',
+    ['pool'],
+    buckets=_LATENCY_BUCKETS,
+)
+DB_POOL_HOLD_SECONDS = Histogram(
+    'slr_db_pool_connection_hold_seconds',
+    'Time a connection of the SQLAlchemy pool was checked out',
+    ['pool'],
+    buckets=_LATENCY_BUCKETS,
+)
+DB_POOL_CONNECTS = Counter(
+    'slr_db_pool_connects',
+    'New database connections opened by the SQLAlchemy pool',
+    ['pool'],
+)
+
+
+def metrics():
+    return flask.Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+def start_metrics_server(port: int) -> None:
+    start_http_server(port)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    ``QueuePool`` observing how long checkouts wait for a connection, once instrumented. SQLAlchemy
+    has no event before a checkout, the ``checkout`` event only fires once a connection was taken.
+    """
+
+    checkout_wait = None
+
+    def _do_get(self):
+        if self.checkout_wait is None:
+            return super()._do_get()
+
+        t_start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            self.checkout_wait.observe(time.monotonic() - t_start)
+
+    def recreate(self):
+        # E.g. on ``engine.dispose()``
+        pool = super().recreate()
+        pool.checkout_wait = self.checkout_wait
+
+        return pool
+
+
+def instrument_pool(name: str, engine) -> None:
+    """
+    Report checked out and idle connections of an engine's pool at scrape time, how long
+    connections are checked out, and how many connections are opened. Checkout waits are
+    observed for pools of ``TimedQueuePool``.
+    """
+    pool = engine.pool
+
+    if isinstance(pool, TimedQueuePool):
+        pool.checkout_wait = DB_POOL_CHECKOUT_WAIT_SECONDS.labels(name)
+
+    DB_POOL_CONNECTIONS.labels(name, 'checked_out').set_function(lambda: pool.checkedout())
+    DB_POOL_CONNECTIONS.labels(name, 'idle').set_function(lambda: pool.checkedin())
+    DB_POOL_CONNECTIONS.labels(name, 'size').set_function(lambda: pool.size())
+
+    hold = DB_POOL_HOLD_SECONDS.labels(name)
+    connects = DB_POOL_CONNECTS.labels(name)
+
+    def on_connect(dbapi_connection, connection_record):
+        connects.inc()
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['slr_checkout_at'] = time.monotonic()
+
+    def on_checkin(dbapi_connection, connection_record):
+        t_checkout = connection_record.info.pop('slr_checkout_at', None)
+        if t_checkout is not None:
+            hold.observe(time.monotonic() - t_checkout)
+
+    event.listen(pool, 'connect', on_connect)
+    event.listen(pool, 'checkout', on_checkout)
+    event.listen(pool, 'checkin', on_checkin)
+
+
+def instrument_app(app: flask.Flask) -> None:
+    """Observe the latency of all requests, labeled by their URL rule."""
+
+    def start_timer():
+        flask.g.metrics_start = time.monotonic()
+
+    def observe(response):
+        start = getattr(flask.g, 'metrics_start', None)
+        if start is not None:
+            rule = flask.request.url_rule
+            API_REQUEST_SECONDS.labels(
+                flask.request.method, rule.rule if rule else 'unknown', response.status_code
+            ).observe(time.monotonic() - start)
+
+        return response
+
+    app.before_request(start_timer)
+    app.after_request(observe)
+
+
+def indicator_value_rows() -> Dict[str, int]:
+    """Written and skipped indicator values since the process started."""
+    return {
+        result: int(
+            REGISTRY.get_sample_value('slr_indicator_values_rows_total', {'result': result}) or 0
+        )
+        for result in ('written', 'skipped')
+    }
+
+
+def observe_ingestion_lag(timestamps: Iterable[Optional[datetime.datetime]]) -> None:
+    now = datetime.datetime.utcnow()
+    lags = sorted((now - ts).total_seconds() for ts in timestamps if ts is not None)
+    if not lags:
+        return
+
+    for quantile in (0.5, 0.9, 0.99, 1):
+        INGESTION_LAG_SECONDS.labels(str(quantile)).set(
+            lags[min(int(quantile * len(lags)), len(lags) - 1)]
+        )
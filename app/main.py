@@ -24,26 +24,45 @@ from app.config import (
     CACHE_TYPE,
     DEBUG,
     MAX_RETENTION_DAYS,
+    METRICS_PORT,
     OPENTRACING_TRACER,
     RUN_UPDATER,
+    SLR_LOCAL_ENV,
+    UPDATER_DB_POOL_SIZE,
+    UPDATER_ENGINE,
     UPDATER_INTERVAL,
+    UPDATER_LEASES,
+    UPDATER_SCHEDULER,
 )
 from app.extensions import (
     cache,
     db,
+    init_updater_session,
     limiter,
     migrate,
     oauth,
     session,
     sqlalchemy_skip_span,
 )
+from app.libs.metrics import (
+    UPDATER_CYCLE_SECONDS,
+    indicator_value_rows,
+    instrument_app,
+    instrument_pool,
+    start_metrics_server,
+)
 from app.libs.oauth import verify_oauth_with_session
 from app.libs.resolver import get_operation_name, get_resource_handler
 
 # Models
 from app.resources import Indicator, Objective, Product, ProductGroup, Target  # noqa
-from app.resources.sli.retention import apply_retention, cleanup_sli
-from app.resources.sli.updater import update_all_indicators
+from app.resources.sli.async_updater import update_all_indicators_async
+from app.resources.sli.leases import LeaseStore
+from app.resources.sli.partitions import maintain_partitions, run_partition_maintenance
+from app.resources.sli.retention import apply_retention, cleanup_sli, rebuild_sli_rollups
+from app.resources.sli.scheduler import UpdateScheduler
+from app.resources.sli.sources.spool import get_spool
+from app.resources.sli.updater import replay_spool, run_spool_replayer, update_all_indicators
 from app.routes import ROUTES, process_request, rate_limit_exceeded, request_skip_span
 from app.utils import DecimalEncoder
 
@@ -85,6 +104,10 @@ def register_extensions(app: flask.Flask) -> None:
 
     app.config['SQLALCHEMY_ECHO'] = DEBUG
     db.init_app(app)
+    instrument_pool('default', db.get_engine(app))
+    instrument_pool(
+        'updater', init_updater_session(app.config['SQLALCHEMY_DATABASE_URI'], UPDATER_DB_POOL_SIZE)
+    )
 
     migrate.init_app(app, db)
     cache.init_app(
@@ -101,6 +124,7 @@ def register_extensions(app: flask.Flask) -> None:
 def register_middleware(app: flask.Flask) -> None:
     # Add middleware processors
     app.before_request(process_request)
+    instrument_app(app)
 
 
 def register_api(connexion_app: connexion.App) -> None:
@@ -121,14 +145,63 @@ def register_errors(app: flask.Flask) -> None:
     app.errorhandler(429)(rate_limit_exceeded)
 
 
-def run_updater(app: flask.Flask, once=False):
+UPDATER_ENGINES = {
+    'gevent': update_all_indicators,
+    'asyncio': update_all_indicators_async,
+}
+
+
+def run_updater(app: flask.Flask, once=False, engine=UPDATER_ENGINE, scheduler=UPDATER_SCHEDULER):
+    update = UPDATER_ENGINES[engine]
+
+    if SLR_LOCAL_ENV:
+        # app/__init__.py skips the gevent patching, updater greenlets then block each other on I/O
+        logger.warning('Running the updater on local env while not setting up gevent properly!')
+
+    spool = get_spool()
+    if spool is not None:
+        if once:
+            logger.info('Replayed {} spooled indicator values'.format(replay_spool(spool)))
+        else:
+            gevent.spawn(run_spool_replayer, spool)
+
+    if once:
+        maintain_partitions()
+    else:
+        gevent.spawn(run_partition_maintenance)
+
     with app.app_context():
         try:
+            if UPDATER_LEASES:
+                # Replicas can only split the work when it is scheduled per work unit
+                leases = LeaseStore()
+                logger.info('Updating indicators continuously as replica {} ...'.format(leases.owner))
+                UpdateScheduler(app, leases=leases).run()
+                return
+
+            if scheduler == 'staggered' and not once:
+                logger.info('Updating indicators continuously (staggered scheduler) ...')
+                UpdateScheduler(app).run()
+                return
+
             while True:
                 try:
-                    logger.info('Updating all indicators ...')
-
-                    update_all_indicators(app)
+                    logger.info('Updating all indicators ({} engine) ...'.format(engine))
+
+                    t_start = time.monotonic()
+                    rows_before = indicator_value_rows()
+                    update(app)
+                    duration = time.monotonic() - t_start
+                    UPDATER_CYCLE_SECONDS.labels(engine).observe(duration)
+
+                    rows = indicator_value_rows()
+                    logger.info(
+                        'Updated all indicators in {:.1f} seconds: {} values written, {} unchanged skipped'.format(
+                            duration,
+                            rows['written'] - rows_before['written'],
+                            rows['skipped'] - rows_before['skipped'],
+                        )
+                    )
                 except Exception:
                     logger.exception('Updater failed!')
 
@@ -187,6 +260,13 @@ def run():
         action='store_true',
         help='Run the cleanup/retention only!',
     )
+    argp.add_argument(
+        '--rebuild-rollups',
+        dest='rebuild_rollups',
+        type=int,
+        metavar='DAYS',
+        help='Rebuild the hourly/daily SLI value rollups of the last DAYS days only!',
+    )
     argp.add_argument(
         '-o',
         '--once',
@@ -194,17 +274,45 @@ def run():
         action='store_true',
         help='Make sure the updater runs once and exits! Only works if --updater-only is used, ignored otherwise',
     )
+    argp.add_argument(
+        '--updater-engine',
+        dest='updater_engine',
+        choices=sorted(UPDATER_ENGINES),
+        default=UPDATER_ENGINE,
+        help='Updater engine (default: SLR_UPDATER_ENGINE or gevent)',
+    )
+    argp.add_argument(
+        '--updater-scheduler',
+        dest='updater_scheduler',
+        choices=['cycle', 'staggered'],
+        default=UPDATER_SCHEDULER,
+        help='Update all indicators per cycle, or each one when it is due (default: SLR_UPDATER_SCHEDULER or cycle)',
+    )
 
     args = argp.parse_args()
 
+    staggered = args.updater_scheduler == 'staggered' or UPDATER_LEASES
+    if args.updater_engine == 'asyncio' and staggered and not args.once:
+        argp.error('The staggered scheduler (also used with SLR_UPDATER_LEASES) only supports the gevent engine')
+    if UPDATER_LEASES and args.once:
+        # A single pass would update all indicators in every replica, regardless of their leases
+        argp.error('--once does not support SLR_UPDATER_LEASES')
+
     connexion_app = create_app(connexion_app=True)
 
     if args.cleanup:
         run_cleanup(connexion_app.app)
+    elif args.rebuild_rollups:
+        rebuild_sli_rollups(connexion_app.app, args.rebuild_rollups)
     elif not args.updater:
         if args.with_updater or RUN_UPDATER:
             logger.info('Running SLI updater ...')
-            gevent.spawn(run_updater, connexion_app.app)
+            gevent.spawn(
+                run_updater,
+                connexion_app.app,
+                engine=args.updater_engine,
+                scheduler=args.updater_scheduler,
+            )
 
         # run our standalone gevent server
         logger.info('Service level reports starting application server')
@@ -218,7 +326,9 @@ def run():
             logger.info('KeyboardInterrupt ... terminating server!')
     else:
         logger.info('Running SLI updater ...')
-        run_updater(connexion_app.app, args.once)
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
+        run_updater(connexion_app.app, args.once, args.updater_engine, args.updater_scheduler)
 
 
 # set the WSGI application callable to allow using uWSGI:
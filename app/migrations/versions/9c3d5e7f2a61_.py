@@ -0,0 +1,80 @@
+"""partition indicatorvalue by month
+
+Revision ID: 9c3d5e7f2a61
+Revises: 5b1f0c6d9e23
+Create Date: 2026-10-17 16:05:31.402187
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.resources.sli import partitions
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3d5e7f2a61'
+down_revision = '5b1f0c6d9e23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    now = datetime.datetime.utcnow()
+    next_month = partitions.add_months(partitions.month_start(now), 1)
+
+    # The existing table becomes the partition of all values before next month, so no rows are copied.
+    # A validated CHECK constraint of its bound lets ATTACH PARTITION skip scanning the table. It is
+    # validated in a transaction of its own, which does not block reads and writes, rather than while
+    # the table is locked for the rename below.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "ALTER TABLE indicatorvalue ADD CONSTRAINT indicatorvalue_legacy_bound "
+            "CHECK (timestamp < '{:%Y-%m-%d}') NOT VALID".format(next_month)
+        )
+        op.execute('ALTER TABLE indicatorvalue VALIDATE CONSTRAINT indicatorvalue_legacy_bound')
+
+    op.rename_table('indicatorvalue', 'indicatorvalue_legacy')
+    op.execute('ALTER INDEX indicatorvalue_timestamp_indicator_id_pkey RENAME TO indicatorvalue_legacy_pkey')
+    op.execute('ALTER INDEX ix_indicatorvalue_indicator_id RENAME TO ix_indicatorvalue_legacy_indicator_id')
+
+    op.create_table('indicatorvalue',
+                    sa.Column('timestamp', sa.DateTime(), nullable=False),
+                    sa.Column('value', sa.Float(), nullable=False),
+                    sa.Column('indicator_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['indicator_id'], ['indicator.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint(
+                        'timestamp', 'indicator_id', name='indicatorvalue_timestamp_indicator_id_pkey'),
+                    postgresql_partition_by='RANGE (timestamp)'
+                    )
+    op.create_index(op.f('ix_indicatorvalue_indicator_id'), 'indicatorvalue', ['indicator_id'], unique=False)
+
+    op.execute(
+        "ALTER TABLE indicatorvalue ATTACH PARTITION indicatorvalue_legacy "
+        "FOR VALUES FROM (MINVALUE) TO ('{:%Y-%m-%d}')".format(next_month)
+    )
+    # Implied by the partition bound now
+    op.execute('ALTER TABLE indicatorvalue_legacy DROP CONSTRAINT indicatorvalue_legacy_bound')
+
+    for partition in partitions.missing_partitions(partitions.get_partitions(op.get_bind()), now):
+        op.execute(partitions.create_partition_sql(partition))
+
+
+def downgrade():
+    op.create_table('indicatorvalue_plain',
+                    sa.Column('timestamp', sa.DateTime(), nullable=False),
+                    sa.Column('value', sa.Float(), nullable=False),
+                    sa.Column('indicator_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['indicator_id'], ['indicator.id'], ondelete='CASCADE'),
+                    )
+    op.execute('INSERT INTO indicatorvalue_plain SELECT timestamp, value, indicator_id FROM indicatorvalue')
+
+    # Drops all partitions as well
+    op.drop_table('indicatorvalue')
+
+    op.rename_table('indicatorvalue_plain', 'indicatorvalue')
+    op.create_primary_key('indicatorvalue_timestamp_indicator_id_pkey', 'indicatorvalue', ['timestamp', 'indicator_id'])
+    op.create_index(op.f('ix_indicatorvalue_indicator_id'), 'indicatorvalue', ['indicator_id'], unique=False)
@@ -54,6 +54,8 @@ def get_target_healthiness(target, aggregate, metric):
             for iv in aggregate.indicator_values
             if iv.value > target_to or iv.value < target_from
         )
+    elif aggregate.count_breaches is not None:
+        target_data["breaches"] = aggregate.count_breaches(target_from, target_to)
 
     target_data["unit"] = target.indicator.unit
 
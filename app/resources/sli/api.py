@@ -11,7 +11,7 @@ from opentracing_utils import (
     trace,
 )
 
-from app.config import API_DEFAULT_PAGE_SIZE
+from app.config import API_DEFAULT_PAGE_SIZE, MAX_RETENTION_DAYS
 from app.extensions import db
 from app.libs.authorization import Authorization
 from app.libs.resource import ResourceHandler
@@ -140,6 +140,10 @@ class SLIResource(ResourceHandler):
         # extra fields
         resource['product_name'] = obj.product.name
 
+        watermark = obj.watermark
+        resource['last_ingested_timestamp'] = watermark.last_timestamp if watermark else None
+        resource['last_ingestion_success'] = watermark.last_success if watermark else None
+
         # Links
         base_uri = resource['uri'] + '/'
 
@@ -179,9 +183,12 @@ class SLIValueResource(ResourceHandler):
             page = int(kwargs.get("page") or 1)
 
         source = sources.from_indicator(indicator)
-        indicator_values, metadata = source.get_indicator_values(
-            timerange, page=page, per_page=per_page,
-        )
+        try:
+            indicator_values, metadata = source.get_indicator_values(
+                timerange, page=page, per_page=per_page,
+            )
+        except sources.SourceUnavailableError as e:
+            raise ProblemException(status=503, title="SLI source unavailable", detail=str(e))
         resources = [
             {k: v for k, v in iv.as_dict().items() if k in cls.model_fields}
             for iv in indicator_values
@@ -240,6 +247,13 @@ class SLIQueryResource(ResourceHandler):
                 detail="Query 'start' must be greater than 'end'",
             )
 
+        # Older values are expired, their partitions may be dropped
+        if start > int(MAX_RETENTION_DAYS) * 24 * 60:
+            raise ProblemException(
+                title='Invalid query duration',
+                detail="Query 'start' must be within the retention of {} days".format(MAX_RETENTION_DAYS),
+            )
+
     def get_object(self, obj_id: int, **kwargs) -> Indicator:
         return self.get_query(**kwargs).filter_by(id=obj_id).first_or_404()
 
@@ -252,9 +266,12 @@ class SLIQueryResource(ResourceHandler):
         self.current_span.log_kv({'query_start': start, 'query_end': end})
 
         # Query and insert IndicatorValue
-        return sources.from_indicator(obj).update_indicator_values(
-            sources.RelativeMinutesRange(start=start, end=end)
-        )
+        try:
+            return sources.from_indicator(obj).update_indicator_values(
+                sources.RelativeMinutesRange(start=start, end=end)
+            )
+        except sources.SourceUnavailableError as e:
+            raise ProblemException(status=503, title="SLI source unavailable", detail=str(e))
 
     def build_resource(self, obj: IndicatorValueLike, count=0, **kwargs) -> dict:
         resource = super().build_resource(obj, **kwargs)
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import re
+from typing import List
+
+from flask import Flask
+
+try:
+    import aiohttp
+    import asyncpg
+except ImportError:  # pragma: no cover
+    aiohttp = asyncpg = None
+
+from app.config import (
+    KAIROSDB_POOL_SIZE,
+    SQLALCHEMY_DATABASE_URI,
+    UPDATER_FETCH_CONCURRENCY,
+    UPDATER_WRITE_CONCURRENCY,
+)
+
+from app.extensions import updater_session
+
+from . import sources
+from .sources.spool import is_db_unavailable
+from .updater import get_source_batches, update_sources
+
+logger = logging.getLogger(__name__)
+
+
+def update_all_indicators_async(app: Flask):
+    """
+    Update all indicators on an asyncio event loop.
+
+    Upstream queries use aiohttp and values are upserted with asyncpg. Fetches and DB writes
+    have separate concurrency limits (``UPDATER_FETCH_CONCURRENCY``, ``UPDATER_WRITE_CONCURRENCY``).
+    Sources without async support are updated with the blocking implementation in the
+    loop's thread pool.
+    """
+    if aiohttp is None or asyncpg is None:
+        raise RuntimeError("The asyncio updater engine requires aiohttp and asyncpg!")
+
+    try:
+        batches = get_source_batches()
+    finally:
+        updater_session.remove()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_update_all(app, batches))
+    finally:
+        loop.close()
+
+
+def _asyncpg_dsn(uri: str) -> str:
+    # asyncpg does not understand SQLAlchemy driver suffixes, e.g. postgresql+psycopg2://
+    return re.sub(r'^postgres(ql)?(\+\w+)?://', 'postgresql://', uri)
+
+
+async def _update_all(app: Flask, batches: List[List[sources.Source]]):
+    fetch_semaphore = asyncio.Semaphore(UPDATER_FETCH_CONCURRENCY)
+
+    pool = await asyncpg.create_pool(
+        _asyncpg_dsn(SQLALCHEMY_DATABASE_URI), min_size=1, max_size=UPDATER_WRITE_CONCURRENCY
+    )
+    try:
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=KAIROSDB_POOL_SIZE)
+        ) as http:
+            await asyncio.gather(
+                *[_update_batch(app, batch, http, pool, fetch_semaphore) for batch in batches]
+            )
+    finally:
+        await pool.close()
+
+
+async def _update_batch(app: Flask, batch: List[sources.Source], http, pool, fetch_semaphore):
+    source_cls = type(batch[0])
+
+    if not source_cls.supports_async:
+        async with fetch_semaphore:
+            await asyncio.get_running_loop().run_in_executor(None, update_sources, app, batch)
+        return
+
+    try:
+        async with fetch_semaphore:
+            results = await source_cls.fetch_batch_indicator_values_async(batch, http)
+    except sources.SourceUnavailableError as e:
+        logger.warning(
+            "Updater: Skipped indicators {}: {}".format(
+                [source.indicator.name for source in batch], e
+            )
+        )
+        return
+    except Exception:
+        logger.exception(
+            "Updater: Failed to query values for indicators {}".format(
+                [source.indicator.name for source in batch]
+            )
+        )
+        return
+
+    for source, result in zip(batch, results):
+        indicator = source.indicator
+        try:
+            async with pool.acquire() as conn:
+                count = await source.store_indicator_values_async(conn, result)
+            logger.info(
+                'Updater: Updated {} indicator values "{}" for product "{}"'.format(
+                    count, indicator.name, indicator.product_name
+                )
+            )
+        except Exception as e:
+            if source.spool is not None and is_db_unavailable(e):
+                source.spool.append(indicator.id, result)
+                continue
+
+            logger.exception(
+                'Updater: Failed to update indicator "{}" values for product "{}"'.format(
+                    indicator.name, indicator.product_name
+                )
+            )
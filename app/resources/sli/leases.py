@@ -0,0 +1,116 @@
+import os
+import socket
+import uuid
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from app.config import UPDATER_LEASE_TTL
+from app.extensions import updater_session
+
+_SYNC_SQL = text("""
+INSERT INTO updater_lease (unit, due_at, failures, seen_at)
+SELECT u.unit, now() + u.delay * interval '1 second', 0, now()
+FROM unnest(CAST(:units AS text[]), CAST(:delays AS float8[])) AS u(unit, delay)
+ON CONFLICT (unit) DO UPDATE SET seen_at = now()
+WHERE updater_lease.seen_at < now() - :ttl / 2 * interval '1 second'
+""")
+
+# Units no replica has seen for a whole TTL, a replica with an older view of the indicators
+# must not drop (and thereby reschedule) units just added by another one
+_PRUNE_SQL = text("""
+DELETE FROM updater_lease
+WHERE unit <> ALL(CAST(:units AS text[]))
+    AND seen_at < now() - :ttl * interval '1 second'
+    AND (owner IS NULL OR expires_at < now())
+""")
+
+_CLAIM_SQL = text("""
+UPDATE updater_lease
+SET owner = :owner, expires_at = now() + :ttl * interval '1 second'
+WHERE unit IN (
+    SELECT unit FROM updater_lease
+    WHERE unit = ANY(CAST(:units AS text[]))
+        AND due_at <= now()
+        AND (owner IS NULL OR expires_at < now())
+    ORDER BY due_at
+    LIMIT :limit
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING unit, failures
+""")
+
+_RENEW_SQL = text("""
+UPDATE updater_lease
+SET expires_at = now() + :ttl * interval '1 second'
+WHERE owner = :owner AND unit = ANY(CAST(:units AS text[]))
+""")
+
+_RELEASE_SQL = text("""
+UPDATE updater_lease
+SET owner = NULL, expires_at = NULL, due_at = now() + :delay * interval '1 second', failures = :failures
+WHERE unit = :unit AND owner = :owner
+""")
+
+
+def default_owner() -> str:
+    return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class LeaseStore:
+    """
+    Work unit leases shared by updater replicas through the ``updater_lease`` table.
+
+    Replicas claim due units with ``FOR UPDATE SKIP LOCKED``, so every unit is updated by
+    one replica at a time and replicas never wait for each other. A lease expires after
+    ``UPDATER_LEASE_TTL`` seconds unless renewed, so units of a dead replica are picked up by
+    the others. Due times and failure counts live in the table as well, thus the schedule
+    survives restarts and is shared by all replicas.
+
+    Note: All methods commit the current ``updater_session``.
+    """
+
+    def __init__(self, owner: str = None, ttl: int = UPDATER_LEASE_TTL):
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+
+    def sync(self, delays: Dict[str, float]) -> None:
+        """
+        Add missing units, first due after the given delays, and drop units which no replica
+        has seen for ``ttl`` seconds.
+        """
+        units = list(delays)
+        if units:
+            updater_session.execute(
+                _SYNC_SQL,
+                {'units': units, 'delays': [float(delays[unit]) for unit in units], 'ttl': self.ttl},
+            )
+        updater_session.execute(_PRUNE_SQL, {'units': units, 'ttl': self.ttl})
+        updater_session.commit()
+
+    def claim(self, units: List[str], limit: int) -> List[Tuple[str, int]]:
+        """Lease up to ``limit`` due units, returns the units with their failure counts."""
+        if not units or limit <= 0:
+            return []
+
+        rows = updater_session.execute(
+            _CLAIM_SQL, {'owner': self.owner, 'ttl': self.ttl, 'units': units, 'limit': limit}
+        ).fetchall()
+        updater_session.commit()
+
+        return [(row.unit, row.failures) for row in rows]
+
+    def renew(self, units: List[str]) -> None:
+        if not units:
+            return
+
+        updater_session.execute(_RENEW_SQL, {'owner': self.owner, 'ttl': self.ttl, 'units': units})
+        updater_session.commit()
+
+    def release(self, unit: str, delay: float, failures: int) -> None:
+        """Give up the lease, the unit is due again after ``delay`` seconds."""
+        updater_session.execute(
+            _RELEASE_SQL,
+            {'owner': self.owner, 'unit': unit, 'delay': float(delay), 'failures': failures},
+        )
+        updater_session.commit()
@@ -1,4 +1,6 @@
+import dataclasses
 from datetime import datetime
+from typing import Dict, Optional
 
 from sqlalchemy import false
 
@@ -28,6 +30,9 @@ class Indicator(db.Model):
     values = db.relationship(
         'IndicatorValue', backref='indicator', lazy='dynamic', passive_deletes=True
     )
+    watermark = db.relationship(
+        'IndicatorWatermark', uselist=False, lazy='joined', passive_deletes=True
+    )
 
     username = db.Column(db.String(120), default='')
     created = db.Column(db.DateTime(), default=datetime.utcnow)
@@ -46,3 +51,64 @@ class Indicator(db.Model):
 
     def __repr__(self):
         return '<SLI {} | {} | {}>'.format(self.product.name, self.name, self.source)
+
+
+class IndicatorWatermark(db.Model):
+    """Ingestion progress of an indicator, updated with every stored batch of values."""
+
+    indicator_id = db.Column(
+        db.Integer(), db.ForeignKey('indicator.id', ondelete='CASCADE'), primary_key=True
+    )
+
+    # Newest minute stored for the indicator (NULL if none was stored yet)
+    last_timestamp = db.Column(db.DateTime())
+    # Last time the updater successfully stored values for the indicator
+    last_success = db.Column(db.DateTime(), nullable=False)
+
+    def __repr__(self):
+        return '<SLI watermark {} | {}>'.format(self.indicator_id, self.last_timestamp)
+
+
+@dataclasses.dataclass(frozen=True)
+class WatermarkRow:
+    last_timestamp: Optional[datetime]
+    last_success: datetime
+
+
+@dataclasses.dataclass(frozen=True)
+class IndicatorRow:
+    """
+    Read-only projection of an active indicator, as loaded by the updater.
+
+    Provides what sources and the updater need from an ``Indicator`` without being bound to
+    a session.
+    """
+
+    id: int
+    name: str
+    source: Dict
+    aggregation: Optional[str]
+    product_name: str
+    watermark: Optional[WatermarkRow] = None
+
+
+class UpdaterLease(db.Model):
+    """
+    Work unit of the staggered updater (an indicator or indicators sharing a query), leased by
+    one updater replica at a time.
+    """
+
+    unit = db.Column(db.String(200), primary_key=True)
+
+    # Replica holding the lease, which is free once ``expires_at`` passed
+    owner = db.Column(db.String(200))
+    expires_at = db.Column(db.DateTime(timezone=True))
+
+    due_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    failures = db.Column(db.Integer(), nullable=False, default=0, server_default='0')
+
+    # Last sync of a replica still configured with the unit, which is pruned once no replica was for a while
+    seen_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    def __repr__(self):
+        return '<Updater lease {} | {}>'.format(self.unit, self.owner)
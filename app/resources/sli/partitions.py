@@ -0,0 +1,210 @@
+"""
+Monthly range partitions of ``indicatorvalue`` (PostgreSQL 11+).
+
+Partitions are created ahead of time (``INDICATORVALUE_PARTITIONS_AHEAD`` months), and
+retention detaches and drops whole partitions once all of their values expired, instead of
+deleting rows. Values are thus kept up to a month longer than ``MAX_RETENTION_DAYS``.
+
+There is no DEFAULT partition: creating a partition would have to scan it, and fail if it held
+values of the new partition's range. Values outside the partitions (``writable_range``) are
+dropped before they are written instead. Partitions are created and dropped by one process at a
+time (updater replicas and the cleanup), others skip their maintenance meanwhile.
+"""
+import dataclasses
+import datetime
+import logging
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gevent
+from sqlalchemy import text
+
+from app.config import INDICATORVALUE_PARTITIONS_AHEAD, MAX_RETENTION_DAYS
+from app.extensions import updater_session
+
+logger = logging.getLogger(__name__)
+
+TABLE = 'indicatorvalue'
+
+# Seconds between checks of the updater for missing partitions
+_MAINTENANCE_INTERVAL = 3600
+
+_PARTITIONS_SQL = text("""
+SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+WHERE i.inhparent = CAST(:table AS regclass)
+""")
+
+# Key space of the advisory lock of partition DDL
+_LOCK_SPACE = 20252
+_TRY_LOCK_SQL = text('SELECT pg_try_advisory_xact_lock({}, 0)'.format(_LOCK_SPACE))
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+@dataclasses.dataclass(frozen=True)
+class Partition:
+    name: str
+    # ``None`` is MINVALUE and MAXVALUE respectively
+    start: Optional[datetime.datetime]
+    end: Optional[datetime.datetime]
+
+    def overlaps(self, start: datetime.datetime, end: datetime.datetime) -> bool:
+        return (self.start is None or self.start < end) and (self.end is None or start < self.end)
+
+
+def _parse_bound(bound: str) -> Optional[datetime.datetime]:
+    if bound in ('MINVALUE', 'MAXVALUE'):
+        return None
+
+    return datetime.datetime.strptime(bound.strip("'"), '%Y-%m-%d %H:%M:%S')
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(dt: datetime.datetime, months: int) -> datetime.datetime:
+    month = dt.month - 1 + months
+    return dt.replace(year=dt.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start: datetime.datetime) -> str:
+    return '{}_y{:04d}m{:02d}'.format(TABLE, start.year, start.month)
+
+
+def get_partitions(session) -> List[Partition]:
+    partitions = []
+
+    for name, bound in session.execute(_PARTITIONS_SQL, {'table': TABLE}):
+        match = _BOUND_RE.search(bound)
+        if match is not None:
+            partitions.append(
+                Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2)))
+            )
+
+    return sorted(partitions, key=lambda p: p.start or datetime.datetime.min)
+
+
+def missing_partitions(
+    partitions: List[Partition],
+    now: datetime.datetime,
+    ahead: int = INDICATORVALUE_PARTITIONS_AHEAD,
+    retention_days: int = int(MAX_RETENTION_DAYS),
+) -> List[Partition]:
+    """Monthly partitions from the retention horizon until ``ahead`` months after ``now`` which don't exist yet."""
+    start = month_start(now - datetime.timedelta(days=retention_days))
+    last = add_months(month_start(now), ahead)
+    missing = []
+
+    while start <= last:
+        end = add_months(start, 1)
+        # E.g. the former unpartitioned table, attached for the range before the first month
+        if not any(p.overlaps(start, end) for p in partitions):
+            missing.append(Partition(partition_name(start), start, end))
+        start = end
+
+    return missing
+
+
+def writable_range(now: Optional[datetime.datetime] = None) -> Tuple[datetime.datetime, datetime.datetime]:
+    """
+    Timestamps with a partition to write values into: from the retention horizon, older partitions may
+    be dropped, until the partitions created ahead end.
+    """
+    now = now or datetime.datetime.utcnow()
+
+    return (
+        now - datetime.timedelta(days=int(MAX_RETENTION_DAYS)),
+        add_months(month_start(now), max(INDICATORVALUE_PARTITIONS_AHEAD, 1)),
+    )
+
+
+def writable_values(values: Dict[datetime.datetime, float], now: Optional[datetime.datetime] = None) -> Dict:
+    """The ``values`` within ``writable_range``."""
+    start, end = writable_range(now)
+
+    return {timestamp: value for timestamp, value in values.items() if start <= timestamp < end}
+
+
+def _try_lock(session) -> bool:
+    """Lock partition DDL until the transaction ends, unless another process holds the lock."""
+    return bool(session.execute(_TRY_LOCK_SQL).scalar())
+
+
+def create_partition_sql(partition: Partition) -> str:
+    return "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{:%Y-%m-%d}') TO ('{:%Y-%m-%d}')".format(
+        partition.name, TABLE, partition.start, partition.end
+    )
+
+
+def ensure_partitions(session, now: Optional[datetime.datetime] = None) -> List[str]:
+    """
+    Create missing partitions, returns their names. Nothing is created while another process
+    maintains the partitions.
+
+    Note: Commits the session.
+    """
+    if not _try_lock(session):
+        session.commit()
+        return []
+
+    missing = missing_partitions(get_partitions(session), now or datetime.datetime.utcnow())
+
+    for partition in missing:
+        session.execute(text(create_partition_sql(partition)))
+    session.commit()
+
+    return [partition.name for partition in missing]
+
+
+def drop_expired_partitions(
+    session, cutoff: datetime.datetime, before_drop: Optional[Callable[[Partition], None]] = None
+) -> List[str]:
+    """
+    Detach and drop partitions whose values are all older than ``cutoff``, returns their names.
+    ``before_drop`` is called with every partition before it is dropped, e.g. to compact its values.
+    A partition is kept until the next run while another process maintains the partitions.
+
+    Note: Commits the session, once per partition so locks on ``indicatorvalue`` are short.
+    """
+    dropped = []
+
+    for partition in get_partitions(session):
+        if partition.end is not None and partition.end <= cutoff:
+            if before_drop is not None:
+                before_drop(partition)
+
+            if not _try_lock(session):
+                session.commit()
+                logger.info('Skipped dropping SLI value partition {}, partitions are maintained meanwhile'.format(
+                    partition.name
+                ))
+                continue
+
+            session.execute(text('ALTER TABLE {} DETACH PARTITION {}'.format(TABLE, partition.name)))
+            session.execute(text('DROP TABLE {}'.format(partition.name)))
+            session.commit()
+
+            dropped.append(partition.name)
+
+    return dropped
+
+
+def maintain_partitions() -> None:
+    try:
+        created = ensure_partitions(updater_session)
+        if created:
+            logger.info('Created SLI value partitions: {}'.format(', '.join(created)))
+    except Exception:
+        logger.exception('Failed to create SLI value partitions!')
+    finally:
+        updater_session.remove()
+
+
+def run_partition_maintenance(interval: int = _MAINTENANCE_INTERVAL):
+    """Create partitions ahead of time, while the updater is running."""
+    while True:
+        maintain_partitions()
+        gevent.sleep(interval)
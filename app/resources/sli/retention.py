@@ -1,45 +1,125 @@
 import logging
 from datetime import datetime, timedelta
+from typing import List
 
 from flask import Flask
 
 from app.config import MAX_RETENTION_DAYS
 from app.extensions import db
 
-from . import sources
 from .models import Indicator
+from .partitions import Partition, drop_expired_partitions, ensure_partitions, get_partitions
+from .sources import archive
+from .sources.rollups import delete_expired_rollups, floor, rebuild_rollups
+from .sources.zmon import IndicatorValue, delete_indicator_values
 
 logger = logging.getLogger(__name__)
 
 
 def cleanup_sli(app: Flask):
+    """
+    Purge soft-deleted SLIs. Their values are deleted in batches first, so deleting the SLI does not
+    cascade through all of them in one transaction. An interrupted cleanup continues with the
+    remaining values on the next run, as the SLI is only deleted at the end.
+    """
     with app.app_context():
         try:
             t_start = datetime.utcnow()
-            count = Indicator.query.filter_by(is_deleted=True).delete()
-            db.session.commit()
+            indicator_ids = [
+                row.id for row in db.session.query(Indicator.id).filter_by(is_deleted=True).order_by(Indicator.id)
+            ]
+
+            values = 0
+            for i, indicator_id in enumerate(indicator_ids, 1):
+                deleted = delete_indicator_values(db.session, indicator_id, datetime.min, datetime.max)
+                Indicator.query.filter_by(id=indicator_id, is_deleted=True).delete()
+                db.session.commit()
+
+                values += deleted
+                logger.info(
+                    'Deleted SLI {} ({}/{}) with {} values'.format(indicator_id, i, len(indicator_ids), deleted)
+                )
+
             duration = datetime.utcnow() - t_start
             logger.info(
-                'Deleted SLIs: {} in {} minutes'.format(count, duration.seconds / 60)
+                'Deleted SLIs: {} with {} values in {} minutes'.format(
+                    len(indicator_ids), values, duration.seconds / 60
+                )
             )
         except Exception:
             logger.exception('Failed to cleanup SLIs!')
 
 
+def _indicator_ids():
+    return [row.id for row in db.session.query(Indicator.id).filter_by(is_deleted=False).order_by(Indicator.id)]
+
+
+def _trim_legacy_partition(indicator_ids: List[int], retention: datetime) -> int:
+    """
+    Delete expired values of the former unpartitioned table in batches. It is attached for all values
+    before the month after the migration, and would otherwise keep growing until that month expired.
+    The values are compacted into the rollups first. Returns the number of deleted values.
+    """
+    legacy = [partition for partition in get_partitions(db.session) if partition.start is None]
+    if not legacy:
+        return 0
+
+    # Whole days, rollups are never refreshed from a partially deleted hour or day
+    cutoff = min(floor(retention, 'day'), legacy[0].end)
+    oldest = (
+        db.session.query(db.func.min(IndicatorValue.timestamp)).filter(IndicatorValue.timestamp < cutoff).scalar()
+    )
+    if oldest is None:
+        return 0
+
+    rebuild_rollups(db.session, indicator_ids, oldest, cutoff, drop_missing=False)
+
+    return sum(
+        delete_indicator_values(db.session, indicator_id, datetime.min, cutoff) for indicator_id in indicator_ids
+    )
+
+
 def apply_retention(app: Flask):
+    """
+    Downsample and expire SLI values: minute partitions are compacted into the hourly and daily
+    rollups before they are dropped, then rollups older than their own retention are deleted.
+    Finally, minutes older than ``ARCHIVE_AFTER_DAYS`` are moved into the per-day archive.
+    """
     now = datetime.utcnow()
-    retention = now - timedelta(days=MAX_RETENTION_DAYS)
+    retention = now - timedelta(days=int(MAX_RETENTION_DAYS))
 
     with app.app_context():
         try:
             t_start = datetime.utcnow()
-            count = sources.from_type("zmon").delete_all_indicator_values(
-                sources.DatetimeRange(end=retention)
-            )
+            indicator_ids = _indicator_ids()
+
+            def compact(partition: Partition):
+                # The former unpartitioned table starts with the oldest value
+                start = partition.start or db.session.query(db.func.min(IndicatorValue.timestamp)).scalar()
+                if start is not None:
+                    # Refresh only, archived days of the partition may have expired already
+                    rebuild_rollups(db.session, indicator_ids, start, partition.end, drop_missing=False)
+                logger.info('Compacted SLI value partition {}'.format(partition.name))
+
+            created = ensure_partitions(db.session, now)
+            # Whole partitions only, values of the partition the retention ends in are kept until it expired
+            dropped = drop_expired_partitions(db.session, retention, before_drop=compact)
+            trimmed = _trim_legacy_partition(indicator_ids, retention)
+            rollups = delete_expired_rollups(db.session, indicator_ids, now)
+
+            expired_days = archive.delete_expired_days(db.session, indicator_ids, retention)
+            archived_days = 0
+            horizon = archive.archive_horizon(now)
+            oldest = db.session.query(db.func.min(IndicatorValue.timestamp)).scalar()
+            if horizon is not None and oldest is not None:
+                archived_days = archive.archive_days(db.session, indicator_ids, max(oldest, retention), horizon)
+
             duration = datetime.utcnow() - t_start
             logger.info(
-                'Deleted SLI values: {} in {} minutes'.format(
-                    count, duration.seconds / 60
+                'Dropped SLI value partitions: {} (created: {}), deleted legacy values: {}, deleted rollups: {}, '
+                'archived days: {} (deleted: {}) in {} minutes'.format(
+                    ', '.join(dropped) or '-', ', '.join(created) or '-', trimmed, rollups, archived_days,
+                    expired_days, duration.seconds / 60
                 )
             )
         except Exception:
@@ -48,3 +128,26 @@ def apply_retention(app: Flask):
                     MAX_RETENTION_DAYS, retention
                 )
             )
+
+
+def rebuild_sli_rollups(app: Flask, days: int):
+    """
+    Rebuild the hourly and daily rollups of the last ``days`` days, e.g. after introducing them.
+    Limited to ``MAX_RETENTION_DAYS``, older rollups have no minute values to be rebuilt from.
+    """
+    now = datetime.utcnow()
+    start = now - timedelta(days=min(days, int(MAX_RETENTION_DAYS)))
+
+    with app.app_context():
+        try:
+            t_start = datetime.utcnow()
+            indicator_ids = _indicator_ids()
+            slices = rebuild_rollups(db.session, indicator_ids, start, now)
+            duration = datetime.utcnow() - t_start
+            logger.info(
+                'Rebuilt SLI value rollups: {} SLIs ({} slices) in {} minutes'.format(
+                    len(indicator_ids), slices, duration.seconds / 60
+                )
+            )
+        except Exception:
+            logger.exception('Failed to rebuild SLI value rollups!')
@@ -0,0 +1,223 @@
+import dataclasses
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import gevent
+from flask import Flask
+from gevent.pool import Pool
+
+from app.config import (
+    UPDATER_INTERVAL,
+    UPDATER_JITTER,
+    UPDATER_MAX_BACKOFF,
+    UPDATER_REFRESH_INTERVAL,
+)
+from app.extensions import updater_session
+from app.libs.metrics import UPDATER_CYCLE_SECONDS, indicator_value_rows
+
+from . import sources
+from .leases import LeaseStore
+from .updater import get_source_batches, update_sources, updater_pool
+
+logger = logging.getLogger(__name__)
+
+# Longest sleep between checks for due work, so rescheduled work is never picked up late
+_MAX_SLEEP = 1
+
+
+@dataclasses.dataclass
+class WorkUnit:
+    """An indicator, or a batch of indicators sharing an upstream query, updated together."""
+
+    key: str
+    batch: List[sources.Source]
+    interval: float
+    failures: int = 0
+
+
+def work_unit_key(batch: List[sources.Source]) -> str:
+    batch_key = batch[0].batch_key()
+    if batch_key is None:
+        return 'indicator:{}'.format(batch[0].indicator.id)
+
+    return '{}:{}'.format(type(batch[0]).__name__, batch_key)
+
+
+def work_unit_interval(batch: List[sources.Source]) -> float:
+    return min(source.update_interval or int(UPDATER_INTERVAL) for source in batch)
+
+
+class UpdateScheduler:
+    """
+    Continuously update indicators, each one when it is due.
+
+    Work units are kept in a heap keyed by their next due time. New units are spread evenly
+    over their first interval, every run is rescheduled with a random jitter, and failing
+    units back off exponentially up to ``UPDATER_MAX_BACKOFF``. Thus upstream and database
+    load is spread over time, and a slow unit only delays itself.
+
+    The indicator set (and the watermarks loaded with it) is reloaded every
+    ``UPDATER_REFRESH_INTERVAL`` seconds, which picks up new and deleted indicators.
+
+    With a ``LeaseStore`` the schedule lives in the database instead of the local heap, and
+    several replicas split the work units between them.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        pool: Pool = updater_pool,
+        clock: Callable[[], float] = time.monotonic,
+        leases: Optional[LeaseStore] = None,
+    ):
+        self.app = app
+        self.pool = pool
+        self.clock = clock
+        self.leases = leases
+
+        self._units: Dict[str, WorkUnit] = {}
+        self._running: Dict[str, WorkUnit] = {}
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._rows = indicator_value_rows()
+
+    def refresh(self, batches: List[List[sources.Source]]) -> None:
+        now = self.clock()
+        units = {}
+
+        for batch in batches:
+            key = work_unit_key(batch)
+            interval = work_unit_interval(batch)
+
+            unit = self._units.get(key)
+            if unit is None:
+                unit = WorkUnit(key, batch, interval)
+                if self.leases is None:
+                    self._schedule(key, now + random.uniform(0, interval))
+            else:
+                unit.batch, unit.interval = batch, interval
+
+            units[key] = unit
+
+        # Heap entries of units which are gone are skipped once they are due
+        self._units = units
+
+        if self.leases is not None:
+            # Only used for units which are new to all replicas
+            self.leases.sync(
+                {key: random.uniform(0, unit.interval) for key, unit in units.items()}
+            )
+
+    def next_delay(self, unit: WorkUnit, succeeded: bool) -> float:
+        if succeeded:
+            unit.failures = 0
+            delay = unit.interval
+        else:
+            unit.failures += 1
+            delay = min(unit.interval * 2 ** unit.failures, UPDATER_MAX_BACKOFF)
+
+        return delay * (1 + random.uniform(-UPDATER_JITTER, UPDATER_JITTER))
+
+    def pop_due(self) -> List[WorkUnit]:
+        if self.leases is not None:
+            return self._claim_due()
+
+        now = self.clock()
+        due = []
+
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            unit = self._units.get(key)
+            if unit is not None:
+                due.append(unit)
+
+        return due
+
+    def run(self) -> None:
+        next_refresh = self.clock()
+
+        while True:
+            if self.clock() >= next_refresh:
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception('Updater: Failed to reload indicators!')
+                next_refresh = self.clock() + UPDATER_REFRESH_INTERVAL
+
+            try:
+                due = self.pop_due()
+            except Exception:
+                logger.exception('Updater: Failed to claim work units!')
+                updater_session.rollback()
+                due = []
+
+            for unit in due:
+                self._running[unit.key] = unit
+                self.pool.spawn(self.run_unit, unit)
+
+            # Yields to the unit greenlets, even where ``time`` is not monkey patched
+            gevent.sleep(_MAX_SLEEP)
+
+    def reload(self) -> None:
+        try:
+            self.refresh(get_source_batches())
+
+            if self.leases is not None:
+                self.leases.renew(list(self._running))
+        finally:
+            # Don't keep the reload's transaction (and connection) open until the next one
+            updater_session.remove()
+
+        rows, self._rows = self._rows, indicator_value_rows()
+        logger.info(
+            'Updater: Scheduling {} work units, {} values written and {} unchanged skipped since last reload'.format(
+                len(self._units),
+                self._rows['written'] - rows['written'],
+                self._rows['skipped'] - rows['skipped'],
+            )
+        )
+
+    def run_unit(self, unit: WorkUnit) -> None:
+        succeeded = False
+        t_start = time.monotonic()
+        try:
+            succeeded = update_sources(self.app, unit.batch)
+        except Exception:
+            logger.exception('Updater: Failed to update work unit {}'.format(unit.key))
+        finally:
+            UPDATER_CYCLE_SECONDS.labels('staggered').observe(time.monotonic() - t_start)
+            self._running.pop(unit.key, None)
+            delay = self.next_delay(unit, succeeded)
+
+            if self.leases is not None:
+                self._release(unit, delay)
+            elif self._units.get(unit.key) is unit:
+                # Units removed by a reload while running are dropped
+                self._schedule(unit.key, self.clock() + delay)
+
+    def _claim_due(self) -> List[WorkUnit]:
+        due = []
+
+        for key, failures in self.leases.claim(list(self._units), self.pool.free_count()):
+            unit = self._units[key]
+            unit.failures = failures
+            due.append(unit)
+
+        return due
+
+    def _release(self, unit: WorkUnit, delay: float) -> None:
+        try:
+            with self.app.app_context():
+                self.leases.release(unit.key, delay, unit.failures)
+        except Exception:
+            # The lease expires eventually
+            logger.exception('Updater: Failed to release work unit {}'.format(unit.key))
+        finally:
+            updater_session.remove()
+
+    def _schedule(self, key: str, due: float) -> None:
+        heapq.heappush(self._heap, (due, next(self._seq), key))
@@ -8,6 +8,7 @@ from .base import (
     RelativeMinutesRange,
     Resolution,
     SourceError,
+    SourceUnavailableError,
     TimeRange,
 )
 from .lightstep import Lightstep
@@ -22,6 +23,7 @@ __all__ = [
     "IndicatorValueAggregate",
     "TimeRange",
     "Resolution",
+    "SourceUnavailableError",
 ]
 
 _DEFAULT_SOURCE = "zmon"
@@ -0,0 +1,224 @@
+"""
+Archive of cold minute values: one row per indicator and day instead of one per minute.
+
+A day's values are stored as a ``float8[]`` of 1440 minutes, missing minutes are ``NULL`` (kept in
+the array's null bitmap). This saves the per-row overhead, the tuple header and the index entries of
+every minute, not the values themselves: TOAST rarely compresses float noise. The cleanup job moves
+days older than ``ARCHIVE_AFTER_DAYS`` from ``indicatorvalue`` into ``indicatorvalue_archive``. Readers
+of minute values select from ``minutes_sql``, which returns stored and archived minutes alike. Writing
+into an archived day moves it back first (``restore``), so a minute is never in both tables.
+
+Days are moved in slices of a few days per indicator, so a transaction never locks more than these
+days of an SLI and writes into archived days keep working. The price is deleting the moved rows one
+by one: WAL for every minute and dead tuples until vacuum. The space is reused by the newer minutes of the same
+month's partition, so it stays at about ``ARCHIVE_AFTER_DAYS`` of minutes; only the last days of past
+months leave unused space behind until their partition is dropped.
+
+Moving and restoring the days of an indicator is serialized by a transaction level advisory lock.
+"""
+import collections
+import datetime
+import logging
+import time
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.config import ARCHIVE_AFTER_DAYS, CLEANUP_PAUSE, CLEANUP_SLICE_DAYS
+from app.extensions import db
+
+logger = logging.getLogger(__name__)
+
+_DAY = datetime.timedelta(days=1)
+
+# Key space of the advisory locks, the second key is the indicator
+_LOCK_SPACE = 20251
+
+
+class IndicatorValueArchive(db.Model):
+    __tablename__ = 'indicatorvalue_archive'
+
+    indicator_id = db.Column(
+        db.Integer(), db.ForeignKey('indicator.id', ondelete='CASCADE'), primary_key=True
+    )
+    day = db.Column(db.DateTime(), primary_key=True)
+
+    # Value of every minute of the day, NULL if missing
+    minute_values = db.Column(ARRAY(db.Float()), nullable=False)
+
+
+_MINUTES_SQL = """
+SELECT timestamp, value FROM indicatorvalue
+WHERE indicator_id = {indicator_id} AND timestamp >= {start} AND timestamp < {end}
+UNION ALL
+SELECT archived.timestamp, archived.value FROM (
+    SELECT a.day + (u.i - 1) * interval '1 minute' AS timestamp, u.value
+    FROM indicatorvalue_archive AS a, unnest(a.minute_values) WITH ORDINALITY AS u(value, i)
+    WHERE a.indicator_id = {indicator_id} AND a.day > {start} - interval '1 day' AND a.day < {end}
+) AS archived
+WHERE archived.value IS NOT NULL AND archived.timestamp >= {start} AND archived.timestamp < {end}
+"""
+
+
+def minutes_sql(indicator_id: str, start: str, end: str) -> str:
+    """
+    SQL selecting ``timestamp, value`` of the minutes in ``[start, end)``, stored and archived.
+    The arguments are SQL expressions, e.g. ``CAST(:start AS timestamp)``.
+    """
+    return _MINUTES_SQL.format(indicator_id=indicator_id, start=start, end=end)
+
+
+MINUTES_SQL = text(minutes_sql(':indicator_id', 'CAST(:start AS timestamp)', 'CAST(:end AS timestamp)'))
+
+_LOCK_SQL = 'SELECT pg_advisory_xact_lock({}, {{indicator_id}})'.format(_LOCK_SPACE)
+_LOCK_NAMED_SQL = text(_LOCK_SQL.format(indicator_id='CAST(:indicator_id AS integer)'))
+# asyncpg
+_LOCK_ASYNC_SQL = _LOCK_SQL.format(indicator_id='$1::integer')
+
+_ARCHIVABLE_DAYS_SQL = text("""
+SELECT DISTINCT indicator_id, date_trunc('day', timestamp) FROM indicatorvalue
+WHERE timestamp >= :start AND timestamp < :end
+ORDER BY 1, 2
+""")
+
+_ARCHIVE_DAYS_SQL = text("""
+WITH moved AS (
+    DELETE FROM indicatorvalue
+    WHERE indicator_id = :indicator_id AND timestamp >= :start AND timestamp < :end
+      AND timestamp = date_trunc('minute', timestamp)
+    RETURNING timestamp, value
+), days AS (
+    SELECT DISTINCT date_trunc('day', timestamp) AS day FROM moved
+)
+INSERT INTO indicatorvalue_archive (indicator_id, day, minute_values)
+SELECT CAST(:indicator_id AS integer), days.day, array_agg(moved.value ORDER BY minute.i)
+FROM days
+CROSS JOIN generate_series(0, 1439) AS minute(i)
+LEFT JOIN moved ON moved.timestamp = days.day + minute.i * interval '1 minute'
+GROUP BY days.day
+ON CONFLICT (indicator_id, day) DO UPDATE
+SET minute_values = ARRAY(
+    SELECT coalesce(u.n, u.o)
+    FROM unnest(EXCLUDED.minute_values, indicatorvalue_archive.minute_values) WITH ORDINALITY AS u(n, o, i)
+    ORDER BY u.i
+)
+""")
+
+_RESTORE_SQL = """
+WITH restored AS (
+    DELETE FROM indicatorvalue_archive
+    WHERE indicator_id = {indicator_id} AND day > {start} - interval '1 day' AND day <= {end}
+    RETURNING day, minute_values
+)
+INSERT INTO indicatorvalue (timestamp, value, indicator_id)
+SELECT restored.day + (u.i - 1) * interval '1 minute', u.value, {indicator_id}
+FROM restored, unnest(restored.minute_values) WITH ORDINALITY AS u(value, i)
+WHERE u.value IS NOT NULL
+ON CONFLICT (timestamp, indicator_id) DO NOTHING
+"""
+
+_RESTORE_NAMED_SQL = text(_RESTORE_SQL.format(
+    indicator_id='CAST(:indicator_id AS integer)', start='CAST(:start AS timestamp)', end='CAST(:end AS timestamp)'
+))
+# asyncpg
+_RESTORE_ASYNC_SQL = _RESTORE_SQL.format(indicator_id='$1::integer', start='$2::timestamp', end='$3::timestamp')
+
+_DELETE_EXPIRED_SQL = text("""
+DELETE FROM indicatorvalue_archive
+WHERE indicator_id = :indicator_id AND day <= :cutoff
+""")
+
+
+def archive_horizon(now: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+    """Days before are archived, ``None`` if archiving is disabled."""
+    if not ARCHIVE_AFTER_DAYS:
+        return None
+
+    now = now or datetime.datetime.utcnow()
+    return (now - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def is_archived(start: datetime.datetime, now: Optional[datetime.datetime] = None) -> bool:
+    """Whether minutes from ``start`` on may be archived."""
+    horizon = archive_horizon(now)
+    return horizon is not None and start < horizon
+
+
+def restore(session: db.Session, indicator_id: int, start: datetime.datetime, end: datetime.datetime) -> None:
+    """
+    Move archived days with minutes between ``start`` and ``end`` (inclusive) back into
+    ``indicatorvalue``, before values of these days are upserted. Holds the indicator's archive lock
+    until the transaction ends, so the days are not archived again before the upsert is committed.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    if is_archived(start):
+        session.execute(_LOCK_NAMED_SQL, {'indicator_id': indicator_id})
+        session.execute(_RESTORE_NAMED_SQL, {'indicator_id': indicator_id, 'start': start, 'end': end})
+
+
+async def restore_async(conn, indicator_id: int, start: datetime.datetime, end: datetime.datetime) -> None:
+    """asyncpg variant of ``restore``."""
+    if is_archived(start):
+        await conn.execute(_LOCK_ASYNC_SQL, indicator_id)
+        await conn.execute(_RESTORE_ASYNC_SQL, indicator_id, start, end)
+
+
+def archive_days(
+    session: db.Session,
+    indicator_ids: List[int],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    slice_days: int = CLEANUP_SLICE_DAYS,
+    pause: float = CLEANUP_PAUSE,
+) -> int:
+    """
+    Move the minutes of every indicator's days in ``[start, end)`` into the archive. Days without
+    minutes are looked up once and skipped, the others are moved in slices of up to ``slice_days``
+    days per indicator, each committed on its own. Returns the number of archived days.
+
+    Note: Commits the session.
+    """
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    days = collections.defaultdict(list)
+    for indicator_id, day in session.execute(_ARCHIVABLE_DAYS_SQL, {'start': start, 'end': end}):
+        if day + _DAY <= end:
+            days[indicator_id].append(day)
+    session.commit()
+
+    count = 0
+    for indicator_id in indicator_ids:
+        slice_end = None
+        for day in days.get(indicator_id, []):
+            if slice_end is not None and day < slice_end:
+                continue
+
+            slice_end = min(day + datetime.timedelta(days=slice_days), end)
+            session.execute(_LOCK_NAMED_SQL, {'indicator_id': indicator_id})
+            count += session.execute(
+                _ARCHIVE_DAYS_SQL, {'indicator_id': indicator_id, 'start': day, 'end': slice_end}
+            ).rowcount
+            session.commit()
+
+            time.sleep(pause)
+
+    return count
+
+
+def delete_expired_days(session: db.Session, indicator_ids: List[int], cutoff: datetime.datetime) -> int:
+    """
+    Delete archived days whose minutes are all older than ``cutoff``, per indicator.
+
+    Note: Commits the session.
+    """
+    count = 0
+
+    for indicator_id in indicator_ids:
+        count += session.execute(
+            _DELETE_EXPIRED_SQL, {'indicator_id': indicator_id, 'cutoff': cutoff - _DAY}
+        ).rowcount
+        session.commit()
+
+    return count
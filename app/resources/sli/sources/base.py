@@ -3,13 +3,17 @@ import datetime
 import enum
 import inspect
 from decimal import Decimal
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, Hashable, List, Optional, Tuple, Union
 
 
 class SourceError(Exception):
     pass
 
 
+class SourceUnavailableError(SourceError):
+    """The source's backend is failing, queries are rejected until it recovers."""
+
+
 class TimeRange:
     DEFAULT: "TimeRange"
 
@@ -130,6 +134,11 @@ class IndicatorValueAggregate:
     max: Optional[Decimal] = None
     min: Optional[Decimal] = None
     sum: Optional[Decimal] = None
+    # Counts the minutes outside of a target (from, to), if the aggregate was computed without
+    # loading ``indicator_values``
+    count_breaches: Optional[Callable[[float, float], int]] = dataclasses.field(
+        repr=False, default=None, compare=False
+    )
 
     @classmethod
     def from_indicator_value(cls, indicator_value: IndicatorValueLike):
@@ -144,22 +153,35 @@ class IndicatorValueAggregate:
         values: List[Decimal] = [
             indicator_value.value for indicator_value in indicator_values
         ]
-        sum_ = sum(values)
-        count = len(values)
+
+        return cls.from_summary(
+            timestamp,
+            aggregation,
+            sum(values),
+            len(values),
+            min(values),
+            max(values),
+            indicator_values=indicator_values,
+        )
+
+    @classmethod
+    def from_summary(
+        cls, timestamp: datetime.datetime, aggregation, sum_, count, min_, max_, **kwargs
+    ):
         summary = {
             "sum": sum_,
             "count": count,
             "avg": sum_ / count,
-            "max": max(values),
-            "min": min(values),
+            "max": max_,
+            "min": min_,
         }
 
         aggregate = cls(
             timestamp=timestamp,
             aggregation=aggregation,
             aggregate=summary[aggregation],
-            indicator_values=indicator_values,
             **summary,  # type: ignore
+            **kwargs,
         )
 
         return aggregate
@@ -168,6 +190,7 @@ class IndicatorValueAggregate:
         dict_ = dataclasses.asdict(self)
         del dict_['indicator_values']
         del dict_['timestamp']
+        del dict_['count_breaches']
 
         return dict_
 
@@ -179,6 +202,21 @@ class Pagination(object):
 
 
 class Source:
+    # Whether the source implements the ``*_async`` methods used by the asyncio updater
+    supports_async = False
+
+    # Seconds between updates of the indicator when using the staggered scheduler, ``None``
+    # means ``UPDATER_INTERVAL``
+    update_interval: Optional[int] = None
+
+    # Scoped session storing the indicator values, ``None`` means ``db.session``. The updater
+    # sets its own, see ``app.extensions.updater_session``
+    session = None
+
+    # Spool taking values which could not be stored as the database is unavailable, ``None``
+    # raises instead. Only set by the updater, see ``spool.get_spool``
+    spool = None
+
     @classmethod
     def __init_subclass__(cls):
         param_names = inspect.signature(cls.__init__).parameters.keys()
@@ -198,10 +236,6 @@ class Source:
     def validate_config(cls, config: Dict):
         raise NotImplementedError
 
-    @classmethod
-    def delete_all_indicator_values(cls, timerange: TimeRange) -> int:
-        raise NotImplementedError
-
     def __init__(self, indicator, **kwargs):
         self.indicator = indicator
 
@@ -221,3 +255,25 @@ class Source:
 
     def update_indicator_values(self, timerange: TimeRange = TimeRange.DEFAULT) -> int:
         raise NotImplementedError
+
+    def batch_key(self) -> Optional[Hashable]:
+        """
+        Sources of the same type returning the same key can be fetched together with
+        ``fetch_batch_indicator_values``. ``None`` means the source is updated on its own.
+        """
+        return None
+
+    @classmethod
+    def fetch_batch_indicator_values(cls, batch: List["Source"]) -> List[Dict]:
+        raise NotImplementedError
+
+    def store_indicator_values(self, result: Dict) -> int:
+        raise NotImplementedError
+
+    @classmethod
+    async def fetch_batch_indicator_values_async(cls, batch: List["Source"], http) -> List[Dict]:
+        """Same as ``fetch_batch_indicator_values``, using the updater's aiohttp session."""
+        raise NotImplementedError
+
+    async def store_indicator_values_async(self, conn, result: Dict) -> int:
+        raise NotImplementedError
@@ -0,0 +1,211 @@
+"""
+Protection of upstream backends (KairosDB hosts, the Lightstep API) and of the updater against them.
+
+Every backend has a ``Guard``: a circuit breaker, a cap on concurrent queries and a token bucket
+limiting the query rate. Once a backend keeps failing, its queries are rejected right away instead
+of tying up updater greenlets (and their database connections) until they time out.
+"""
+import time
+from typing import Callable, Dict, Optional
+
+import gevent
+import requests
+from gevent.lock import BoundedSemaphore
+
+from app.config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    SOURCE_CONCURRENCY,
+    SOURCE_RATE_BURST,
+    SOURCE_RATE_LIMIT,
+)
+from app.libs.metrics import SOURCE_CIRCUIT_STATE, SOURCE_REJECTED_QUERIES
+
+from .base import SourceUnavailableError
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def is_backend_failure(error: Exception) -> bool:
+    """Server errors, rate limiting, timeouts and connection errors, not errors of the query itself."""
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 500
+        return status >= 500 or status == 429
+
+    return isinstance(error, requests.RequestException)
+
+
+class CircuitBreaker:
+    """
+    Opens after ``failure_threshold`` consecutive failures and rejects all queries for
+    ``reset_timeout`` seconds. Then a single probe is let through (half-open): its success
+    closes the circuit, its failure opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        SOURCE_CIRCUIT_STATE.labels(name).set(_STATE_VALUES[CLOSED])
+
+    def check(self) -> None:
+        """Raise ``SourceUnavailableError`` if a query would be rejected, without taking the probe."""
+        if self.state == OPEN and self.clock() - self.opened_at < self.reset_timeout:
+            self._reject()
+        if self.state == HALF_OPEN and self._probing:
+            self._reject()
+
+    def before_query(self) -> None:
+        self.check()
+
+        if self.state == OPEN:
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            self._probing = True
+
+    def on_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        self._set_state(CLOSED)
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+            self._set_state(OPEN)
+
+    def _reject(self):
+        SOURCE_REJECTED_QUERIES.labels(self.name).inc()
+        raise SourceUnavailableError(
+            'Backend {} is unavailable after {} consecutive failures, not querying it for now'.format(
+                self.name, self.failures
+            )
+        )
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        SOURCE_CIRCUIT_STATE.labels(self.name).set(_STATE_VALUES[state])
+
+
+class TokenBucket:
+    """Allows ``rate`` queries per second on average, and bursts of up to ``burst`` queries."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = gevent.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def acquire(self) -> None:
+        while True:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            self.sleep((1 - self.tokens) / self.rate)
+
+
+class Guard:
+    """Runs the queries of a backend through its circuit breaker, concurrency cap and rate limit."""
+
+    def __init__(
+        self,
+        name: str,
+        concurrency: int = SOURCE_CONCURRENCY,
+        rate: float = SOURCE_RATE_LIMIT,
+        burst: int = SOURCE_RATE_BURST,
+        is_failure: Callable[[Exception], bool] = is_backend_failure,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        self.breaker = breaker or CircuitBreaker(name)
+        self.slots = BoundedSemaphore(concurrency)
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+
+    def call(self, func: Callable, *args, **kwargs):
+        # Don't wait for a slot only to be rejected then
+        self.breaker.check()
+
+        with self.slots:
+            if self.bucket is not None:
+                self.bucket.acquire()
+
+            # The circuit may have opened while waiting
+            self.breaker.before_query()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self._record(e)
+                raise
+
+        self.breaker.on_success()
+        return result
+
+    async def call_async(self, func: Callable, *args, **kwargs):
+        """
+        Same as ``call`` for coroutine functions, without the concurrency cap and rate limit
+        (the asyncio updater has its own limits).
+        """
+        self.breaker.before_query()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self._record(e)
+            raise
+
+        self.breaker.on_success()
+        return result
+
+    def _record(self, error: Exception) -> None:
+        if self.is_failure(error):
+            self.breaker.on_failure()
+        else:
+            # The backend answered, the query itself was wrong
+            self.breaker.on_success()
+
+
+_guards: Dict[str, Guard] = {}
+
+
+def get_guard(name: str, is_failure: Callable[[Exception], bool] = is_backend_failure) -> Guard:
+    """The process-wide guard of a backend, shared by all sources querying it."""
+    guard = _guards.get(name)
+    if guard is None:
+        guard = _guards[name] = Guard(name, is_failure=is_failure)
+    elif guard.is_failure is not is_failure:
+        raise ValueError('Guard {} already exists with another failure check'.format(name))
+
+    return guard
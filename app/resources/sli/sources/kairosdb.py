@@ -0,0 +1,424 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import gevent
+import requests
+import urllib3
+import zign.api
+from gevent.pool import Pool
+from requests.adapters import HTTPAdapter
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+from app.config import (
+    KAIROSDB_MIN_QUERY_SLICE,
+    KAIROSDB_POOL_SIZE,
+    KAIROSDB_QUERY_RETRIES,
+    KAIROSDB_QUERY_SLICE,
+    KAIROSDB_SLICE_CONCURRENCY,
+    KAIROSDB_TOKEN_TTL,
+    KAIROSDB_URL,
+)
+from app.libs.metrics import KAIROSDB_QUERY_SECONDS, KAIROSDB_RESPONSE_BYTES
+
+from . import guard
+
+logger = logging.getLogger(__name__)
+
+_QUERY_TIMEOUT = 55
+
+_MINUTE_MS = 60000
+
+# Seconds to wait before retrying a failed slice, doubled with every split or retry
+_RETRY_BACKOFF = 1
+
+# Refresh tokens a bit before they are assumed to expire
+_TOKEN_REFRESH_MARGIN = 60
+
+_RESULT_PREFIX = 'queries.item.results.item'
+
+# A result group: its ``group_by`` list and an iterator over its ``[timestamp, value]`` points
+ResultGroup = Tuple[List[Dict], Iterator[List]]
+
+
+class TokenCache:
+    """In-memory cache of a zign token, refreshed shortly before its assumed expiry."""
+
+    def __init__(self, name: str, scopes: List[str], ttl: int = KAIROSDB_TOKEN_TTL):
+        self.name = name
+        self.scopes = scopes
+        self.ttl = ttl
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        if self._token and time.monotonic() < self._expires_at - _TOKEN_REFRESH_MARGIN:
+            return self._token
+
+        with self._lock:
+            # Another greenlet may have refreshed the token while we were waiting
+            if not self._token or time.monotonic() >= self._expires_at - _TOKEN_REFRESH_MARGIN:
+                self._token = zign.api.get_token(self.name, self.scopes)
+                self._expires_at = time.monotonic() + self.ttl
+
+        return self._token
+
+    def invalidate(self) -> None:
+        self._token = None
+
+
+class KairosDBClient:
+    """
+    KairosDB HTTP client with a keep-alive connection pool.
+
+    One instance is shared by the updater greenlets and the API (see ``get_client``), so
+    connections and tokens are reused across indicators and cycles. Every request goes
+    through the host's ``guard``.
+    """
+
+    def __init__(self, url: str, pool_size: int = KAIROSDB_POOL_SIZE):
+        self.url = url
+        self.tokens = TokenCache('zmon', ['uid'])
+        self.guard = get_guard(url)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def query(self, q: Dict) -> Iterator[ResultGroup]:
+        """
+        Run a datapoints query and return its result groups as they are parsed.
+
+        Each group's points must be consumed before advancing to the next group.
+        """
+        t_start = time.monotonic()
+        response = self.session.post(
+            self.url + '/api/v1/datapoints/query',
+            json=q,
+            headers={'Authorization': 'Bearer {}'.format(self.tokens.get())},
+            timeout=_QUERY_TIMEOUT,
+            stream=True,
+        )
+        if response.status_code == 401:
+            self.tokens.invalidate()
+
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            KAIROSDB_QUERY_SECONDS.labels('error').observe(time.monotonic() - t_start)
+            raise
+
+        return _iter_response(response, t_start)
+
+    def query_sliced(
+        self, q: Dict, consume: Callable[[Iterator[ResultGroup]], None],
+        slice_minutes: int = KAIROSDB_QUERY_SLICE,
+    ) -> None:
+        """
+        Run a query over its ``start_absolute``/``end_absolute`` window in minute aligned
+        slices, passing each slice's result groups to ``consume``.
+
+        Slices run concurrently (``KAIROSDB_SLICE_CONCURRENCY``). A slice failing with a
+        server error, timeout or broken stream is halved and retried after a backoff until
+        it reaches ``KAIROSDB_MIN_QUERY_SLICE`` minutes, then retried as is up to
+        ``KAIROSDB_QUERY_RETRIES`` times. ``consume`` may see a slice more than once, so it
+        must be idempotent.
+
+        Every request of a slice goes through the host's ``guard``, so its circuit breaker
+        counts failed requests, not failed queries.
+        """
+        pending = _initial_slices(q, slice_minutes)
+        pool = Pool(KAIROSDB_SLICE_CONCURRENCY)
+        rounds = 0
+
+        while pending:
+            if rounds:
+                gevent.sleep(_RETRY_BACKOFF * 2 ** (rounds - 1))
+            rounds += 1
+
+            errors = pool.map(self._try_slice(q, consume), pending)
+            pending = _retry_slices(pending, errors)
+
+    def _try_slice(self, q: Dict, consume: Callable[[Iterator[ResultGroup]], None]):
+        def run(slice_: Tuple[int, int, int]) -> Optional[Exception]:
+            start, end, _ = slice_
+            try:
+                self.guard.call(
+                    lambda: consume(self.query(dict(q, start_absolute=start, end_absolute=end - 1)))
+                )
+            except Exception as e:
+                if not _is_retriable(e):
+                    raise
+                return e
+
+            return None
+
+        return run
+
+
+class AsyncKairosDBClient:
+    """
+    asyncio counterpart of ``KairosDBClient``, used by the asyncio updater.
+
+    Requests go through the given aiohttp session, which owns the connection pool. Tokens
+    are shared with the process-wide client. Responses are parsed while they are received,
+    like the blocking client's.
+    """
+
+    def __init__(self, session: "aiohttp.ClientSession", url: str = KAIROSDB_URL):
+        self.url = url
+        self.tokens = get_client().tokens
+        self.guard = get_guard(url)
+        self.session = session
+
+    async def query(self, q: Dict, consume: Callable[[Iterator[ResultGroup]], None]) -> None:
+        """
+        Run a datapoints query and pass its result groups to ``consume`` one by one, as they
+        are received. Only the group being parsed is held in memory.
+        """
+        loop = asyncio.get_running_loop()
+        t_start = time.monotonic()
+        # zign may block while refreshing the token
+        token = await loop.run_in_executor(None, self.tokens.get)
+
+        async with self.session.post(
+            self.url + '/api/v1/datapoints/query',
+            json=q,
+            headers={'Authorization': 'Bearer {}'.format(token)},
+            timeout=aiohttp.ClientTimeout(total=_QUERY_TIMEOUT),
+        ) as response:
+            if response.status == 401:
+                self.tokens.invalidate()
+
+            size = 0
+            try:
+                response.raise_for_status()
+
+                if ijson is None:
+                    body = await response.read()
+                    size = len(body)
+                    consume(iter_json_result_groups(json.loads(body)))
+                else:
+                    results = ijson.sendable_list()
+                    parser = ijson.items_coro(results, _RESULT_PREFIX, use_float=True)
+                    async for chunk in response.content.iter_any():
+                        size += len(chunk)
+                        parser.send(chunk)
+                        for result in results:
+                            consume(iter([(result.get('group_by', []), iter(result.get('values', [])))]))
+                        del results[:]
+                    parser.close()
+            except Exception:
+                KAIROSDB_QUERY_SECONDS.labels('error').observe(time.monotonic() - t_start)
+                raise
+
+        KAIROSDB_QUERY_SECONDS.labels('ok').observe(time.monotonic() - t_start)
+        KAIROSDB_RESPONSE_BYTES.observe(size)
+
+    async def query_sliced(
+        self, q: Dict, consume: Callable[[Iterator[ResultGroup]], None],
+        slice_minutes: int = KAIROSDB_QUERY_SLICE,
+    ) -> None:
+        """Same as ``KairosDBClient.query_sliced``."""
+        pending = _initial_slices(q, slice_minutes)
+        semaphore = asyncio.Semaphore(KAIROSDB_SLICE_CONCURRENCY)
+        rounds = 0
+
+        async def run(slice_: Tuple[int, int, int]) -> Optional[Exception]:
+            start, end, _ = slice_
+            try:
+                async with semaphore:
+                    await self.guard.call_async(
+                        self.query, dict(q, start_absolute=start, end_absolute=end - 1), consume
+                    )
+            except Exception as e:
+                if not _is_retriable(e):
+                    raise
+                return e
+
+            return None
+
+        while pending:
+            if rounds:
+                await asyncio.sleep(_RETRY_BACKOFF * 2 ** (rounds - 1))
+            rounds += 1
+
+            errors = await asyncio.gather(*[run(slice_) for slice_ in pending])
+            pending = _retry_slices(pending, errors)
+
+
+def _initial_slices(q: Dict, slice_minutes: int) -> List[Tuple[int, int, int]]:
+    return [
+        (start, end, 0)
+        for start, end in _split_window(
+            q['start_absolute'], q['end_absolute'] + 1, slice_minutes * _MINUTE_MS
+        )
+    ]
+
+
+def _retry_slices(
+    slices: List[Tuple[int, int, int]], errors: List[Optional[Exception]]
+) -> List[Tuple[int, int, int]]:
+    """Halve or retry the failed slices, raise the error of a slice out of retries."""
+    pending = []
+
+    for (start, end, retries), error in zip(slices, errors):
+        if error is None:
+            continue
+
+        middle = (start + end) // 2 // _MINUTE_MS * _MINUTE_MS
+        if end - start > KAIROSDB_MIN_QUERY_SLICE * _MINUTE_MS and start < middle < end:
+            pending.extend([(start, middle, retries), (middle, end, retries)])
+        elif retries < KAIROSDB_QUERY_RETRIES:
+            pending.append((start, end, retries + 1))
+        else:
+            raise error
+
+        logger.warning(
+            'KairosDB query slice of {} minutes failed, retrying: {}'.format(
+                (end - start) // _MINUTE_MS, error
+            )
+        )
+
+    return pending
+
+
+def _split_window(start: int, end: int, slice_ms: int) -> List[Tuple[int, int]]:
+    """Split ``[start, end)`` in milliseconds into slices with minute aligned boundaries."""
+    slices = []
+
+    while start < end:
+        boundary = min(max((start + slice_ms) // _MINUTE_MS * _MINUTE_MS, start + 1), end)
+        slices.append((start, boundary))
+        start = boundary
+
+    return slices
+
+
+def _is_retriable(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        status = error.response.status_code if error.response is not None else 500
+        return status >= 500 or status == 429
+
+    # Broken streams surface as urllib3 errors, since responses are parsed from the raw socket
+    if isinstance(error, (requests.RequestException, urllib3.exceptions.HTTPError)):
+        return True
+
+    if aiohttp is not None:
+        if isinstance(error, aiohttp.ClientResponseError):
+            return error.status >= 500 or error.status == 429
+        if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+            return True
+
+    return ijson is not None and isinstance(error, ijson.JSONError)
+
+
+def _iter_response(response: requests.Response, t_start: float) -> Iterator[ResultGroup]:
+    outcome = 'error'
+    try:
+        if ijson is None:
+            yield from iter_json_result_groups(response.json())
+        else:
+            response.raw.decode_content = True
+            yield from iter_result_groups(response.raw)
+        outcome = 'ok'
+    finally:
+        KAIROSDB_QUERY_SECONDS.labels(outcome).observe(time.monotonic() - t_start)
+        # Bytes read from the wire, i.e. compressed if the response was
+        KAIROSDB_RESPONSE_BYTES.observe(response.raw.tell())
+        response.close()
+
+
+def iter_json_result_groups(data: Dict) -> Iterator[ResultGroup]:
+    for result in data['queries'][0]['results']:
+        yield result.get('group_by', []), iter(result.get('values', []))
+
+
+def iter_result_groups(fp) -> Iterator[ResultGroup]:
+    """
+    Incrementally parse a KairosDB query response.
+
+    KairosDB writes ``group_by`` before ``values``, so points are streamed straight from the
+    parser and never held in memory. Should ``values`` come first, the group's points are
+    buffered until its ``group_by`` is known.
+    """
+    events = ijson.parse(fp, use_float=True)
+
+    group_by = None
+    buffered = None
+
+    for prefix, event, value in events:
+        if prefix == _RESULT_PREFIX and event == 'start_map':
+            group_by, buffered = None, None
+        elif prefix == _RESULT_PREFIX + '.group_by' and event == 'start_array':
+            group_by = _build_object(events, prefix, event, value)
+        elif prefix == _RESULT_PREFIX + '.values' and event == 'start_array':
+            points = _iter_points(events)
+            if group_by is None:
+                buffered = list(points)
+                continue
+
+            yield group_by, points
+
+            # Skip whatever the consumer did not read
+            for _ in points:
+                pass
+        elif prefix == _RESULT_PREFIX and event == 'end_map' and buffered is not None:
+            yield group_by or [], iter(buffered)
+
+
+def _build_object(events, prefix: str, event: str, value):
+    builder = ijson.ObjectBuilder()
+    builder.event(event, value)
+
+    for current_prefix, event, value in events:
+        builder.event(event, value)
+        if current_prefix == prefix and event in ('end_array', 'end_map'):
+            return builder.value
+
+
+def _iter_points(events) -> Iterator[List]:
+    point = []
+
+    for prefix, event, value in events:
+        if prefix == _RESULT_PREFIX + '.values.item.item':
+            point.append(value)
+        elif prefix == _RESULT_PREFIX + '.values.item' and event == 'end_array':
+            yield point
+            point = []
+        elif prefix == _RESULT_PREFIX + '.values' and event == 'end_array':
+            return
+
+
+def get_guard(url: str) -> guard.Guard:
+    """Guard of a KairosDB host, shared by its sync and async clients."""
+    return guard.get_guard('kairosdb:{}'.format(urlparse(url or '').netloc), is_failure=_is_retriable)
+
+
+_client: Optional[KairosDBClient] = None
+
+
+def get_client() -> KairosDBClient:
+    global _client
+
+    if _client is None:
+        _client = KairosDBClient(KAIROSDB_URL)
+
+    return _client
@@ -20,6 +20,9 @@ from .base import (
     SourceError,
     TimeRange,
 )
+from .guard import get_guard
+
+_QUERY_TIMEOUT = 55
 
 
 class _MetricImpl:
@@ -113,6 +116,15 @@ class _Metric(enum.Enum):
         ]
 
 
+def _get_timeseries(url: str, headers: Dict, params: Dict) -> requests.Response:
+    response = requests.get(url=url, headers=headers, params=params, timeout=_QUERY_TIMEOUT)
+    if response.status_code >= 500 or response.status_code == 429:
+        # Counted as a failure of the Lightstep API by its guard
+        response.raise_for_status()
+
+    return response
+
+
 def _paginate_timerange(
     timerange: TimeRange,
     resolution: int,
@@ -225,10 +237,8 @@ class Lightstep(Source):
             **self.metric.to_request(),
         }
         url = f"https://api.lightstep.com/public/v0.1/Zalando/projects/Production/searches/{self.stream_id}/timeseries"
-        response = requests.get(
-            url=url,
-            headers={"Authorization": f"Bearer {LIGHTSTEP_API_KEY}"},
-            params=params,
+        response = get_guard("lightstep").call(
+            _get_timeseries, url, {"Authorization": f"Bearer {LIGHTSTEP_API_KEY}"}, params
         )
         if response.status_code == 401:
             raise SourceError(
@@ -0,0 +1,370 @@
+"""
+Hourly and daily rollups (sum, count, min and max) of the minute values in ``indicatorvalue``.
+
+Buckets touched by an upsert are recomputed in the same transaction: hours from their minutes,
+days from their hours. Aggregates over long ranges then read full days from
+``indicatorvalue_daily``, the partial days at the edges from ``indicatorvalue_hourly`` and only the
+partial hours from the minutes, so their cost grows with the number of days, not minutes.
+
+The rollups are also retention tiers: minutes are kept ``MAX_RETENTION_DAYS``, hours
+``HOURLY_RETENTION_DAYS`` and days ``DAILY_RETENTION_DAYS``. Minute partitions are compacted
+(their rollups refreshed) before they are dropped.
+"""
+import datetime
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.declarative import declared_attr
+
+from app.config import (
+    CLEANUP_BATCH_SIZE,
+    CLEANUP_PAUSE,
+    CLEANUP_SLICE_DAYS,
+    DAILY_RETENTION_DAYS,
+    HOURLY_RETENTION_DAYS,
+    MAX_RETENTION_DAYS,
+)
+from app.extensions import db
+
+from . import archive
+
+logger = logging.getLogger(__name__)
+
+MINUTES = 'indicatorvalue'
+HOURLY = 'indicatorvalue_hourly'
+DAILY = 'indicatorvalue_daily'
+
+_HOUR = datetime.timedelta(hours=1)
+_DAY = datetime.timedelta(days=1)
+
+
+class _RollupMixin:
+    timestamp = db.Column(db.DateTime(), primary_key=True)
+
+    @declared_attr
+    def indicator_id(cls):
+        return db.Column(
+            db.Integer(), db.ForeignKey('indicator.id', ondelete='CASCADE'), primary_key=True
+        )
+
+    sum = db.Column(db.Float(), nullable=False)
+    count = db.Column(db.Integer(), nullable=False)
+    min = db.Column(db.Float(), nullable=False)
+    max = db.Column(db.Float(), nullable=False)
+
+
+class IndicatorValueHourly(_RollupMixin, db.Model):
+    __tablename__ = HOURLY
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('indicator_id', 'timestamp', name='indicatorvalue_hourly_pkey'),
+    )
+
+
+class IndicatorValueDaily(_RollupMixin, db.Model):
+    __tablename__ = DAILY
+
+    __table_args__ = (
+        db.PrimaryKeyConstraint('indicator_id', 'timestamp', name='indicatorvalue_daily_pkey'),
+    )
+
+
+_REFRESH_SQL = """
+INSERT INTO {target} (indicator_id, timestamp, sum, count, min, max)
+SELECT {indicator_id}, date_trunc('{unit}', timestamp), {columns}
+FROM ({source}) AS source
+GROUP BY 2
+ON CONFLICT (indicator_id, timestamp)
+DO UPDATE SET sum = EXCLUDED.sum, count = EXCLUDED.count, min = EXCLUDED.min, max = EXCLUDED.max
+"""
+
+_FROM_MINUTES = 'sum(value), count(*), min(value), max(value)'
+_FROM_ROLLUPS = 'sum(sum), sum(count), min(min), max(max)'
+
+_HOURLY_SQL = """
+SELECT timestamp, sum, count, min, max FROM indicatorvalue_hourly
+WHERE indicator_id = {indicator_id} AND timestamp >= {start} AND timestamp < {end}
+"""
+
+
+def _refresh_sql(target: str, unit: str, columns: str, params: Tuple[str, str, str]) -> str:
+    indicator_id, start, end = params
+    # Whole buckets from the one of ``start`` to the one of ``end``
+    start = "date_trunc('{}', {})".format(unit, start)
+    end = "date_trunc('{0}', {1}) + interval '1 {0}'".format(unit, end)
+
+    if target == HOURLY:
+        source = archive.minutes_sql(indicator_id, start, end)
+    else:
+        source = _HOURLY_SQL.format(indicator_id=indicator_id, start=start, end=end)
+
+    return _REFRESH_SQL.format(target=target, unit=unit, columns=columns, indicator_id=indicator_id, source=source)
+
+
+_NAMED = ('CAST(:indicator_id AS integer)', 'CAST(:start AS timestamp)', 'CAST(:end AS timestamp)')
+_REFRESH_HOURLY_SQL = text(_refresh_sql(HOURLY, 'hour', _FROM_MINUTES, _NAMED))
+_REFRESH_DAILY_SQL = text(_refresh_sql(DAILY, 'day', _FROM_ROLLUPS, _NAMED))
+
+# asyncpg
+_POSITIONAL = ('$1::integer', '$2::timestamp', '$3::timestamp')
+_REFRESH_HOURLY_ASYNC_SQL = _refresh_sql(HOURLY, 'hour', _FROM_MINUTES, _POSITIONAL)
+_REFRESH_DAILY_ASYNC_SQL = _refresh_sql(DAILY, 'day', _FROM_ROLLUPS, _POSITIONAL)
+
+_DELETE_SQL = """
+DELETE FROM {}
+WHERE indicator_id = :indicator_id AND timestamp >= :start AND timestamp < :end
+"""
+_DELETE_HOURLY_SQL = text(_DELETE_SQL.format(HOURLY))
+_DELETE_DAILY_SQL = text(_DELETE_SQL.format(DAILY))
+
+_DELETE_EXPIRED_SQL = """
+DELETE FROM {table}
+WHERE indicator_id = :indicator_id AND timestamp IN (
+    SELECT timestamp FROM {table}
+    WHERE indicator_id = :indicator_id AND timestamp < :cutoff
+    ORDER BY timestamp
+    LIMIT :limit
+)
+"""
+
+_COUNT_BREACHES_SQL = text(
+    'SELECT count(*) FROM ({}) AS minutes WHERE value < :target_from OR value > :target_to'.format(
+        archive.minutes_sql(':indicator_id', 'CAST(:start AS timestamp)', 'CAST(:end AS timestamp)')
+    )
+)
+
+
+def refresh_rollups(
+    session: db.Session, indicator_id: int, start: datetime.datetime, end: datetime.datetime
+) -> None:
+    """
+    Recompute the hourly and daily rollups of minutes between ``start`` and ``end`` (inclusive),
+    e.g. the oldest and the newest minute just upserted.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    params = {'indicator_id': indicator_id, 'start': start, 'end': end}
+    session.execute(_REFRESH_HOURLY_SQL, params)
+    session.execute(_REFRESH_DAILY_SQL, params)
+
+
+async def refresh_rollups_async(
+    conn, indicator_id: int, start: datetime.datetime, end: datetime.datetime
+) -> None:
+    """asyncpg variant of ``refresh_rollups``."""
+    await conn.execute(_REFRESH_HOURLY_ASYNC_SQL, indicator_id, start, end)
+    await conn.execute(_REFRESH_DAILY_ASYNC_SQL, indicator_id, start, end)
+
+
+def rebuild_rollups(
+    session: db.Session,
+    indicator_ids: List[int],
+    start: datetime.datetime,
+    end: datetime.datetime,
+    slice_days: int = CLEANUP_SLICE_DAYS,
+    pause: float = CLEANUP_PAUSE,
+    drop_missing: bool = True,
+) -> int:
+    """
+    Rebuild the rollups of all minutes in ``[start, end)`` (full days), per indicator and time slice,
+    each committed on its own. Hours and days without minutes are dropped, so only rebuild ranges whose
+    minutes were not deleted by the retention, unless ``drop_missing`` is disabled: then only the
+    rollups of hours and days with minutes are refreshed, e.g. to compact minutes before they expire.
+    Returns the number of rebuilt slices.
+
+    Note: Commits the session.
+    """
+    start = floor(start, 'day')
+    end = ceil(end, 'day')
+    slices = 0
+
+    for indicator_id in indicator_ids:
+        slice_start = start
+        while slice_start < end:
+            slice_end = min(slice_start + datetime.timedelta(days=slice_days), end)
+
+            params = {'indicator_id': indicator_id, 'start': slice_start, 'end': slice_end}
+            if drop_missing:
+                session.execute(_DELETE_HOURLY_SQL, params)
+                session.execute(_DELETE_DAILY_SQL, params)
+            # The end is inclusive, the last hour of the slice
+            refresh_rollups(session, indicator_id, slice_start, slice_end - _HOUR)
+            session.commit()
+
+            slices += 1
+            slice_start = slice_end
+            time.sleep(pause)
+
+        logger.info('Rebuilt SLI value rollups of indicator {} since {}'.format(indicator_id, start))
+
+    return slices
+
+
+def delete_in_batches(
+    session: db.Session,
+    statement,
+    params: Dict,
+    batch_size: int = CLEANUP_BATCH_SIZE,
+    pause: float = CLEANUP_PAUSE,
+) -> int:
+    """
+    Run a ``DELETE`` limited to ``:limit`` rows until it deletes less than ``batch_size`` rows,
+    committing every batch and pausing ``pause`` seconds in between.
+
+    Note: Commits the session.
+    """
+    params = dict(params, limit=batch_size)
+    count = 0
+
+    while True:
+        deleted = session.execute(statement, params).rowcount
+        session.commit()
+        count += deleted
+
+        if deleted < batch_size:
+            return count
+
+        time.sleep(pause)
+
+
+def retention_cutoffs(now: datetime.datetime) -> Dict[str, Optional[datetime.datetime]]:
+    """Oldest timestamp kept per tier, ``None`` if kept forever."""
+    return {
+        MINUTES: now - datetime.timedelta(days=int(MAX_RETENTION_DAYS)),
+        HOURLY: now - datetime.timedelta(days=HOURLY_RETENTION_DAYS) if HOURLY_RETENTION_DAYS else None,
+        DAILY: now - datetime.timedelta(days=DAILY_RETENTION_DAYS) if DAILY_RETENTION_DAYS else None,
+    }
+
+
+def finest_table(start: datetime.datetime, now: Optional[datetime.datetime] = None) -> str:
+    """The finest tier still holding values from ``start`` on."""
+    cutoffs = retention_cutoffs(now or datetime.datetime.utcnow())
+
+    for table in (MINUTES, HOURLY):
+        if cutoffs[table] is None or start >= cutoffs[table]:
+            return table
+
+    return DAILY
+
+
+def delete_expired_rollups(
+    session: db.Session, indicator_ids: List[int], now: Optional[datetime.datetime] = None
+) -> int:
+    """
+    Delete hourly and daily rollups older than their retention, in batches per indicator.
+
+    Note: Commits the session.
+    """
+    cutoffs = retention_cutoffs(now or datetime.datetime.utcnow())
+    count = 0
+
+    for table in (HOURLY, DAILY):
+        if cutoffs[table] is None:
+            continue
+
+        statement = text(_DELETE_EXPIRED_SQL.format(table=table))
+        for indicator_id in indicator_ids:
+            count += delete_in_batches(
+                session, statement, {'indicator_id': indicator_id, 'cutoff': cutoffs[table]}
+            )
+
+    return count
+
+
+def floor(dt: datetime.datetime, unit: str) -> datetime.datetime:
+    dt = dt.replace(minute=0, second=0, microsecond=0)
+    return dt.replace(hour=0) if unit == 'day' else dt
+
+
+def ceil(dt: datetime.datetime, unit: str) -> datetime.datetime:
+    floored = floor(dt, unit)
+    if floored == dt:
+        return dt
+
+    return floored + (_DAY if unit == 'day' else _HOUR)
+
+
+def segments(
+    start: datetime.datetime, end: datetime.datetime, tables=((DAILY, 'day'), (HOURLY, 'hour'))
+) -> List[Tuple[str, datetime.datetime, datetime.datetime]]:
+    """
+    Split ``[start, end)`` into the coarsest ranges covered by rollups: full days, then full hours
+    at the edges, then the remaining minutes. Returns ``(table, start, end)`` tuples in order.
+    """
+    if start >= end:
+        return []
+
+    if not tables:
+        return [(MINUTES, start, end)]
+
+    (table, unit), finer = tables[0], tables[1:]
+    aligned_start, aligned_end = ceil(start, unit), floor(end, unit)
+    if aligned_start >= aligned_end:
+        return segments(start, end, finer)
+
+    return (
+        segments(start, aligned_start, finer)
+        + [(table, aligned_start, aligned_end)]
+        + segments(aligned_end, end, finer)
+    )
+
+
+def get_daily_summaries(
+    session: db.Session, indicator_id: int, start: datetime.datetime, end: datetime.datetime
+) -> List[Tuple[datetime.datetime, float, int, float, float]]:
+    """``(day, sum, count, min, max)`` of the values in ``[start, end)`` per day, read from the rollups."""
+    parts = []
+    params: Dict = {'indicator_id': indicator_id}
+
+    for i, (table, segment_start, segment_end) in enumerate(segments(start, end)):
+        if table == MINUTES:
+            # Stored and archived minutes
+            parts.append('SELECT timestamp, value, 1, value, value FROM ({}) AS minutes_{}'.format(
+                archive.minutes_sql(
+                    ':indicator_id', 'CAST(:start_{} AS timestamp)'.format(i), 'CAST(:end_{} AS timestamp)'.format(i)
+                ),
+                i,
+            ))
+        else:
+            parts.append(
+                'SELECT timestamp, sum, count, min, max FROM {table} '
+                'WHERE indicator_id = :indicator_id AND timestamp >= :start_{i} AND timestamp < :end_{i}'.format(
+                    table=table, i=i
+                )
+            )
+        params['start_{}'.format(i)] = segment_start
+        params['end_{}'.format(i)] = segment_end
+
+    if not parts:
+        return []
+
+    statement = text(
+        "SELECT date_trunc('day', timestamp) AS day, sum(sum), sum(count), min(min), max(max) "
+        'FROM ({}) AS rollup (timestamp, sum, count, min, max) GROUP BY 1 ORDER BY 1'.format(
+            ' UNION ALL '.join(parts)
+        )
+    )
+
+    return [tuple(row) for row in session.execute(statement, params)]
+
+
+def count_breaches(
+    session: db.Session,
+    indicator_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    target_from: Optional[float],
+    target_to: Optional[float],
+) -> int:
+    """Minutes in ``[start, end)`` outside the target."""
+    params = {
+        'indicator_id': indicator_id,
+        'start': start,
+        'end': end,
+        'target_from': float('-inf') if target_from is None else target_from,
+        'target_to': float('inf') if target_to is None else target_to,
+    }
+
+    return session.execute(_COUNT_BREACHES_SQL, params).scalar()
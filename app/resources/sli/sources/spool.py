@@ -0,0 +1,204 @@
+"""
+Local spool of fetched indicator values which could not be written to the database.
+
+Values are appended to segment files as fixed size binary records (indicator id, epoch
+minute, value). Every process appends to a segment of its own, holding an exclusive
+``flock`` on it. The replayer closes the current segment, drains all segments it can lock
+(including those of dead processes) into the database and deletes them.
+"""
+import asyncio
+import collections
+import datetime
+import fcntl
+import glob
+import logging
+import os
+import struct
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import exc
+
+try:
+    import asyncpg
+except ImportError:  # pragma: no cover
+    asyncpg = None
+
+from app.config import UPDATER_SPOOL_DIR, UPDATER_SPOOL_MAX_ATTEMPTS
+from app.libs.metrics import SPOOLED_ROWS
+
+logger = logging.getLogger(__name__)
+
+# indicator id, minutes since the epoch, value
+_RECORD = struct.Struct('<iid')
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MINUTE = datetime.timedelta(minutes=1)
+
+_SUFFIX = '.spool'
+# Segments are renamed to their final name once they are locked, so replayers never see them unlocked
+_NEW_SUFFIX = '.new'
+# Segments which repeatedly failed to replay
+_FAILED_SUFFIX = '.failed'
+
+
+def is_db_unavailable(error: Exception) -> bool:
+    """Connection errors and pool timeouts, the values are worth keeping until the database is back."""
+    if isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.TimeoutError)):
+        return True
+
+    if asyncpg is not None and isinstance(
+        error, (asyncpg.PostgresConnectionError, asyncpg.InterfaceError)
+    ):
+        return True
+
+    return isinstance(error, (OSError, asyncio.TimeoutError))
+
+
+def pack(indicator_id: int, values: Dict[datetime.datetime, float]) -> bytes:
+    return b''.join(
+        _RECORD.pack(indicator_id, (minute - _EPOCH) // _MINUTE, value)
+        for minute, value in values.items()
+    )
+
+
+def unpack(data: bytes) -> Dict[int, Dict[datetime.datetime, float]]:
+    """Values per indicator, later records win. A torn record at the end is ignored."""
+    values: Dict[int, Dict[datetime.datetime, float]] = collections.defaultdict(dict)
+
+    end = len(data) - len(data) % _RECORD.size
+    for indicator_id, minute, value in _RECORD.iter_unpack(data[:end]):
+        values[indicator_id][_EPOCH + minute * _MINUTE] = value
+
+    return values
+
+
+class Spool:
+    def __init__(self, directory: str, max_attempts: int = UPDATER_SPOOL_MAX_ATTEMPTS):
+        self.directory = directory
+        self.max_attempts = max_attempts
+        self._segment = None
+        # Newest spooled minute per indicator, so updates continue from there instead of the stale watermark
+        # until the values are replayed
+        self._newest: Dict[int, datetime.datetime] = {}
+        # Failed replays per segment
+        self._attempts: Dict[str, int] = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, indicator_id: int, values: Dict[datetime.datetime, float]) -> None:
+        if not values:
+            return
+
+        segment = self._segment or self._open_segment()
+        segment.write(pack(indicator_id, values))
+        segment.flush()
+        os.fsync(segment.fileno())
+
+        newest = max(values)
+        if indicator_id not in self._newest or self._newest[indicator_id] < newest:
+            self._newest[indicator_id] = newest
+
+        SPOOLED_ROWS.labels('spooled').inc(len(values))
+        logger.warning(
+            'Spooled {} values of indicator {} until the database is available again'.format(
+                len(values), indicator_id
+            )
+        )
+
+    def newest(self, indicator_id: int) -> Optional[datetime.datetime]:
+        return self._newest.get(indicator_id)
+
+    def replay(self, store: Callable[[int, Dict[datetime.datetime, float]], None]) -> int:
+        """
+        Pass all spooled values to ``store``, per indicator, and delete the drained segments.
+
+        Stops at the first ``store`` failing as the database is unavailable. A segment failing
+        otherwise is skipped and replayed again next time (values are upserted, so storing them
+        twice does no harm), after ``max_attempts`` failures it is quarantined: renamed to
+        ``*.failed`` and left for inspection.
+        """
+        self._close_segment()
+
+        count = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, '*' + _SUFFIX))):
+            with open(path, 'rb') as segment:
+                try:
+                    fcntl.flock(segment, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Still written by another process, or replayed by another replica
+                    continue
+
+                values = unpack(segment.read())
+                try:
+                    for indicator_id, indicator_values in values.items():
+                        store(indicator_id, indicator_values)
+                        count += len(indicator_values)
+                except Exception as e:
+                    if is_db_unavailable(e):
+                        raise
+                    if not self._failed(path, values, e):
+                        continue
+                else:
+                    os.unlink(path)
+                    self._attempts.pop(path, None)
+
+                self._replayed(values)
+
+        return count
+
+    def _failed(self, path: str, values: Dict[int, Dict[datetime.datetime, float]], error: Exception) -> bool:
+        """Count a failed replay of a segment, returns whether it was quarantined."""
+        attempts = self._attempts[path] = self._attempts.get(path, 0) + 1
+        if attempts < self.max_attempts:
+            logger.warning('Failed to replay spool segment {} ({}/{}): {}'.format(
+                path, attempts, self.max_attempts, error
+            ))
+            return False
+
+        os.rename(path, path + _FAILED_SUFFIX)
+        del self._attempts[path]
+
+        SPOOLED_ROWS.labels('quarantined').inc(sum(len(v) for v in values.values()))
+        logger.error('Quarantined spool segment {} after {} failed replays: {}'.format(
+            path + _FAILED_SUFFIX, attempts, error
+        ))
+        return True
+
+    def _replayed(self, values: Dict[int, Dict[datetime.datetime, float]]) -> None:
+        # Updates continue from the watermark again, which also re-fetches quarantined values
+        for indicator_id, indicator_values in values.items():
+            newest = self._newest.get(indicator_id)
+            if newest is not None and newest <= max(indicator_values):
+                del self._newest[indicator_id]
+
+    def _open_segment(self):
+        path = os.path.join(
+            self.directory, '{:017d}-{}{}'.format(int(time.time() * 1e6), os.getpid(), _SUFFIX)
+        )
+
+        segment = open(path + _NEW_SUFFIX, 'ab')
+        fcntl.flock(segment, fcntl.LOCK_EX)
+        os.rename(path + _NEW_SUFFIX, path)
+
+        self._segment = segment
+        return segment
+
+    def _close_segment(self) -> None:
+        if self._segment is not None:
+            # Releases the lock, the segment can be replayed now
+            self._segment.close()
+            self._segment = None
+
+
+_spool: Optional[Spool] = None
+
+
+def get_spool() -> Optional[Spool]:
+    """The process-wide spool, ``None`` unless ``SLR_UPDATER_SPOOL_DIR`` is set."""
+    global _spool
+
+    if _spool is None and UPDATER_SPOOL_DIR:
+        _spool = Spool(UPDATER_SPOOL_DIR)
+
+    return _spool
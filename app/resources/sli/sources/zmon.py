@@ -1,23 +1,48 @@
+import asyncio
+import bisect
+import collections
 import datetime
 import fnmatch
 import itertools
+import logging
 import math
-from typing import Dict, List, Optional, Tuple
+import re
+import time
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import opentracing
-import requests
-import zign.api
 from datetime_truncate import truncate as truncate_datetime
 from opentracing_utils import extract_span_from_kwargs, trace
+from sqlalchemy import text
 from sqlalchemy.dialects.postgresql import insert as pg_insert
 
-from app.config import KAIROS_QUERY_LIMIT, KAIROSDB_URL, MAX_QUERY_TIME_SLICE
-from app.extensions import db
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
 
+from app.config import (BACKFILL_COPY_THRESHOLD, CLEANUP_BATCH_SIZE,
+                        CLEANUP_PAUSE, KAIROS_QUERY_LIMIT,
+                        KAIROSDB_AGGREGATION_PUSHDOWN, MAX_QUERY_TIME_SLICE,
+                        UPDATER_INSERT_BATCH_SIZE, VECTORIZED_AGGREGATION)
+from app.extensions import db, updater_session
+from app.libs.metrics import INDICATOR_VALUE_ROWS, ROWS_WRITTEN, UPSERT_SECONDS
+from app.resources.sli import partitions
+from app.resources.sli.models import IndicatorWatermark
+
+from . import archive, kairosdb, rollups, spool
 from .base import (IndicatorValueAggregate, IndicatorValueLike, Pagination,
-                   Resolution, Source, SourceError, TimeRange)
+                   PureIndicatorValue, Resolution, Source, SourceError,
+                   TimeRange)
+
+logger = logging.getLogger(__name__)
 
 _MIN_VAL = math.expm1(1e-10)
+# Sources sharing a check are queried together per bucket of their start (minutes back, upper bounds),
+# so a source catching up does not widen the query of all others
+_BATCH_START_BUCKETS = (15, 60, 360)
+_EPOCH = datetime.datetime(1970, 1, 1)
 _AGGREGATION_TYPES = ("average", "weighted", "sum", "min", "max", "minimum", "maximum")
 _AGGREGATION_TYPES_NORMALIZED = {
     "average": "avg",
@@ -31,11 +56,104 @@ _AGGREGATION_TYPES_NORMALIZED = {
 }
 
 
-def _key_matches(key, key_patterns):
-    for pat in key_patterns:
-        if fnmatch.fnmatch(key, pat):
-            return True
-    return False
+class _KeyMatcher:
+    """Matches keys against a list of glob patterns with one compiled regex."""
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._regex = (
+            re.compile("|".join(fnmatch.translate(pat) for pat in self.patterns))
+            if self.patterns
+            else None
+        )
+
+    def __call__(self, key: str) -> bool:
+        return self._regex is not None and self._regex.match(key) is not None
+
+
+def _as_list(value) -> List:
+    return value if isinstance(value, list) else [value]
+
+
+def _merge_tag_filters(tag_filters: List[Dict]) -> Tuple[Dict, List[str]]:
+    """
+    Merge KairosDB tag filters of several queries into one covering all of them.
+
+    Only tags filtered by every query are kept (with the union of their values). Tags whose
+    filters differ between queries are returned as extra ``group_by`` tags, so results can
+    be told apart again.
+    """
+    common = set.intersection(*[set(tag_filter) for tag_filter in tag_filters])
+
+    merged = {}
+    for name in sorted(common):
+        values = []
+        for tag_filter in tag_filters:
+            values.extend(v for v in _as_list(tag_filter[name]) if v not in values)
+        merged[name] = values
+
+    group_by_tags = sorted(
+        {
+            name
+            for tag_filter in tag_filters
+            for name in tag_filter
+            if name not in ("entity", "key")
+            and any(
+                sorted(_as_list(other.get(name, []))) != sorted(_as_list(tag_filter[name]))
+                for other in tag_filters
+            )
+        }
+    )
+
+    return merged, group_by_tags
+
+
+def _kairosdb_query(
+    check_id,
+    tags: Dict,
+    start_dt: datetime.datetime,
+    end_dt: datetime.datetime,
+    group_by_tags=(),
+    aggregator=None,
+) -> Dict:
+    metric = {"name": "zmon.check.{}".format(check_id), "tags": tags}
+
+    if aggregator:
+        # Merge all series and reduce them per minute in KairosDB. No limit here, as it
+        # would cut raw datapoints before they are aggregated.
+        metric["aggregators"] = [
+            {
+                "name": aggregator,
+                "sampling": {"value": 1, "unit": "minutes"},
+                "align_sampling": True,
+                "align_start_time": True,
+            }
+        ]
+    else:
+        metric["limit"] = KAIROS_QUERY_LIMIT
+        metric["group_by"] = [
+            {"name": "tag", "tags": ["entity", "key"] + list(group_by_tags)}
+        ]
+
+    # Absolute bounds, so the window can be split into slices which line up exactly
+    return {
+        "start_absolute": _to_epoch_ms(start_dt),
+        "end_absolute": _to_epoch_ms(end_dt),
+        "metrics": [metric],
+    }
+
+
+def _to_epoch_ms(dt: datetime.datetime) -> int:
+    return int((dt - _EPOCH).total_seconds() * 1000)
+
+
+def _clamp_value(val):
+    # Keep tiny values distinguishable from zero when stored as numeric
+    if val > 0:
+        return max(val, _MIN_VAL)
+    elif val < 0:
+        return min(val, _MIN_VAL * -1)
+    return val
 
 
 class IndicatorValue(db.Model, IndicatorValueLike):
@@ -51,12 +169,15 @@ class IndicatorValue(db.Model, IndicatorValueLike):
         index=True,
     )
 
+    # Monthly partitions, see ``app.resources.sli.partitions``. Upserts infer the conflict
+    # target from the primary key columns, which works on partitioned tables as well.
     __table_args__ = (
         db.PrimaryKeyConstraint(
             'timestamp',
             'indicator_id',
             name='indicatorvalue_timestamp_indicator_id_pkey',
         ),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
 
     def as_dict(self):
@@ -86,7 +207,7 @@ def insert_indicator_value(session: db.Session, sli_value: IndicatorValue) -> No
         pg_insert(IndicatorValue)
         .values(**sli_value.as_dict())
         .on_conflict_do_update(
-            constraint='indicatorvalue_timestamp_indicator_id_pkey',
+            index_elements=[IndicatorValue.timestamp, IndicatorValue.indicator_id],
             set_=sli_value.update_dict(),
         )
     )
@@ -94,7 +215,573 @@ def insert_indicator_value(session: db.Session, sli_value: IndicatorValue) -> No
     session.execute(statement)
 
 
+def insert_indicator_values(
+    session: db.Session,
+    indicator_id: int,
+    values: Dict[datetime.datetime, float],
+    batch_size: int = UPDATER_INSERT_BATCH_SIZE,
+) -> int:
+    """
+    Bulk upsert indicator values using multi-row ``INSERT ... ON CONFLICT`` statements.
+
+    Values are written in chunks of ``batch_size`` rows, so a full day of minutes costs
+    a couple of round trips instead of one statement per minute. Rows whose value did not
+    change are left untouched. Returns the number of inserted or updated rows.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    rows = [
+        {"timestamp": minute, "value": _clamp_value(val), "indicator_id": indicator_id}
+        for minute, val in sorted(values.items())
+    ]
+    count = 0
+
+    for i in range(0, len(rows), batch_size):
+        statement = pg_insert(IndicatorValue).values(rows[i:i + batch_size])
+        statement = statement.on_conflict_do_update(
+            index_elements=[IndicatorValue.timestamp, IndicatorValue.indicator_id],
+            set_={"value": statement.excluded.value},
+            where=IndicatorValue.value.is_distinct_from(statement.excluded.value),
+        )
+
+        count += session.execute(statement).rowcount
+
+    return count
+
+
+def get_stored_values(
+    session: db.Session, indicator_id: int, start: datetime.datetime, end: datetime.datetime
+) -> Dict[datetime.datetime, Decimal]:
+    rows = (
+        session.query(IndicatorValue.timestamp, IndicatorValue.value)
+        .filter(
+            IndicatorValue.indicator_id == indicator_id,
+            IndicatorValue.timestamp >= start,
+            IndicatorValue.timestamp <= end,
+        )
+        .all()
+    )
+
+    return {timestamp: value for timestamp, value in rows}
+
+
+def changed_values(
+    values: Dict[datetime.datetime, float], stored: Dict[datetime.datetime, Decimal]
+) -> Dict[datetime.datetime, float]:
+    """Values which are not stored yet, or stored with a different value."""
+    return {
+        minute: val
+        for minute, val in values.items()
+        if minute not in stored or float(stored[minute]) != float(_clamp_value(val))
+    }
+
+
+class _CopyStream:
+    """File-like object feeding ``COPY ... FROM STDIN`` from a row iterator."""
+
+    def __init__(self, lines: Iterator[str]):
+        self._lines = lines
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+
+        if size < 0:
+            size = len(self._buffer)
+
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return chunk
+
+
+def copy_indicator_values(
+    session: db.Session, indicator_id: int, values: Dict[datetime.datetime, float],
+) -> int:
+    """
+    Bulk upsert indicator values by streaming them with ``COPY`` into a temporary staging
+    table, then merging into ``indicatorvalue`` with one ``INSERT ... SELECT ... ON CONFLICT``.
+
+    Meant for large backfills, where even batched upserts are dominated by statement overhead.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    lines = (
+        "{}\t{}\t{}\n".format(minute.isoformat(), _clamp_value(val), indicator_id)
+        for minute, val in sorted(values.items())
+    )
+
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE indicatorvalue_staging "
+            "(LIKE indicatorvalue INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        cursor.copy_expert(
+            "COPY indicatorvalue_staging (timestamp, value, indicator_id) FROM STDIN",
+            _CopyStream(lines),
+        )
+        cursor.execute(
+            "INSERT INTO indicatorvalue (timestamp, value, indicator_id) "
+            "SELECT timestamp, value, indicator_id FROM indicatorvalue_staging "
+            "ON CONFLICT (timestamp, indicator_id) "
+            "DO UPDATE SET value = EXCLUDED.value "
+            "WHERE indicatorvalue.value IS DISTINCT FROM EXCLUDED.value"
+        )
+        count = cursor.rowcount
+        cursor.execute("DROP TABLE indicatorvalue_staging")
+    finally:
+        cursor.close()
+
+    return count
+
+
+def update_indicator_watermark(
+    session: db.Session, indicator_id: int, timestamp: Optional[datetime.datetime]
+) -> None:
+    """
+    Record a successful ingestion of values up to ``timestamp`` (``None`` if nothing new was
+    stored). The watermark never moves backwards, e.g. when older ranges are backfilled.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    statement = pg_insert(IndicatorWatermark).values(
+        indicator_id=indicator_id,
+        last_timestamp=timestamp,
+        last_success=datetime.datetime.utcnow(),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=[IndicatorWatermark.indicator_id],
+        set_={
+            # GREATEST ignores NULLs
+            "last_timestamp": db.func.greatest(
+                IndicatorWatermark.last_timestamp, statement.excluded.last_timestamp
+            ),
+            "last_success": statement.excluded.last_success,
+        },
+    )
+
+    session.execute(statement)
+
+
+def write_indicator_values(
+    session: db.Session, indicator_id: int, values: Dict[datetime.datetime, float]
+) -> int:
+    """
+    Upsert values (via ``COPY`` if there are many) and advance the watermark, e.g. when
+    replaying spooled values.
+
+    Note: Does not perform ``session.commit()``.
+    """
+    if values:
+        archive.restore(session, indicator_id, min(values), max(values))
+
+    if len(values) >= BACKFILL_COPY_THRESHOLD:
+        count = copy_indicator_values(session, indicator_id, values)
+    else:
+        count = insert_indicator_values(session, indicator_id, values)
+    if values:
+        rollups.refresh_rollups(session, indicator_id, min(values), max(values))
+
+    update_indicator_watermark(session, indicator_id, max(values) if values else None)
+
+    return count
+
+
+_DELETE_INDICATOR_VALUES_BATCH_SQL = text("""
+DELETE FROM indicatorvalue
+WHERE indicator_id = :indicator_id AND timestamp IN (
+    SELECT timestamp FROM indicatorvalue
+    WHERE indicator_id = :indicator_id AND timestamp >= :start AND timestamp < :end
+    ORDER BY timestamp
+    LIMIT :limit
+)
+""")
+
+
+def delete_indicator_values(
+    session: db.Session,
+    indicator_id: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    batch_size: int = CLEANUP_BATCH_SIZE,
+    pause: float = CLEANUP_PAUSE,
+) -> int:
+    """
+    Delete values of an indicator in ``[start, end)``, oldest first, in batches of up to
+    ``batch_size`` rows, pausing ``pause`` seconds between batches. Every batch is committed,
+    so an interrupted delete continues where it stopped when run again.
+
+    Note: Commits the session.
+    """
+    return rollups.delete_in_batches(
+        session,
+        _DELETE_INDICATOR_VALUES_BATCH_SQL,
+        {"indicator_id": indicator_id, "start": start, "end": end},
+        batch_size,
+        pause,
+    )
+
+
+_UPSERT_INDICATOR_VALUES_SQL = """
+INSERT INTO indicatorvalue (timestamp, value, indicator_id)
+SELECT v.timestamp, v.value, $3::integer
+FROM unnest($1::timestamp[], $2::float8[]) AS v(timestamp, value)
+ON CONFLICT (timestamp, indicator_id)
+DO UPDATE SET value = EXCLUDED.value
+WHERE indicatorvalue.value IS DISTINCT FROM EXCLUDED.value
+"""
+
+_STORED_VALUES_SQL = """
+SELECT timestamp, value FROM indicatorvalue
+WHERE indicator_id = $1 AND timestamp >= $2 AND timestamp <= $3
+"""
+
+_UPDATE_INDICATOR_WATERMARK_SQL = """
+INSERT INTO indicator_watermark (indicator_id, last_timestamp, last_success)
+VALUES ($1, $2, $3)
+ON CONFLICT (indicator_id) DO UPDATE
+SET last_timestamp = GREATEST(indicator_watermark.last_timestamp, EXCLUDED.last_timestamp),
+    last_success = EXCLUDED.last_success
+"""
+
+
+async def upsert_indicator_values_async(
+    conn, indicator_id: int, values: Dict[datetime.datetime, float]
+) -> int:
+    """
+    asyncpg variant of ``insert_indicator_values``, upserting all values with one statement.
+
+    Note: Does not start a transaction.
+    """
+    if not values:
+        return 0
+
+    minutes = sorted(values)
+    status = await conn.execute(
+        _UPSERT_INDICATOR_VALUES_SQL,
+        minutes,
+        [float(_clamp_value(values[minute])) for minute in minutes],
+        indicator_id,
+    )
+
+    # Command tag, e.g. "INSERT 0 42"
+    return int(status.split()[-1])
+
+
+async def get_stored_values_async(
+    conn, indicator_id: int, start: datetime.datetime, end: datetime.datetime
+) -> Dict[datetime.datetime, Decimal]:
+    """asyncpg variant of ``get_stored_values``."""
+    rows = await conn.fetch(_STORED_VALUES_SQL, indicator_id, start, end)
+
+    return {row["timestamp"]: row["value"] for row in rows}
+
+
+async def update_indicator_watermark_async(
+    conn, indicator_id: int, timestamp: Optional[datetime.datetime]
+) -> None:
+    """asyncpg variant of ``update_indicator_watermark``."""
+    await conn.execute(
+        _UPDATE_INDICATOR_WATERMARK_SQL, indicator_id, timestamp, datetime.datetime.utcnow()
+    )
+
+
+class _MinuteAggregation:
+    """
+    Per-minute aggregation of one indicator's KairosDB datapoints.
+
+    Datapoints are folded in while the response is parsed, so memory grows with the number
+    of minutes and entity groups rather than with the size of the response.
+    """
+
+    def __init__(self, source: "ZMON", since: Optional[datetime.datetime] = None):
+        self.source = source
+        self.since = since
+
+        self.aggregation_type = source.aggregation["type"]
+
+        self._minutes: Dict = {}
+
+    def slot(self, group: Dict) -> Optional[Tuple[Tuple[str, str], str]]:
+        """Decide once per result group where its datapoints go, ``None`` skips the group."""
+        key = group.get("key")
+        if key is None or not self.source._accepts_group(group):
+            return None
+
+        if self.source.exclude_matcher(key):
+            return None
+
+        g = group.get("entity"), ".".join(key.split(".")[:-1])
+
+        if self.aggregation_type == "weighted" and self.source.weight_matcher(key):
+            return g, "weight"
+
+        return g, "value"
+
+    def add(self, slot: Tuple[Tuple[str, str], str], ts: int, value) -> None:
+        # truncate to full minutes
+        minute = datetime.datetime.utcfromtimestamp((ts // 60000) * 60)
+        if self.since and minute < self.since:
+            return
+
+        g, field = slot
+        self._minutes.setdefault(minute, {}).setdefault(g, {})[field] = value
+
+    def add_points(self, slot: Tuple[Tuple[str, str], str], points: Iterable) -> None:
+        for ts, value in points:
+            self.add(slot, ts, value)
+
+    def result(self) -> Dict:
+        aggregation_type = self.aggregation_type
+
+        result = {}
+        for minute, values in self._minutes.items():
+            if aggregation_type == "weighted":
+                total_weight = 0
+                total_value = 0
+                for g, entry in values.items():
+                    if "value" in entry:
+                        val = entry["value"]
+                        weight = entry.get(
+                            "weight", 1
+                        )  # In case weight was not available!
+
+                        total_weight += weight
+                        total_value += val * weight
+                if total_weight != 0:
+                    result[minute] = total_value / total_weight
+                else:
+                    result[minute] = 0
+            elif aggregation_type == "average":
+                total_value = 0
+                for g, entry in values.items():
+                    total_value += entry["value"]
+                result[minute] = total_value / len(values)
+            elif aggregation_type == "sum":
+                total_value = 0
+                for g, entry in values.items():
+                    total_value += entry["value"]
+                result[minute] = total_value
+            elif aggregation_type in ("minimum", "min"):
+                result[minute] = min([entry["value"] for g, entry in values.items()])
+            elif aggregation_type in ("maximum", "max"):
+                result[minute] = max([entry["value"] for g, entry in values.items()])
+
+        return result
+
+
+class _VectorizedMinuteAggregation(_MinuteAggregation):
+    """
+    Array based variant of ``_MinuteAggregation`` for checks with many entities.
+
+    Every series is reduced to its last value per minute while it is parsed, so memory grows
+    with minutes and series like the dict based path. The minutes are then aggregated with
+    ``bincount`` and ``reduceat``. Entries are ordered like the dict based path iterates
+    them, and sums use ``bincount`` which adds sequentially, so results are identical to
+    ``result()`` of the parent class.
+    """
+
+    _VALUE, _WEIGHT = 0, 1
+
+    def __init__(self, source: "ZMON", since: Optional[datetime.datetime] = None):
+        super().__init__(source, since)
+
+        # First minute not before ``since``
+        self._since_minute = (
+            math.ceil((since - _EPOCH).total_seconds() / 60) if since else None
+        )
+        self._group_ids: Dict = {}
+        self._chunks: List[Tuple] = []
+        # Arrival order of the datapoints
+        self._seq = 0
+
+    def add(self, slot: Tuple[Tuple[str, str], str], ts: int, value) -> None:
+        self.add_points(slot, [(ts, value)])
+
+    def add_points(self, slot: Tuple[Tuple[str, str], str], points: Iterable) -> None:
+        data = np.array(points if isinstance(points, list) else list(points), dtype=np.float64)
+        if not len(data):
+            return
+
+        minutes = (data[:, 0] // 60000).astype(np.int64)
+        values = data[:, 1]
+        if self._since_minute is not None:
+            keep = minutes >= self._since_minute
+            minutes, values = minutes[keep], values[keep]
+
+        if not len(minutes):
+            return
+
+        seq = np.arange(self._seq, self._seq + len(minutes))
+        self._seq += len(minutes)
+
+        # Last value and first arrival of every minute, the stable sort keeps the arrival order
+        order = np.argsort(minutes, kind="stable")
+        minutes, values, seq = minutes[order], values[order], seq[order]
+        firsts = np.flatnonzero(np.r_[True, minutes[1:] != minutes[:-1]])
+        lasts = np.r_[firsts[1:], len(minutes)] - 1
+
+        g, field = slot
+        group_id = self._group_ids.setdefault(g, len(self._group_ids))
+        self._chunks.append(
+            (
+                minutes[firsts],
+                group_id,
+                self._WEIGHT if field == "weight" else self._VALUE,
+                values[lasts],
+                seq[firsts],
+            )
+        )
+
+    def result(self) -> Dict:
+        if not self._chunks:
+            return {}
+
+        minutes = np.concatenate([chunk[0] for chunk in self._chunks])
+        groups = np.concatenate(
+            [np.full(len(chunk[0]), chunk[1], dtype=np.int64) for chunk in self._chunks]
+        )
+        fields = np.concatenate(
+            [np.full(len(chunk[0]), chunk[2], dtype=np.int8) for chunk in self._chunks]
+        )
+        values = np.concatenate([chunk[3] for chunk in self._chunks])
+        seq = np.concatenate([chunk[4] for chunk in self._chunks])
+
+        # Sort by (minute, group, field, arrival). The last entry of every (minute, group,
+        # field) run wins, like assignments to the nested dicts. Series arrive one after the
+        # other, so the first arrival of a reduced minute orders it like its last value.
+        order = np.lexsort((seq, fields, groups, minutes))
+        minutes, groups, fields, values, seq = (
+            minutes[order], groups[order], fields[order], values[order], seq[order]
+        )
+
+        changed_row = np.ones(len(minutes), dtype=bool)
+        changed_row[1:] = (minutes[1:] != minutes[:-1]) | (groups[1:] != groups[:-1])
+        last = np.ones(len(minutes), dtype=bool)
+        last[:-1] = changed_row[1:] | (fields[1:] != fields[:-1])
+
+        # One row per (minute, group), ordered by first arrival within the minute, which is
+        # the insertion order the dict based path iterates in.
+        row_ids = np.cumsum(changed_row) - 1
+        row_starts = np.flatnonzero(changed_row)
+        row_minutes = minutes[row_starts]
+        row_first_seq = np.minimum.reduceat(seq, row_starts)
+
+        row_has_value = np.zeros(len(row_starts), dtype=bool)
+        row_values = np.zeros(len(row_starts))
+        row_weights = np.ones(len(row_starts))  # In case weight was not available!
+
+        is_value = last & (fields == self._VALUE)
+        row_has_value[row_ids[is_value]] = True
+        row_values[row_ids[is_value]] = values[is_value]
+        is_weight = last & (fields == self._WEIGHT)
+        row_weights[row_ids[is_weight]] = values[is_weight]
+
+        row_order = np.lexsort((row_first_seq, row_minutes))
+        row_minutes = row_minutes[row_order]
+        row_has_value = row_has_value[row_order]
+        row_values = row_values[row_order]
+        row_weights = row_weights[row_order]
+
+        minute_keys, minute_index = np.unique(row_minutes, return_inverse=True)
+        count = len(minute_keys)
+
+        aggregation_type = self.aggregation_type
+        if aggregation_type == "weighted":
+            index = minute_index[row_has_value]
+            weights = row_weights[row_has_value]
+            total_weight = np.bincount(index, weights=weights, minlength=count)
+            total_value = np.bincount(
+                index, weights=row_values[row_has_value] * weights, minlength=count
+            )
+            nonzero = total_weight != 0
+            aggregated = np.zeros(count)
+            aggregated[nonzero] = total_value[nonzero] / total_weight[nonzero]
+        elif aggregation_type in ("average", "sum"):
+            aggregated = np.bincount(minute_index, weights=row_values, minlength=count)
+            if aggregation_type == "average":
+                aggregated = aggregated / np.bincount(minute_index, minlength=count)
+        elif aggregation_type in ("minimum", "min", "maximum", "max"):
+            ufunc = np.minimum if aggregation_type in ("minimum", "min") else np.maximum
+            starts = np.flatnonzero(np.r_[True, row_minutes[1:] != row_minutes[:-1]])
+            aggregated = ufunc.reduceat(row_values, starts)
+        else:
+            return {}
+
+        return {
+            datetime.datetime.utcfromtimestamp(int(minute) * 60): float(value)
+            for minute, value in zip(minute_keys, aggregated)
+        }
+
+
+def _minute_aggregation(
+    source: "ZMON", since: Optional[datetime.datetime] = None
+) -> _MinuteAggregation:
+    if np is not None and VECTORIZED_AGGREGATION:
+        return _VectorizedMinuteAggregation(source, since)
+
+    return _MinuteAggregation(source, since)
+
+
+class _PushdownAggregation(_MinuteAggregation):
+    """Collects per-minute values already aggregated by KairosDB."""
+
+    def slot(self, group: Dict) -> Optional[Tuple[Tuple[str, str], str]]:
+        return (None, None), "value"
+
+    def add(self, slot: Tuple[Tuple[str, str], str], ts: int, value) -> None:
+        minute = datetime.datetime.utcfromtimestamp((ts // 60000) * 60)
+        if self.since and minute < self.since:
+            return
+
+        self._minutes[minute] = value
+
+    def result(self) -> Dict:
+        return dict(self._minutes)
+
+
+def _tag_group(group_by: List[Dict]) -> Dict:
+    for group in group_by:
+        if group.get("name") == "tag":
+            return group.get("group", {})
+    return {}
+
+
+def _fold(
+    aggregations: List[_MinuteAggregation], results: Iterable[kairosdb.ResultGroup]
+) -> None:
+    """Fold streamed result groups into each aggregation, consuming every group once."""
+    for group_by, points in results:
+        group = _tag_group(group_by)
+
+        slots = [(agg, agg.slot(group)) for agg in aggregations]
+        slots = [(agg, slot) for agg, slot in slots if slot is not None]
+        if not slots:
+            continue
+
+        if len(slots) == 1:
+            agg, slot = slots[0]
+            agg.add_points(slot, points)
+        else:
+            points = list(points)
+            for agg, slot in slots:
+                agg.add_points(slot, points)
+
+
+def _aggregate(aggregations: List[_MinuteAggregation], q: Optional[Dict]) -> List[Dict]:
+    if q is not None:
+        kairosdb.get_client().query_sliced(q, lambda results: _fold(aggregations, results))
+
+    return [agg.result() for agg in aggregations]
+
+
 class ZMON(Source):
+    supports_async = True
+
     @classmethod
     def validate_config(cls, config: Dict):
         required = {"aggregation", "check_id", "keys"}
@@ -122,20 +809,20 @@ class ZMON(Source):
                 "SLI 'source' aggregation type *weighted* must have *weight_keys*",
             )
 
-    @classmethod
-    def delete_all_indicator_values(self, timerange: TimeRange) -> int:
-        from_dt, to_dt = timerange.to_datetimes()
-        count = IndicatorValue.query.filter(
-            IndicatorValue.timestamp >= from_dt, IndicatorValue.timestamp <= to_dt
-        ).delete()
-        db.session.commit()
-
-        return count
+        update_interval = config.get("update_interval")
+        if update_interval is not None and (
+            not isinstance(update_interval, int) or isinstance(update_interval, bool) or update_interval < 60
+        ):
+            raise SourceError(
+                "SLI 'source' *update_interval* must be an integer of at least 60 seconds",
+            )
 
     def __init__(
         self, indicator, check_id, keys, aggregation, tags=None, exclude_keys=(),
+        update_interval=None,
     ):
         self.indicator = indicator
+        self.update_interval = update_interval
 
         self.check_id = check_id
         self.keys = keys
@@ -144,6 +831,13 @@ class ZMON(Source):
         self.exclude_keys = exclude_keys
         self.tags = tags or {}
 
+        # Compiled once per source, result groups are matched against these
+        self.exclude_matcher = _KeyMatcher(exclude_keys)
+        self.weight_matcher = _KeyMatcher(aggregation.get("weight_keys", []))
+        self._tag_filter = {
+            name: set(_as_list(allowed)) for name, allowed in self._kairosdb_tags().items()
+        }
+
     def get_indicator_values(
         self,
         timerange: TimeRange = TimeRange.DEFAULT,
@@ -152,186 +846,370 @@ class ZMON(Source):
         per_page: Optional[int] = None,
     ) -> Tuple[List[IndicatorValueLike], Optional[Pagination]]:
         start_dt, end_dt = timerange.to_datetimes()
-        query = IndicatorValue.query.filter(
-            IndicatorValue.indicator_id == self.indicator.id,
-            IndicatorValue.timestamp >= start_dt,
-            IndicatorValue.timestamp < end_dt,
-        ).order_by(IndicatorValue.timestamp)
+
+        # Minutes expire before the hourly and daily rollups, read the finest tier still covering the range
+        table = rollups.finest_table(start_dt)
+
+        if table == rollups.MINUTES and archive.is_archived(start_dt):
+            # Stored and archived minutes
+            minutes = archive.MINUTES_SQL.columns(
+                timestamp=db.DateTime(), value=db.Float()
+            ).alias("minutes")
+            query = (
+                db.session.query(minutes.c.timestamp, minutes.c.value)
+                .params(indicator_id=self.indicator.id, start=start_dt, end=end_dt)
+                .order_by(minutes.c.timestamp)
+            )
+        else:
+            model = {
+                rollups.MINUTES: IndicatorValue,
+                rollups.HOURLY: rollups.IndicatorValueHourly,
+                rollups.DAILY: rollups.IndicatorValueDaily,
+            }[table]
+            query = model.query.filter(
+                model.indicator_id == self.indicator.id,
+                model.timestamp >= start_dt,
+                model.timestamp < end_dt,
+            ).order_by(model.timestamp)
+
         if page and per_page:
             query = query.paginate(page=page, per_page=per_page, error_out=False)
 
             return (
-                list(query.items),
+                self._tier_values(query.items),
                 query,
             )
         else:
-            return list(query.all()), None
+            return self._tier_values(query.all()), None
+
+    def _tier_values(self, rows: List) -> List[IndicatorValueLike]:
+        if not rows or isinstance(rows[0], IndicatorValue):
+            return list(rows)
+
+        if not isinstance(rows[0], (rollups.IndicatorValueHourly, rollups.IndicatorValueDaily)):
+            # Rows of stored and archived minutes
+            return [PureIndicatorValue(row.timestamp, row.value) for row in rows]
+
+        # An hour or day is represented by the SLI's aggregation of its minutes
+        aggregation = _AGGREGATION_TYPES_NORMALIZED.get(self.indicator.aggregation, "avg")
+        return [
+            PureIndicatorValue(
+                row.timestamp,
+                row.sum / row.count if aggregation == "avg" else getattr(row, aggregation),
+            )
+            for row in rows
+        ]
 
     def get_indicator_value_aggregates(
         self, timerange: TimeRange, resolution: Resolution
     ) -> Dict:
         aggregates = {resolution: [], Resolution.TOTAL: None}
 
-        indicator_values, _ = self.get_indicator_values(timerange)
-        if not indicator_values:
+        # Per day summaries from the rollups, instead of every minute
+        start_dt, end_dt = timerange.to_datetimes()
+        days = rollups.get_daily_summaries(db.session, self.indicator.id, start_dt, end_dt)
+        if not days:
             return aggregates
 
         normalized_aggregation = _AGGREGATION_TYPES_NORMALIZED[
             self.indicator.aggregation
         ]
+        unit_end = {
+            Resolution.DAILY: lambda ts: ts + datetime.timedelta(days=1),
+            Resolution.WEEKLY: lambda ts: ts + datetime.timedelta(weeks=1),
+        }[resolution]
+
         aggregates[resolution] = [
-            IndicatorValueAggregate.from_indicator_values(
-                timestamp, list(grouped_values), normalized_aggregation,
+            self._summarize(
+                timestamp,
+                list(grouped_days),
+                normalized_aggregation,
+                max(timestamp, start_dt),
+                min(unit_end(timestamp), end_dt),
             )
-            for timestamp, grouped_values in itertools.groupby(
-                indicator_values,
-                lambda value: truncate_datetime(value.timestamp, resolution.unit),
+            for timestamp, grouped_days in itertools.groupby(
+                days, lambda day: truncate_datetime(day[0], resolution.unit),
             )
         ]
 
-        aggregates[Resolution.TOTAL] = IndicatorValueAggregate.from_indicator_values(
-            indicator_values[0].timestamp, indicator_values, normalized_aggregation
+        aggregates[Resolution.TOTAL] = self._summarize(
+            days[0][0], days, normalized_aggregation, start_dt, end_dt
         )
 
         return aggregates
 
-    def _get_start_relative_for_update(self) -> int:
-        now = datetime.datetime.utcnow()
-        newest_dt = now - datetime.timedelta(minutes=MAX_QUERY_TIME_SLICE)
+    def _summarize(
+        self,
+        timestamp: datetime.datetime,
+        days: List[Tuple],
+        aggregation: str,
+        start: datetime.datetime,
+        end: datetime.datetime,
+    ) -> IndicatorValueAggregate:
+        min_ = min(day[3] for day in days)
+        max_ = max(day[4] for day in days)
 
-        newest_iv = (
-            IndicatorValue.query.with_entities(
-                db.func.max(IndicatorValue.timestamp).label("timestamp")
+        def count_breaches(target_from: float, target_to: float) -> int:
+            if target_from <= min_ and max_ <= target_to:
+                return 0
+
+            return rollups.count_breaches(
+                db.session, self.indicator.id, start, end, target_from, target_to
+            )
+
+        return IndicatorValueAggregate.from_summary(
+            timestamp,
+            aggregation,
+            sum(day[1] for day in days),
+            sum(day[2] for day in days),
+            min_,
+            max_,
+            # Breaches are counted in minutes, unknown once they expired
+            count_breaches=count_breaches if rollups.finest_table(start) == rollups.MINUTES else None,
+        )
+
+    def _get_newest_timestamp(self) -> Optional[datetime.datetime]:
+        # The watermark is loaded along with the indicator. Values spooled while the database
+        # was unavailable are newer than it.
+        spooled = self.spool.newest(self.indicator.id) if self.spool is not None else None
+        watermark = self.indicator.watermark
+        if watermark is not None or spooled is not None:
+            return max(
+                (ts for ts in (spooled, watermark and watermark.last_timestamp) if ts is not None),
+                default=None,
             )
+
+        # Indicators which were not updated since the watermark was introduced
+        now = datetime.datetime.utcnow()
+        newest_iv = (
+            self._session()
+            .query(db.func.max(IndicatorValue.timestamp).label("timestamp"))
             .filter(
-                IndicatorValue.timestamp >= newest_dt,
+                IndicatorValue.timestamp >= now - datetime.timedelta(minutes=MAX_QUERY_TIME_SLICE),
                 IndicatorValue.timestamp < now,
                 IndicatorValue.indicator_id == self.indicator.id,
             )
             .first()
         )
-        if not getattr(newest_iv, "timestamp", None):
-            return MAX_QUERY_TIME_SLICE
 
-        return (now - newest_iv.timestamp).seconds // 60 + 5  # add some overlapping
+        return getattr(newest_iv, "timestamp", None)
 
-    def _query_kairosdb(self, start, end=None):
-        aggregation_type = self.aggregation["type"]
-        weight_keys = self.aggregation.get("weight_keys", [])
+    def _get_start_relative_for_update(self) -> int:
+        now = datetime.datetime.utcnow()
+        newest_dt = now - datetime.timedelta(minutes=MAX_QUERY_TIME_SLICE)
 
-        kairosdb_metric_name = "zmon.check.{}".format(self.check_id)
+        newest_timestamp = self._get_newest_timestamp()
+        if not newest_timestamp or not newest_dt <= newest_timestamp < now:
+            return MAX_QUERY_TIME_SLICE
 
-        token = zign.api.get_token("zmon", ["uid"])
-        headers = {"Authorization": "Bearer {}".format(token)}
+        return (now - newest_timestamp).seconds // 60 + 5  # add some overlapping
 
-        session = requests.Session()
-        session.headers.update(headers)
+    def _kairosdb_tags(self) -> Dict:
+        weight_keys = self.aggregation.get("weight_keys", [])
 
         tags = {"key": self.keys + weight_keys}
         if self.tags:
             tags.update(self.tags)
 
-        q = {
-            "start_relative": {"value": start, "unit": "minutes"},
-            "metrics": [
-                {
-                    "name": kairosdb_metric_name,
-                    "tags": tags,
-                    "limit": KAIROS_QUERY_LIMIT,
-                    "group_by": [{"name": "tag", "tags": ["entity", "key"]}],
-                }
-            ],
-        }
+        return tags
+
+    def _accepts_group(self, group: Dict) -> bool:
+        # Result groups of a shared query may belong to other indicators of the same check
+        for name, allowed in self._tag_filter.items():
+            if name in group and group[name] not in allowed:
+                return False
+        return True
+
+    def _pushdown_keys(self) -> Optional[List[str]]:
+        """
+        Keys to query when KairosDB can compute the aggregation, ``None`` if it cannot.
+
+        KairosDB reduces all datapoints of a minute at once, which only matches the per
+        entity and key aggregation done in Python when every key prefix is distinct.
+        """
+        if not KAIROSDB_AGGREGATION_PUSHDOWN or self.aggregation["type"] == "weighted":
+            return None
+
+        keys = [
+            key
+            for key in self.keys + self.aggregation.get("weight_keys", [])
+            if not self.exclude_matcher(key)
+        ]
+        prefixes = [".".join(key.split(".")[:-1]) for key in keys]
+        if len(set(prefixes)) != len(prefixes):
+            return None
+
+        return keys
+
+    def _kairosdb_request(self, start, end=None) -> Tuple[Optional[Dict], _MinuteAggregation]:
+        """Query and aggregation for the given relative minutes, no query is needed if ``None``."""
+        now = datetime.datetime.utcnow()
+        start_dt = now - datetime.timedelta(minutes=start)
+        end_dt = now - datetime.timedelta(minutes=end or 0)
+
+        pushdown_keys = self._pushdown_keys()
+        if pushdown_keys is not None:
+            if not pushdown_keys:
+                return None, _PushdownAggregation(self)
+
+            tags = self._kairosdb_tags()
+            tags["key"] = pushdown_keys
+            aggregator = _AGGREGATION_TYPES_NORMALIZED[self.aggregation["type"]]
+            q = _kairosdb_query(
+                self.check_id, tags, start_dt, end_dt, aggregator=aggregator
+            )
+
+            return q, _PushdownAggregation(self)
+
+        q = _kairosdb_query(self.check_id, self._kairosdb_tags(), start_dt, end_dt)
+
+        return q, _minute_aggregation(self)
+
+    def _query_kairosdb(self, start, end=None):
+        q, aggregation = self._kairosdb_request(start, end)
 
-        if end:
-            q["end_relative"] = {"value": end, "unit": "minutes"}
+        return _aggregate([aggregation], q)[0]
 
-        # TODO: make this part smarter.
-        # If we fail with 500 then may be consider graceful retries with smaller intervals!
-        response = session.post(
-            KAIROSDB_URL + "/api/v1/datapoints/query", json=q, timeout=55
+    def batch_key(self):
+        # Pushed down queries are already reduced per indicator, they cannot be shared
+        if self._pushdown_keys() is not None:
+            return None
+
+        return self.check_id
+
+    @classmethod
+    def _batch_kairosdb_request(
+        cls, batch: List["ZMON"], starts: List[int]
+    ) -> Tuple[Optional[Dict], List[_MinuteAggregation]]:
+        """
+        One query for all sources sharing a check, covering the union of their keys and
+        tags, and an aggregation per source the result groups are fanned out to.
+        """
+        if len(batch) == 1:
+            q, aggregation = batch[0]._kairosdb_request(starts[0])
+            return q, [aggregation]
+
+        now = datetime.datetime.utcnow()
+
+        tags, group_by_tags = _merge_tag_filters(
+            [source._kairosdb_tags() for source in batch]
         )
-        response.raise_for_status()
+        q = _kairosdb_query(
+            batch[0].check_id,
+            tags,
+            now - datetime.timedelta(minutes=max(starts)),
+            now,
+            group_by_tags,
+        )
+        aggregations = [
+            _minute_aggregation(
+                source,
+                since=(now - datetime.timedelta(minutes=start)).replace(
+                    second=0, microsecond=0
+                ),
+            )
+            for source, start in zip(batch, starts)
+        ]
 
-        data = response.json()
+        return q, aggregations
 
-        res = {}
-        for result in data["queries"][0]["results"]:
-            if not result.get("values"):
-                continue
+    @classmethod
+    def _batch_kairosdb_requests(
+        cls, batch: List["ZMON"]
+    ) -> List[Tuple[List["ZMON"], Optional[Dict], List[_MinuteAggregation]]]:
+        """Requests per start bucket (``_BATCH_START_BUCKETS``) of the sources sharing a check."""
+        buckets = collections.defaultdict(list)
+        for source in batch:
+            start = source._get_start_relative_for_update()
+            buckets[bisect.bisect_left(_BATCH_START_BUCKETS, start)].append((source, start))
 
-            group = result["group_by"][0]["group"]
-            key = group["key"]
+        requests = []
+        for bucket in sorted(buckets):
+            sources, starts = zip(*buckets[bucket])
+            requests.append((list(sources), *cls._batch_kairosdb_request(list(sources), list(starts))))
 
-            exclude = _key_matches(key, self.exclude_keys)
+        return requests
 
-            if not exclude:
-                for ts, value in result["values"]:
-                    # truncate to full minutes
-                    minute = datetime.datetime.utcfromtimestamp((ts // 60000) * 60)
-                    if minute not in res:
-                        res[minute] = {}
+    @classmethod
+    def fetch_batch_indicator_values(cls, batch: List["ZMON"]) -> List[Dict]:
+        results = {}
+        for sources, q, aggregations in cls._batch_kairosdb_requests(batch):
+            results.update(zip(map(id, sources), _aggregate(aggregations, q)))
 
-                    g = group["entity"], ".".join(key.split(".")[:-1])
-                    if g not in res[minute]:
-                        res[minute][g] = {}
+        return [results[id(source)] for source in batch]
 
-                    if aggregation_type == "weighted" and _key_matches(
-                        key, weight_keys
-                    ):
-                        res[minute][g]["weight"] = value
-                    else:
-                        res[minute][g]["value"] = value
+    @classmethod
+    async def fetch_batch_indicator_values_async(cls, batch: List["ZMON"], http) -> List[Dict]:
+        def batch_requests():
+            try:
+                return cls._batch_kairosdb_requests(batch)
+            finally:
+                # The executor thread's session of the updater, see ``get_source_batches``
+                updater_session.remove()
 
-        result = {}
-        for minute, values in res.items():
-            if aggregation_type == "weighted":
-                total_weight = 0
-                total_value = 0
-                for g, entry in values.items():
-                    if "value" in entry:
-                        val = entry["value"]
-                        weight = entry.get(
-                            "weight", 1
-                        )  # In case weight was not available!
+        # Sources without watermark query their newest value from the database
+        queries = await asyncio.get_running_loop().run_in_executor(None, batch_requests)
+        client = kairosdb.AsyncKairosDBClient(http)
 
-                        total_weight += weight
-                        total_value += val * weight
-                if total_weight != 0:
-                    result[minute] = total_value / total_weight
-                else:
-                    result[minute] = 0
-            # TODO: aggregate in Kairosdb query?!
-            elif aggregation_type == "average":
-                total_value = 0
-                for g, entry in values.items():
-                    total_value += entry["value"]
-                result[minute] = total_value / len(values)
-            # TODO: aggregate in Kairosdb query?!
-            elif aggregation_type == "sum":
-                total_value = 0
-                for g, entry in values.items():
-                    total_value += entry["value"]
-                result[minute] = total_value
-            elif aggregation_type in ("minimum", "min"):
-                result[minute] = min([entry["value"] for g, entry in values.items()])
-            elif aggregation_type in ("maximum", "max"):
-                result[minute] = max([entry["value"] for g, entry in values.items()])
+        results = {}
+        for sources, q, aggregations in queries:
+            if q is not None:
+                await client.query_sliced(
+                    q, lambda groups, aggregations=aggregations: _fold(aggregations, groups)
+                )
+            results.update(zip(map(id, sources), [agg.result() for agg in aggregations]))
 
-        return result
+        return [results[id(source)] for source in batch]
 
-    @trace(pass_span=True)
-    def update_indicator_values(
-        self, timerange: TimeRange = TimeRange.DEFAULT, **kwargs,
-    ):
-        start, end = timerange.to_relative_minutes()
-        start = start or self._get_start_relative_for_update()
-        result = self._query_kairosdb(start, end)
+    def _session(self):
+        return self.session if self.session is not None else db.session
+
+    def _stored_overlap(self, result: Dict) -> List[datetime.datetime]:
+        """
+        Fetched minutes which may be stored already, i.e. the overlap of an update with the
+        minutes up to the watermark. Only this window is read before writing, newer minutes
+        are written as they are.
+        """
+        watermark = self.indicator.watermark
+        if watermark is None or watermark.last_timestamp is None:
+            return []
+
+        return [minute for minute in result if minute <= watermark.last_timestamp]
+
+    def _writable(self, result: Dict) -> Dict:
+        """The fetched values within the partitions, others are dropped."""
+        writable = partitions.writable_values(result)
+
+        dropped = len(result) - len(writable)
+        if dropped:
+            INDICATOR_VALUE_ROWS.labels("dropped").inc(dropped)
+            logger.warning(
+                "Dropped {} values of indicator {} outside the stored range".format(dropped, self.indicator.id)
+            )
+
+        return writable
+
+    def _insert_indicator_values(self, result: Dict, current_span) -> int:
+        """Store the fetched values, returns their number (whether they changed or not)."""
+        session = self._session()
         if not result:
+            update_indicator_watermark(session, self.indicator.id, None)
+            session.commit()  # pylint: disable=no-member
             return 0
 
-        session = db.session
-        current_span = extract_span_from_kwargs(**kwargs)
+        # Every update overlaps with already stored minutes, which mostly did not change
+        changed = result
+        overlap = self._stored_overlap(result)
+        if overlap:
+            changed = changed_values(
+                result, get_stored_values(session, self.indicator.id, min(overlap), max(overlap))
+            )
+        INDICATOR_VALUE_ROWS.labels("skipped").inc(len(result) - len(changed))
+        if not changed:
+            update_indicator_watermark(session, self.indicator.id, max(result))
+            session.commit()  # pylint: disable=no-member
+            return len(result)
+
         insert_span = opentracing.tracer.start_span(
             operation_name="insert_indicator_values", child_of=current_span
         )
@@ -340,20 +1218,89 @@ class ZMON(Source):
                 "indicator_id", self.indicator.id
             )
         )
-        insert_span.log_kv({"result_count": len(result)})
+        insert_span.log_kv({"result_count": len(result), "changed_count": len(changed)})
 
+        t_start = time.monotonic()
         with insert_span:
-            for minute, val in result.items():
-                if val > 0:
-                    val = max(val, _MIN_VAL)
-                elif val < 0:
-                    val = min(val, _MIN_VAL * -1)
-
-                iv = IndicatorValue(
-                    timestamp=minute, value=val, indicator_id=self.indicator.id
-                )
-                insert_indicator_value(session, iv)
+            archive.restore(session, self.indicator.id, min(changed), max(changed))
+
+            if len(changed) >= BACKFILL_COPY_THRESHOLD:
+                ingest_mode = "copy"
+                count = copy_indicator_values(session, self.indicator.id, changed)
+            else:
+                ingest_mode = "batch"
+                count = insert_indicator_values(session, self.indicator.id, changed)
+            insert_span.set_tag("ingest_mode", ingest_mode)
+
+            rollups.refresh_rollups(session, self.indicator.id, min(changed), max(changed))
+
+            update_indicator_watermark(session, self.indicator.id, max(result))
 
         session.commit()  # pylint: disable=no-member
 
+        UPSERT_SECONDS.labels(ingest_mode).observe(time.monotonic() - t_start)
+        ROWS_WRITTEN.observe(count)
+        INDICATOR_VALUE_ROWS.labels("written").inc(count)
+        INDICATOR_VALUE_ROWS.labels("skipped").inc(len(changed) - count)
+
         return len(result)
+
+    async def store_indicator_values_async(self, conn, result: Dict) -> int:
+        result = self._writable(result)
+
+        t_start = time.monotonic()
+        async with conn.transaction():
+            changed = result
+            overlap = self._stored_overlap(result)
+            if overlap:
+                stored = await get_stored_values_async(
+                    conn, self.indicator.id, min(overlap), max(overlap)
+                )
+                changed = changed_values(result, stored)
+
+            if changed:
+                await archive.restore_async(conn, self.indicator.id, min(changed), max(changed))
+
+            count = await upsert_indicator_values_async(conn, self.indicator.id, changed)
+            if changed:
+                await rollups.refresh_rollups_async(
+                    conn, self.indicator.id, min(changed), max(changed)
+                )
+            await update_indicator_watermark_async(
+                conn, self.indicator.id, max(result) if result else None
+            )
+
+        UPSERT_SECONDS.labels("async").observe(time.monotonic() - t_start)
+        ROWS_WRITTEN.observe(count)
+        INDICATOR_VALUE_ROWS.labels("written").inc(count)
+        INDICATOR_VALUE_ROWS.labels("skipped").inc(len(result) - count)
+
+        return len(result)
+
+    def _store_or_spool(self, result: Dict, current_span) -> int:
+        result = self._writable(result)
+        try:
+            return self._insert_indicator_values(result, current_span)
+        except Exception as e:
+            if self.spool is None or not spool.is_db_unavailable(e):
+                raise
+
+            # Keep the fetched values until the database is back, rather than fetching them again
+            self._session().rollback()
+            self.spool.append(self.indicator.id, result)
+
+            return 0
+
+    @trace(pass_span=True)
+    def store_indicator_values(self, result: Dict, **kwargs) -> int:
+        return self._store_or_spool(result, extract_span_from_kwargs(**kwargs))
+
+    @trace(pass_span=True)
+    def update_indicator_values(
+        self, timerange: TimeRange = TimeRange.DEFAULT, **kwargs,
+    ):
+        start, end = timerange.to_relative_minutes()
+        start = start or self._get_start_relative_for_update()
+        result = self._query_kairosdb(start, end)
+
+        return self._store_or_spool(result, extract_span_from_kwargs(**kwargs))
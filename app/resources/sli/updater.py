@@ -1,56 +1,249 @@
+import collections
 import logging
-import os
-import warnings
+from typing import Iterator, List
 
+import gevent
 from flask import Flask
 from gevent.pool import Pool
+from sqlalchemy import exc
 
-from app.config import UPDATER_CONCURRENCY
+from app.config import UPDATER_CONCURRENCY, UPDATER_SPOOL_REPLAY_INTERVAL
+from app.extensions import updater_session
+from app.libs.metrics import SPOOLED_ROWS, UPDATER_BUSY, observe_ingestion_lag
+from app.resources.product.models import Product
 
-from . import sources
-from .models import Indicator
+from . import partitions, sources
+from .models import Indicator, IndicatorRow, IndicatorWatermark, WatermarkRow
+from .sources.spool import Spool, get_spool
+from .sources.zmon import write_indicator_values
 
 logger = logging.getLogger(__name__)
 
 updater_pool = Pool(UPDATER_CONCURRENCY)
+UPDATER_BUSY.set_function(lambda: len(updater_pool))
 
 
 def update_all_indicators(app: Flask):
     """
     Update all indicators async!
+
+    Indicators whose sources can share an upstream query (e.g. ZMON SLIs on the same check)
+    are updated together, so the query is only executed once per cycle. Ingestion watermarks
+    are loaded along with the indicators, so sources don't probe their newest values.
+    """
+    try:
+        batches = get_source_batches()
+    finally:
+        updater_session.remove()
+
+    for batch in batches:
+        updater_pool.spawn(update_sources, app, batch)
+
+    updater_pool.join()
+
+
+def get_source_batches() -> List[List[sources.Source]]:
+    """
+    Sources of all active indicators, grouped by the upstream query they can share. Sources
+    without a batch key are updated on their own.
+
+    All sources store their values with ``updater_session``, and spool them while the
+    database is unavailable (if enabled).
     """
-    if os.environ.get("SLR_LOCAL_ENV"):
-        warnings.warn("Running on local env while not setting up gevent properly!")
+    batches = collections.defaultdict(list)
+    singles = []
+    newest_timestamps = []
+    spool = get_spool()
 
-    for indicator in Indicator.query.all():
+    for indicator in get_active_indicators():
         try:
-            if indicator.is_deleted:
-                continue
-            updater_pool.spawn(update_indicator, app, indicator)
+            newest_timestamps.append(
+                indicator.watermark.last_timestamp if indicator.watermark else None
+            )
+
+            source = sources.from_indicator(indicator)
+            source.session = updater_session
+            source.spool = spool
+            batch_key = source.batch_key()
+            if batch_key is None:
+                singles.append([source])
+            else:
+                batches[(type(source), batch_key)].append(source)
         except Exception:
             logger.exception("Updater: Failed to spawn indicator updater!")
 
-    updater_pool.join()
+    observe_ingestion_lag(newest_timestamps)
 
+    return singles + list(batches.values())
+
+
+def get_active_indicators() -> Iterator[IndicatorRow]:
+    """Active indicators with their watermarks, as plain rows rather than ORM objects."""
+    query = (
+        updater_session.query(
+            Indicator.id,
+            Indicator.name,
+            Indicator.source,
+            Indicator.aggregation,
+            Product.name,
+            IndicatorWatermark.last_timestamp,
+            IndicatorWatermark.last_success,
+        )
+        .join(Product, Indicator.product_id == Product.id)
+        .outerjoin(IndicatorWatermark, IndicatorWatermark.indicator_id == Indicator.id)
+        .filter(Indicator.is_deleted.isnot(True))
+        .order_by(Indicator.id)
+        .yield_per(1000)
+    )
 
-def update_indicator(app: Flask, indicator: Indicator):
+    for id_, name, source, aggregation, product_name, last_timestamp, last_success in query:
+        yield IndicatorRow(
+            id=id_,
+            name=name,
+            source=source,
+            aggregation=aggregation,
+            product_name=product_name,
+            watermark=WatermarkRow(last_timestamp, last_success) if last_success else None,
+        )
+
+
+def update_sources(app: Flask, batch: List[sources.Source]) -> bool:
+    try:
+        if len(batch) == 1 and batch[0].batch_key() is None:
+            return update_indicator(app, batch[0])
+
+        return update_indicator_batch(app, batch)
+    finally:
+        # Return the greenlet's connection to the updater pool
+        updater_session.remove()
+
+
+def update_indicator(app: Flask, source: sources.Source) -> bool:
+    indicator = source.indicator
     logger.info(
         "Updater: Updating Indicator {} values for product {}".format(
-            indicator.name, indicator.product.name
+            indicator.name, indicator.product_name
         )
     )
 
     with app.app_context():
         try:
-            count = sources.from_indicator(indicator).update_indicator_values()
+            count = source.update_indicator_values()
             logger.info(
                 'Updater: Updated {} indicator values "{}" for product "{}"'.format(
-                    count, indicator.name, indicator.product.name
+                    count, indicator.name, indicator.product_name
                 )
             )
+        except sources.SourceUnavailableError as e:
+            logger.warning('Updater: Skipped indicator "{}": {}'.format(indicator.name, e))
+            return False
         except Exception:
             logger.exception(
                 'Updater: Failed to update indicator "{}" values for product "{}"'.format(
-                    indicator.name, indicator.product.name
+                    indicator.name, indicator.product_name
+                )
+            )
+            return False
+
+    return True
+
+
+def update_indicator_batch(app: Flask, batch: List[sources.Source]) -> bool:
+    logger.info(
+        "Updater: Updating {} indicators sharing query {}".format(
+            len(batch), batch[0].batch_key()
+        )
+    )
+
+    with app.app_context():
+        try:
+            results = type(batch[0]).fetch_batch_indicator_values(batch)
+        except sources.SourceUnavailableError as e:
+            logger.warning(
+                "Updater: Skipped indicators {}: {}".format(
+                    [source.indicator.name for source in batch], e
+                )
+            )
+            return False
+        except Exception:
+            logger.exception(
+                "Updater: Failed to query values for indicators {}".format(
+                    [source.indicator.name for source in batch]
+                )
+            )
+            return False
+
+        succeeded = True
+
+        for source, result in zip(batch, results):
+            indicator = source.indicator
+            try:
+                count = source.store_indicator_values(result)
+                logger.info(
+                    'Updater: Updated {} indicator values "{}" for product "{}"'.format(
+                        count, indicator.name, indicator.product_name
+                    )
                 )
+            except Exception:
+                updater_session.rollback()
+                logger.exception(
+                    'Updater: Failed to update indicator "{}" values for product "{}"'.format(
+                        indicator.name, indicator.product_name
+                    )
+                )
+                succeeded = False
+
+    return succeeded
+
+
+def replay_spool(spool: Spool) -> int:
+    """
+    Write spooled values to the database, values of deleted indicators and values outside the
+    partitions (e.g. dropped meanwhile) are dropped.
+    """
+
+    def store(indicator_id, values):
+        writable = partitions.writable_values(values)
+        if len(writable) < len(values):
+            SPOOLED_ROWS.labels('dropped').inc(len(values) - len(writable))
+            logger.warning(
+                'Updater: Dropped {} spooled values of indicator {} outside the stored range'.format(
+                    len(values) - len(writable), indicator_id
+                )
+            )
+        values = writable
+
+        try:
+            write_indicator_values(updater_session, indicator_id, values)
+            updater_session.commit()
+            SPOOLED_ROWS.labels('replayed').inc(len(values))
+        except exc.IntegrityError:
+            updater_session.rollback()
+            SPOOLED_ROWS.labels('dropped').inc(len(values))
+            logger.warning(
+                'Updater: Dropped {} spooled values of deleted indicator {}'.format(
+                    len(values), indicator_id
+                )
+            )
+        except Exception:
+            updater_session.rollback()
+            raise
+
+    try:
+        return spool.replay(store)
+    finally:
+        updater_session.remove()
+
+
+def run_spool_replayer(spool: Spool, interval: int = UPDATER_SPOOL_REPLAY_INTERVAL):
+    while True:
+        gevent.sleep(interval)
+
+        try:
+            count = replay_spool(spool)
+            if count:
+                logger.info('Updater: Replayed {} spooled indicator values'.format(count))
+        except Exception:
+            logger.exception(
+                'Updater: Failed to replay spooled values, retrying in {} seconds'.format(interval)
             )
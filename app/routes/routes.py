@@ -11,6 +11,7 @@ from app.libs.oauth import get_auth_app
 from app.config import APP_URL, OAUTH2_ENABLED, PRESHARED_TOKEN
 
 from app.extensions import set_token_info, oauth
+from app.libs.metrics import metrics
 
 
 LOGIN_AUTHORIZATION = '/login/authorized'
@@ -21,7 +22,7 @@ oauth.remote_apps['auth'] = auth
 
 
 def request_skip_span(*args, **kwargs):
-    return request.path == '/health'
+    return request.path in ('/health', '/metrics')
 
 
 def get_safe_redirect_uri(next_uri, default=''):
@@ -82,6 +83,7 @@ def authorized():
 
 ROUTES = {
     '/health': health,
+    '/metrics': metrics,
     '/login': login,
     LOGIN_AUTHORIZATION: authorized,
     '/logout': logout,
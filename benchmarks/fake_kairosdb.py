@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for KairosDB, answering ``/api/v1/datapoints/query`` with ZMON check shaped data.
+
+Every queried check reports ``--entities`` entities, each with a datapoint per minute for every
+queried key. Values are a function of entity, key and minute, so overlapping queries return the
+same datapoints, just like the real thing. Queries with aggregators (aggregation pushdown) get one
+group per key.
+
+    $ python -m benchmarks.fake_kairosdb --port 8081 --entities 100
+"""
+import argparse
+import json
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, Iterator, List
+
+MINUTE_MS = 60 * 1000
+# ZMON checks don't report exactly on the minute
+_REPORT_OFFSET_MS = 7000
+
+
+def value(entity: str, key: str, minute: int) -> float:
+    return (zlib.crc32('{}/{}'.format(entity, key).encode()) + minute * 7919) % 100000 / 100
+
+
+def minutes(q: Dict) -> range:
+    end = q.get('end_absolute') or int(time.time() * 1000)
+    start = q['start_absolute']
+
+    return range(-(-start // MINUTE_MS), -(-end // MINUTE_MS))
+
+
+def metric_results(metric: Dict, window: range, entities: int) -> Iterator[Dict]:
+    tags = metric.get('tags', {})
+    keys = tags.get('key') or ['value']
+    entity_names = tags.get('entity') or ['entity-{}'.format(i) for i in range(entities)]
+
+    if metric.get('aggregators'):
+        for key in keys:
+            yield {
+                'name': metric['name'],
+                'group_by': [{'name': 'tag', 'tags': ['key'], 'group': {'key': key}}],
+                'tags': {'key': [key]},
+                'values': [
+                    [m * MINUTE_MS, sum(value(e, key, m) for e in entity_names) / len(entity_names)]
+                    for m in window
+                ],
+            }
+        return
+
+    group_by_tags: List[str] = metric.get('group_by', [{}])[0].get('tags', ['entity', 'key'])
+    # Further tags of a shared check query, every entity reports their first filter value
+    extra = {tag: tags[tag][0] for tag in group_by_tags if tag not in ('entity', 'key') and tags.get(tag)}
+
+    for entity in entity_names:
+        for key in keys:
+            group = dict(extra, entity=entity, key=key)
+            yield {
+                'name': metric['name'],
+                'group_by': [{'name': 'tag', 'tags': group_by_tags, 'group': group}],
+                'tags': {name: [val] for name, val in group.items()},
+                'values': [[m * MINUTE_MS + _REPORT_OFFSET_MS, value(entity, key, m)] for m in window],
+            }
+
+
+def query_response(q: Dict, entities: int) -> Dict:
+    window = minutes(q)
+    queries = []
+
+    for metric in q['metrics']:
+        results = list(metric_results(metric, window, entities))
+        queries.append({
+            'sample_size': sum(len(result['values']) for result in results),
+            'results': results,
+        })
+
+    return {'queries': queries}
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(entities: int, latency: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            if self.path != '/api/v1/datapoints/query':
+                self.send_error(404)
+                return
+
+            q = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if latency:
+                time.sleep(latency)
+
+            body = json.dumps(query_response(q, entities)).encode()
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    argp = argparse.ArgumentParser(description='Fake KairosDB serving ZMON check datapoints')
+    argp.add_argument('--host', default='127.0.0.1')
+    argp.add_argument('--port', type=int, default=8081)
+    argp.add_argument('--entities', type=int, default=100, help='Entities reporting every check')
+    argp.add_argument('--latency', type=float, default=0, help='Seconds added to every query')
+
+    args = argp.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.entities, args.latency))
+    print('Fake KairosDB on http://{}:{} ({} entities)'.format(args.host, args.port, args.entities))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
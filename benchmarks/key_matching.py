@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of ZMON key matching on a synthetic 10k group KairosDB response.
+
+Compares the former per-datapoint ``fnmatch`` loop with the compiled matchers and per-group
+decisions used by ``_MinuteAggregation``.
+
+    $ SLR_LOCAL_ENV=true python -m benchmarks.key_matching --entities 1000 --keys 10
+"""
+import argparse
+import datetime
+import fnmatch
+import random
+import time
+from unittest.mock import MagicMock
+
+from app.resources.sli.sources import zmon
+
+EXCLUDE_KEYS = ['*.p50', 'internal.*', '*.debug.*']
+WEIGHT_KEYS = ['*.rate', '*.requests']
+
+
+def generate_results(entities, keys, minutes):
+    key_names = ['endpoint-{}.latency'.format(i) for i in range(keys - 1)] + ['endpoint.rate']
+    results = []
+
+    for entity in range(entities):
+        for key in key_names:
+            results.append({
+                'group_by': [{'name': 'tag', 'group': {'entity': 'app-{}'.format(entity), 'key': key}}],
+                'values': [[m * 60000, random.uniform(0, 100)] for m in range(minutes)],
+            })
+
+    return key_names, results
+
+
+def fnmatch_loop(results, exclude_keys, weight_keys):
+    """Previous implementation: patterns matched with fnmatch for every datapoint."""
+    def key_matches(key, key_patterns):
+        for pat in key_patterns:
+            if fnmatch.fnmatch(key, pat):
+                return True
+        return False
+
+    res = {}
+    for result in results:
+        group = result['group_by'][0]['group']
+        key = group['key']
+
+        if not key_matches(key, exclude_keys):
+            for ts, value in result['values']:
+                minute = datetime.datetime.utcfromtimestamp((ts // 60000) * 60)
+                if minute not in res:
+                    res[minute] = {}
+
+                g = group['entity'], '.'.join(key.split('.')[:-1])
+                if g not in res[minute]:
+                    res[minute][g] = {}
+
+                if key_matches(key, weight_keys):
+                    res[minute][g]['weight'] = value
+                else:
+                    res[minute][g]['value'] = value
+
+    return res
+
+
+def compiled(results, source):
+    aggregation = zmon._MinuteAggregation(source)
+    zmon._fold([aggregation], ((r['group_by'], iter(r['values'])) for r in results))
+
+    return aggregation._minutes
+
+
+def best_of(rounds, func, *args):
+    best = None
+    for _ in range(rounds):
+        t_start = time.perf_counter()
+        func(*args)
+        duration = time.perf_counter() - t_start
+        best = duration if best is None else min(best, duration)
+
+    return best
+
+
+def main():
+    argp = argparse.ArgumentParser(description='ZMON key matching micro-benchmark')
+    argp.add_argument('--entities', type=int, default=1000)
+    argp.add_argument('--keys', type=int, default=10, help='Keys per entity')
+    argp.add_argument('--minutes', type=int, default=10, help='Datapoints per group')
+    argp.add_argument('--rounds', type=int, default=3)
+
+    args = argp.parse_args()
+
+    keys, results = generate_results(args.entities, args.keys, args.minutes)
+    source = zmon.ZMON(
+        MagicMock(),
+        check_id=1,
+        keys=keys,
+        aggregation={'type': 'weighted', 'weight_keys': WEIGHT_KEYS},
+        exclude_keys=EXCLUDE_KEYS,
+    )
+
+    print('{} groups, {} datapoints'.format(len(results), len(results) * args.minutes))
+    for name, func, func_args in [
+        ('fnmatch per datapoint', fnmatch_loop, (results, EXCLUDE_KEYS, WEIGHT_KEYS)),
+        ('compiled per group', compiled, (results, source)),
+    ]:
+        print('{:<24} {:>8.1f} ms'.format(name, best_of(args.rounds, func, *func_args) * 1000))
+
+
+if __name__ == '__main__':
+    main()
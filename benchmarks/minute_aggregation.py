@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the per-minute ZMON aggregation: nested dicts vs. NumPy arrays.
+
+    $ SLR_LOCAL_ENV=true python -m benchmarks.minute_aggregation --entities 500 --type weighted
+"""
+import argparse
+from unittest.mock import MagicMock
+
+from app.resources.sli.sources import zmon
+
+from .key_matching import WEIGHT_KEYS, best_of, generate_results
+
+
+def aggregate(cls, results, source):
+    aggregation = cls(source)
+    zmon._fold([aggregation], ((r['group_by'], iter(r['values'])) for r in results))
+
+    return aggregation.result()
+
+
+def main():
+    argp = argparse.ArgumentParser(description='ZMON minute aggregation micro-benchmark')
+    argp.add_argument('--entities', type=int, default=500)
+    argp.add_argument('--keys', type=int, default=4, help='Keys per entity')
+    argp.add_argument('--minutes', type=int, default=60, help='Datapoints per group')
+    argp.add_argument('--type', default='weighted', help='Aggregation type')
+    argp.add_argument('--rounds', type=int, default=3)
+
+    args = argp.parse_args()
+
+    keys, results = generate_results(args.entities, args.keys, args.minutes)
+    source = zmon.ZMON(
+        MagicMock(), check_id=1, keys=keys, aggregation={'type': args.type, 'weight_keys': WEIGHT_KEYS}
+    )
+
+    assert aggregate(zmon._VectorizedMinuteAggregation, results, source) == aggregate(
+        zmon._MinuteAggregation, results, source
+    )
+
+    print('{} groups, {} datapoints'.format(len(results), len(results) * args.minutes))
+    for name, cls in [
+        ('nested dicts', zmon._MinuteAggregation),
+        ('numpy arrays', zmon._VectorizedMinuteAggregation),
+    ]:
+        print('{:<24} {:>8.1f} ms'.format(name, best_of(args.rounds, aggregate, cls, results, source) * 1000))
+
+
+if __name__ == '__main__':
+    main()
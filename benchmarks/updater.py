@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+End-to-end updater throughput: ``update_all_indicators`` against a fake KairosDB and a local database.
+
+Creates ``--checks`` x ``--indicators`` ZMON SLIs, starts ``benchmarks.fake_kairosdb`` on the port of
+``KAIROSDB_URL`` and runs the updater ``--rounds`` times. The first round backfills
+``SLR_MAX_QUERY_TIME_SLICE`` minutes, later rounds only fetch the minutes since the watermark. The
+SLIs and their values are deleted at the end.
+
+Note: The updater updates *all* active SLIs, use a database without other SLIs. Leave ``SLR_LOCAL_ENV``
+unset, so gevent is patched like in production.
+
+    $ DATABASE_URI=postgresql://postgres@localhost/slr KAIROSDB_URL=http://127.0.0.1:8081 \\
+        python -m benchmarks.updater --checks 20 --indicators 5 --entities 100
+"""
+import argparse
+import resource
+import socket
+import subprocess
+import sys
+import time
+from unittest import mock
+from urllib.parse import urlparse
+
+from app.config import KAIROSDB_URL
+from app.extensions import db
+from app.libs.metrics import indicator_value_rows
+from app.main import UPDATER_ENGINES, create_app
+from app.resources import Indicator, Product, ProductGroup
+
+NAME = 'bench-updater'
+AGGREGATIONS = ['average', 'weighted', 'sum', 'max']
+
+
+def start_kairosdb(entities, latency):
+    url = urlparse(KAIROSDB_URL)
+    server = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.fake_kairosdb',
+        '--host', url.hostname, '--port', str(url.port),
+        '--entities', str(entities), '--latency', str(latency),
+    ])
+
+    for _ in range(100):
+        try:
+            socket.create_connection((url.hostname, url.port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError('Fake KairosDB did not start on {}'.format(KAIROSDB_URL))
+
+
+def create_indicators(session, checks, indicators, keys):
+    group = ProductGroup(name=NAME, slug=NAME)
+    product = Product(name=NAME, slug=NAME, product_group=group)
+    session.add_all([group, product])
+
+    for check in range(checks):
+        for i in range(indicators):
+            endpoint = 'endpoint-{}'.format(i % keys)
+            aggregation = {'type': AGGREGATIONS[i % len(AGGREGATIONS)]}
+            if aggregation['type'] == 'weighted':
+                aggregation['weight_keys'] = [endpoint + '.rate']
+
+            session.add(Indicator(
+                name='{}-{}-{}'.format(NAME, check, i),
+                slug='{}-{}-{}'.format(NAME, check, i),
+                source={
+                    'type': 'zmon',
+                    'check_id': 100000 + check,
+                    'keys': [endpoint + '.latency'],
+                    'aggregation': aggregation,
+                },
+                product=product,
+            ))
+
+    session.commit()
+
+    return product
+
+
+def delete_indicators(session):
+    product = Product.query.filter_by(name=NAME).first()
+    if product is not None:
+        # Values and watermarks are deleted by cascade
+        Indicator.query.filter_by(product_id=product.id).delete()
+        session.delete(product)
+    ProductGroup.query.filter_by(name=NAME).delete()
+    session.commit()
+
+
+def peak_rss_mb():
+    # KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    argp = argparse.ArgumentParser(description='End-to-end updater throughput benchmark')
+    argp.add_argument('--checks', type=int, default=20, help='ZMON checks, SLIs of a check share a query')
+    argp.add_argument('--indicators', type=int, default=5, help='SLIs per check')
+    argp.add_argument('--keys', type=int, default=5, help='Distinct SLI keys per check')
+    argp.add_argument('--entities', type=int, default=100, help='Entities reporting every check')
+    argp.add_argument('--latency', type=float, default=0, help='Seconds the fake KairosDB adds to every query')
+    argp.add_argument('--rounds', type=int, default=2)
+    argp.add_argument('--engine', choices=sorted(UPDATER_ENGINES), default='gevent')
+    argp.add_argument(
+        '--external-kairosdb', action='store_true', help='Use the server at KAIROSDB_URL instead of starting one'
+    )
+
+    args = argp.parse_args()
+
+    if not KAIROSDB_URL:
+        argp.error('KAIROSDB_URL is not set')
+
+    server = None if args.external_kairosdb else start_kairosdb(args.entities, args.latency)
+    app = create_app()
+    update = UPDATER_ENGINES[args.engine]
+    total = args.checks * args.indicators
+
+    try:
+        with app.app_context(), mock.patch('zign.api.get_token', return_value='benchmark'):
+            delete_indicators(db.session)
+            create_indicators(db.session, args.checks, args.indicators, args.keys)
+            db.session.remove()
+
+            print('{} SLIs on {} checks, {} entities, {} engine'.format(
+                total, args.checks, args.entities, args.engine
+            ))
+            print('{:<6} {:>10} {:>14} {:>14} {:>14} {:>12}'.format(
+                'round', 'seconds', 'SLIs/sec', 'rows/sec', 'skipped', 'peak RSS MB'
+            ))
+
+            for i in range(args.rounds):
+                rows_before = indicator_value_rows()
+                t_start = time.perf_counter()
+                update(app)
+                duration = time.perf_counter() - t_start
+                rows = indicator_value_rows()
+
+                print('{:<6} {:>10.2f} {:>14.1f} {:>14.0f} {:>14} {:>12.0f}'.format(
+                    i + 1,
+                    duration,
+                    total / duration,
+                    (rows['written'] - rows_before['written']) / duration,
+                    rows['skipped'] - rows_before['skipped'],
+                    peak_rss_mb(),
+                ))
+
+            delete_indicators(db.session)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
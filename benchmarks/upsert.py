@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark indicator value upserts: row-by-row vs. multi-row ``INSERT ... ON CONFLICT`` vs. ``COPY``.
+
+Runs against the database configured in ``DATABASE_URI``. All rows are written inside a
+transaction which is rolled back at the end, so the benchmark leaves no data behind.
+
+    $ DATABASE_URI=postgresql://postgres@localhost/slr SLR_LOCAL_ENV=true \\
+        python -m benchmarks.upsert --minutes 1440 --rounds 3
+"""
+import argparse
+import datetime
+import random
+import time
+
+from app.extensions import db
+from app.main import create_app
+from app.resources import Indicator, Product, ProductGroup
+from app.resources.sli.sources.zmon import (
+    IndicatorValue,
+    _clamp_value,
+    copy_indicator_values,
+    insert_indicator_value,
+    insert_indicator_values,
+)
+
+
+def generate_values(minutes):
+    now = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+
+    return {
+        now - datetime.timedelta(minutes=i): random.uniform(0, 1000)
+        for i in range(minutes)
+    }
+
+
+def create_indicator(session):
+    group = ProductGroup(name='bench-upsert', slug='bench-upsert')
+    product = Product(name='bench-upsert', slug='bench-upsert', product_group=group)
+    indicator = Indicator(
+        name='bench-upsert', slug='bench-upsert', source={}, product=product
+    )
+    session.add_all([group, product, indicator])
+    session.flush()
+
+    return indicator
+
+
+def row_by_row(session, indicator_id, values):
+    for minute, val in values.items():
+        iv = IndicatorValue(
+            timestamp=minute, value=_clamp_value(val), indicator_id=indicator_id
+        )
+        insert_indicator_value(session, iv)
+
+
+def batched(batch_size):
+    def upsert(session, indicator_id, values):
+        insert_indicator_values(session, indicator_id, values, batch_size=batch_size)
+
+    return upsert
+
+
+def measure(session, indicator_id, values, upsert, rounds):
+    best = None
+
+    for _ in range(rounds):
+        nested = session.begin_nested()
+
+        t_start = time.perf_counter()
+        upsert(session, indicator_id, values)
+        # Twice: first pass inserts, second pass hits the ON CONFLICT path
+        upsert(session, indicator_id, values)
+        duration = time.perf_counter() - t_start
+
+        nested.rollback()
+
+        best = duration if best is None else min(best, duration)
+
+    return 2 * len(values) / best
+
+
+def main():
+    argp = argparse.ArgumentParser(description='Indicator value upsert benchmark')
+    argp.add_argument('--minutes', type=int, default=1440, help='Rows per indicator')
+    argp.add_argument('--rounds', type=int, default=3, help='Rounds per variant')
+    argp.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[100, 500, 1000, 5000]
+    )
+
+    args = argp.parse_args()
+
+    app = create_app()
+
+    with app.app_context():
+        session = db.session
+        try:
+            indicator = create_indicator(session)
+            values = generate_values(args.minutes)
+
+            variants = (
+                [('row-by-row', row_by_row)]
+                + [
+                    ('batched ({})'.format(size), batched(size))
+                    for size in args.batch_sizes
+                ]
+                + [('copy', copy_indicator_values)]
+            )
+
+            for name, upsert in variants:
+                rate = measure(session, indicator.id, values, upsert, args.rounds)
+                print('{:<20} {:>12.0f} rows/sec'.format(name, rate))
+        finally:
+            session.rollback()
+
+
+if __name__ == '__main__':
+    main()
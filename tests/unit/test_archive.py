@@ -0,0 +1,79 @@
+import datetime
+from unittest.mock import MagicMock
+
+from app.resources.sli.sources import archive
+
+NOW = datetime.datetime(2020, 1, 10, 15, 30)
+
+
+def day(d):
+    return datetime.datetime(2020, 1, d)
+
+
+def test_days_before_the_horizon_are_archived(monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_AFTER_DAYS', 7)
+
+    assert archive.archive_horizon(NOW) == day(3)
+    assert archive.is_archived(datetime.datetime(2020, 1, 2, 23, 59), NOW)
+    assert not archive.is_archived(day(3), NOW)
+
+    monkeypatch.setattr(archive, 'ARCHIVE_AFTER_DAYS', 0)
+
+    assert archive.archive_horizon(NOW) is None
+    assert not archive.is_archived(day(1), NOW)
+
+
+def test_restore_only_archived_ranges(monkeypatch):
+    monkeypatch.setattr(archive, 'ARCHIVE_AFTER_DAYS', 7)
+    session = MagicMock()
+
+    archive.restore(session, 1, datetime.datetime.utcnow(), datetime.datetime.utcnow())
+    session.execute.assert_not_called()
+
+    archive.restore(session, 1, day(1), day(2))
+    assert [call[0] for call in session.execute.call_args_list] == [
+        (archive._LOCK_NAMED_SQL, {'indicator_id': 1}),
+        (archive._RESTORE_NAMED_SQL, {'indicator_id': 1, 'start': day(1), 'end': day(2)}),
+    ]
+
+
+def test_archive_days_skips_empty_days_and_commits_per_slice(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr(archive.time, 'sleep', sleep)
+
+    session = MagicMock()
+    # Indicator 1 has values on days 1, 2 and 5, indicator 2 on day 3 only, day 8 is not over yet
+    days = [(1, day(1)), (1, day(2)), (1, day(5)), (2, day(3)), (2, day(8))]
+
+    def execute(statement, params=None):
+        if statement is archive._ARCHIVABLE_DAYS_SQL:
+            return days
+        if statement is archive._ARCHIVE_DAYS_SQL:
+            return MagicMock(rowcount=len([d for i, d in days if i == params['indicator_id']
+                                           and params['start'] <= d < params['end']]))
+        return MagicMock()
+
+    session.execute.side_effect = execute
+
+    assert archive.archive_days(
+        session, [1, 2, 3], datetime.datetime(2020, 1, 1, 12), datetime.datetime(2020, 1, 8, 12), slice_days=3
+    ) == 4
+
+    # Every slice is archived under the lock of its indicator
+    statements = [call[0][0] for call in session.execute.call_args_list[1:]]
+    assert statements == [archive._LOCK_NAMED_SQL, archive._ARCHIVE_DAYS_SQL] * 3
+    slices = [
+        (call[0][1]['indicator_id'], call[0][1]['start'], call[0][1]['end'])
+        for call in session.execute.call_args_list[2::2]
+    ]
+    assert slices == [(1, day(1), day(4)), (1, day(5), day(8)), (2, day(3), day(6))]
+    assert session.commit.call_count == 4
+    assert sleep.call_count == 3
+
+
+def test_minutes_are_read_from_both_tables():
+    sql = archive.minutes_sql('1', "'2020-01-01'", "'2020-01-02'")
+
+    assert 'FROM indicatorvalue\n' in sql
+    assert 'FROM indicatorvalue_archive' in sql
+    assert 'UNION ALL' in sql
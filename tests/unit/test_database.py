@@ -0,0 +1,98 @@
+import time
+
+import gevent
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+from app.extensions import init_updater_session, updater_session
+from app.libs.metrics import TimedQueuePool, instrument_pool
+
+# Simulated round trip of an updater query, greenlets yield while waiting for it
+DB_WAIT = 0.2
+UPDATERS = 4
+
+
+def sample(name, pool):
+    return REGISTRY.get_sample_value(name, {'pool': pool}) or 0
+
+
+@pytest.fixture
+def updater_engine():
+    engine = init_updater_session('sqlite://', pool_size=UPDATERS)
+    instrument_pool('updater', engine)
+
+    yield engine
+
+    updater_session.remove()
+    engine.dispose()
+
+
+@pytest.fixture
+def api_engine():
+    engine = create_engine('sqlite://', poolclass=TimedQueuePool, pool_size=1, max_overflow=0)
+    instrument_pool('default', engine)
+
+    yield engine
+
+    engine.dispose()
+
+
+def test_updater_greenlets_overlap_db_waits_without_starving_api(updater_engine, api_engine):
+    updater_waits = sample('slr_db_pool_checkout_wait_seconds_count', 'updater')
+    api_waits = sample('slr_db_pool_checkout_wait_seconds_count', 'default')
+    api_waited = sample('slr_db_pool_checkout_wait_seconds_sum', 'default')
+    sessions = []
+
+    def update():
+        try:
+            session = updater_session()
+            sessions.append(session)
+            session.execute(text('SELECT 1'))
+            gevent.sleep(DB_WAIT)
+            session.commit()
+        finally:
+            updater_session.remove()
+
+    def api_request():
+        # All updater connections are checked out meanwhile
+        checked_out = updater_engine.pool.checkedout()
+        t_start = time.monotonic()
+        with api_engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+        return checked_out, time.monotonic() - t_start
+
+    t_start = time.monotonic()
+    updaters = [gevent.spawn(update) for _ in range(UPDATERS)]
+    gevent.sleep(DB_WAIT / 4)
+    checked_out, api_duration = gevent.spawn(api_request).get()
+    gevent.joinall(updaters, raise_error=True)
+    duration = time.monotonic() - t_start
+
+    # One session per greenlet, all of them waiting at the same time
+    assert len({id(session) for session in sessions}) == UPDATERS
+    assert duration < 2 * DB_WAIT
+
+    # The API checkout does not wait behind the saturated updater pool
+    assert checked_out == UPDATERS
+    assert api_duration < DB_WAIT / 4
+    assert sample('slr_db_pool_checkout_wait_seconds_count', 'default') - api_waits == 1
+    assert sample('slr_db_pool_checkout_wait_seconds_sum', 'default') - api_waited < DB_WAIT / 4
+
+    assert sample('slr_db_pool_checkout_wait_seconds_count', 'updater') - updater_waits == UPDATERS
+    assert updater_engine.pool.checkedout() == 0
+
+
+def test_updater_pool_is_instrumented_through_pool_events(updater_engine):
+    holds_before = sample('slr_db_pool_connection_hold_seconds_count', 'updater')
+    connects_before = sample('slr_db_pool_connects_total', 'updater')
+
+    for _ in range(3):
+        updater_session.execute(text('SELECT 1'))
+        assert updater_engine.pool.checkedout() == 1
+        updater_session.remove()
+
+    # The pooled connection is reused, every checkout is observed once it is returned
+    assert sample('slr_db_pool_connects_total', 'updater') - connects_before == 1
+    assert sample('slr_db_pool_connection_hold_seconds_count', 'updater') - holds_before == 3
+    assert updater_engine.pool.checkedout() == 0
@@ -0,0 +1,124 @@
+import gevent
+import pytest
+import requests
+
+from app.resources.sli.sources import SourceUnavailableError
+from app.resources.sli.sources import guard
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def server_error(status=503):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+def fail(error):
+    raise error
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def backend(clock):
+    breaker = guard.CircuitBreaker('test', failure_threshold=3, reset_timeout=60, clock=clock)
+    return guard.Guard('test', concurrency=2, rate=0, breaker=breaker)
+
+
+def test_circuit_opens_after_consecutive_failures(backend):
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            backend.call(fail, server_error())
+
+    calls = []
+    with pytest.raises(SourceUnavailableError):
+        backend.call(calls.append, 1)
+
+    assert backend.breaker.state == guard.OPEN
+    assert calls == []
+
+
+def test_query_errors_do_not_open_the_circuit(backend):
+    for _ in range(5):
+        with pytest.raises(requests.HTTPError):
+            backend.call(fail, server_error(400))
+
+    assert backend.breaker.state == guard.CLOSED
+    assert backend.call(lambda: 'ok') == 'ok'
+
+
+def test_half_open_circuit_lets_a_single_probe_through(backend, clock):
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            backend.call(fail, server_error())
+
+    clock.now += 61
+
+    def probe():
+        # Concurrent queries are rejected while the probe runs
+        with pytest.raises(SourceUnavailableError):
+            backend.call(lambda: 'other')
+        return 'probe'
+
+    assert backend.call(probe) == 'probe'
+    assert backend.breaker.state == guard.CLOSED
+
+
+def test_failing_probe_opens_the_circuit_again(backend, clock):
+    for _ in range(3):
+        with pytest.raises(requests.HTTPError):
+            backend.call(fail, server_error())
+
+    clock.now += 61
+    with pytest.raises(requests.Timeout):
+        backend.call(fail, requests.Timeout())
+
+    assert backend.breaker.state == guard.OPEN
+    with pytest.raises(SourceUnavailableError):
+        backend.call(lambda: 'ok')
+
+
+def test_concurrent_queries_are_capped(backend):
+    running = []
+    peak = []
+
+    def query():
+        running.append(1)
+        peak.append(len(running))
+        gevent.sleep(0.01)
+        running.pop()
+
+    gevent.joinall([gevent.spawn(backend.call, query) for _ in range(6)], raise_error=True)
+
+    assert max(peak) == 2
+
+
+def test_token_bucket_limits_the_rate_after_a_burst(clock):
+    bucket = guard.TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+
+    for _ in range(7):
+        bucket.acquire()
+
+    # 3 queries right away, the other 4 at 2 per second
+    assert clock.now == pytest.approx(1002.0)
+
+
+def test_guards_are_shared_per_backend(monkeypatch):
+    monkeypatch.setattr(guard, '_guards', {})
+
+    assert guard.get_guard('backend') is guard.get_guard('backend')
+    with pytest.raises(ValueError):
+        guard.get_guard('backend', is_failure=lambda error: True)
@@ -0,0 +1,187 @@
+import asyncio
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from app.resources.sli.sources import SourceUnavailableError, guard, kairosdb
+
+MINUTE = 60000
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture(autouse=True)
+def guards(monkeypatch):
+    # Fresh circuit breakers for every test
+    monkeypatch.setattr(guard, '_guards', {})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(kairosdb, '_RETRY_BACKOFF', 0)
+    return kairosdb.KairosDBClient('http://kairosdb')
+
+
+def test_split_window_aligns_boundaries_to_minutes():
+    start = 10 * MINUTE + 1234
+    end = 70 * MINUTE + 5
+
+    slices = kairosdb._split_window(start, end, 30 * MINUTE)
+
+    assert slices == [(start, 40 * MINUTE), (40 * MINUTE, 70 * MINUTE), (70 * MINUTE, end)]
+
+
+def test_query_sliced_halves_failing_slices(monkeypatch, client):
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_MIN_QUERY_SLICE', 15)
+    windows = []
+
+    def query(q):
+        minutes = (q['end_absolute'] + 1 - q['start_absolute']) // MINUTE
+        if minutes > 30:
+            raise http_error(500)
+        windows.append((q['start_absolute'], q['end_absolute'] + 1))
+        return iter([])
+
+    monkeypatch.setattr(client, 'query', query)
+
+    client.query_sliced(
+        {'start_absolute': 0, 'end_absolute': 120 * MINUTE - 1}, lambda results: list(results), slice_minutes=60)
+
+    assert sorted(windows) == [(i * 30 * MINUTE, (i + 1) * 30 * MINUTE) for i in range(4)]
+
+
+def test_query_sliced_gives_up_after_retries(monkeypatch, client):
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_MIN_QUERY_SLICE', 60)
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_QUERY_RETRIES', 2)
+    calls = []
+
+    def query(q):
+        calls.append(q)
+        raise requests.Timeout()
+
+    monkeypatch.setattr(client, 'query', query)
+
+    with pytest.raises(requests.Timeout):
+        client.query_sliced({'start_absolute': 0, 'end_absolute': 60 * MINUTE - 1}, list)
+
+    assert len(calls) == 3
+
+
+def test_circuit_counts_every_failed_request(monkeypatch, client):
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_MIN_QUERY_SLICE', 60)
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_QUERY_RETRIES', 10)
+    calls = []
+
+    def query(q):
+        calls.append(q)
+        raise http_error(503)
+
+    monkeypatch.setattr(client, 'query', query)
+
+    # The circuit opens long before the query is out of retries
+    with pytest.raises(SourceUnavailableError):
+        client.query_sliced({'start_absolute': 0, 'end_absolute': 60 * MINUTE - 1}, list)
+
+    assert len(calls) == client.guard.breaker.failure_threshold
+    assert client.guard.breaker.state == guard.OPEN
+
+
+def test_query_sliced_does_not_retry_client_errors(monkeypatch, client):
+    calls = []
+
+    def query(q):
+        calls.append(q)
+        raise http_error(400)
+
+    monkeypatch.setattr(client, 'query', query)
+
+    with pytest.raises(requests.HTTPError):
+        client.query_sliced({'start_absolute': 0, 'end_absolute': 60 * MINUTE - 1}, list)
+
+    assert len(calls) == 1
+
+
+def test_async_query_sliced_halves_failing_slices(monkeypatch):
+    monkeypatch.setattr(kairosdb, '_RETRY_BACKOFF', 0)
+    monkeypatch.setattr(kairosdb, 'KAIROSDB_MIN_QUERY_SLICE', 15)
+    client = kairosdb.AsyncKairosDBClient(session=None, url='http://kairosdb')
+    windows = []
+
+    async def query(q, consume):
+        minutes = (q['end_absolute'] + 1 - q['start_absolute']) // MINUTE
+        if minutes > 30:
+            raise http_error(503)
+        windows.append((q['start_absolute'], q['end_absolute'] + 1))
+        consume(iter([]))
+
+    monkeypatch.setattr(client, 'query', query)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(client.query_sliced(
+            {'start_absolute': 0, 'end_absolute': 120 * MINUTE - 1}, lambda results: list(results), slice_minutes=60))
+    finally:
+        loop.close()
+
+    assert sorted(windows) == [(i * 30 * MINUTE, (i + 1) * 30 * MINUTE) for i in range(4)]
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, chunks):
+        self.content = self
+        self.chunks = chunks
+
+    async def iter_any(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    def raise_for_status(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+def test_async_query_passes_groups_while_receiving(monkeypatch):
+    body = json.dumps({'queries': [{'results': [
+        {'name': 'zmon.check.1', 'group_by': [{'name': 'tag', 'group': {'key': 'a'}}],
+         'values': [[0, 1], [MINUTE, 2.5]]},
+        {'name': 'zmon.check.1', 'values': [[0, 3]], 'group_by': [{'name': 'tag', 'group': {'key': 'b'}}]},
+    ]}]}).encode()
+    chunks = [body[i:i + 16] for i in range(0, len(body), 16)]
+    received = []
+
+    def receive():
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+    session = MagicMock(post=lambda *args, **kwargs: FakeResponse(receive()))
+    client = kairosdb.AsyncKairosDBClient(session=session, url='http://kairosdb')
+    client.tokens = MagicMock(get=MagicMock(return_value='token'))
+    groups = []
+
+    def consume(results):
+        for group_by, points in results:
+            groups.append((group_by[0]['group']['key'], list(points), len(received)))
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(client.query({'start_absolute': 0, 'end_absolute': MINUTE}, consume))
+    finally:
+        loop.close()
+
+    assert [(key, points) for key, points, _ in groups] == [('a', [[0, 1], [MINUTE, 2.5]]), ('b', [[0, 3]])]
+    # The first group is passed on before the rest of the body is received
+    assert groups[0][2] < len(chunks)
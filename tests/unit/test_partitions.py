@@ -0,0 +1,185 @@
+import datetime
+from unittest.mock import MagicMock
+
+from app.resources.sli import partitions, retention
+from app.resources.sli.sources import rollups
+
+NOW = datetime.datetime(2020, 11, 15, 12, 30)
+
+
+def session_with(*bounds, locked=True):
+    session = MagicMock()
+
+    def execute(statement, params=None):
+        if statement is partitions._TRY_LOCK_SQL:
+            return MagicMock(scalar=MagicMock(return_value=locked))
+        return list(bounds)
+
+    session.execute.side_effect = execute
+    return session
+
+
+def executed(session):
+    # Without reading the partitions and taking the lock
+    return [
+        str(call[0][0]) for call in session.execute.call_args_list
+        if call[0][0] not in (partitions._PARTITIONS_SQL, partitions._TRY_LOCK_SQL)
+    ]
+
+
+def test_month_arithmetic():
+    assert partitions.month_start(NOW) == datetime.datetime(2020, 11, 1)
+    assert partitions.add_months(datetime.datetime(2020, 11, 1), 3) == datetime.datetime(2021, 2, 1)
+    assert partitions.add_months(datetime.datetime(2020, 1, 1), -1) == datetime.datetime(2019, 12, 1)
+    assert partitions.partition_name(datetime.datetime(2021, 2, 1)) == 'indicatorvalue_y2021m02'
+
+
+def test_partitions_are_parsed_from_their_bounds():
+    session = session_with(
+        ('indicatorvalue_y2020m12', "FOR VALUES FROM ('2020-12-01 00:00:00') TO ('2021-01-01 00:00:00')"),
+        ('indicatorvalue_legacy', "FOR VALUES FROM (MINVALUE) TO ('2020-12-01 00:00:00')"),
+    )
+
+    assert partitions.get_partitions(session) == [
+        partitions.Partition('indicatorvalue_legacy', None, datetime.datetime(2020, 12, 1)),
+        partitions.Partition(
+            'indicatorvalue_y2020m12', datetime.datetime(2020, 12, 1), datetime.datetime(2021, 1, 1)
+        ),
+    ]
+
+
+def test_missing_partitions_from_retention_horizon_until_months_ahead():
+    existing = [partitions.Partition('indicatorvalue_legacy', None, datetime.datetime(2020, 12, 1))]
+
+    missing = partitions.missing_partitions(existing, NOW, ahead=2, retention_days=100)
+
+    assert [p.name for p in missing] == ['indicatorvalue_y2020m12', 'indicatorvalue_y2021m01']
+
+
+def test_ensure_partitions_creates_missing_months():
+    session = session_with(
+        ('indicatorvalue_y2020m12', "FOR VALUES FROM ('2020-12-01 00:00:00') TO ('2021-01-01 00:00:00')"),
+    )
+
+    created = partitions.ensure_partitions(session, NOW)
+
+    # Retention horizon (100 days) is in August, 3 months ahead
+    assert created == [
+        'indicatorvalue_y2020m08',
+        'indicatorvalue_y2020m09',
+        'indicatorvalue_y2020m10',
+        'indicatorvalue_y2020m11',
+        'indicatorvalue_y2021m01',
+        'indicatorvalue_y2021m02',
+    ]
+    assert executed(session)[0] == (
+        "CREATE TABLE IF NOT EXISTS indicatorvalue_y2020m08 PARTITION OF indicatorvalue "
+        "FOR VALUES FROM ('2020-08-01') TO ('2020-09-01')"
+    )
+    session.commit.assert_called_once_with()
+
+
+def test_only_fully_expired_partitions_are_dropped():
+    session = session_with(
+        ('indicatorvalue_legacy', "FOR VALUES FROM (MINVALUE) TO ('2020-08-01 00:00:00')"),
+        ('indicatorvalue_y2020m08', "FOR VALUES FROM ('2020-08-01 00:00:00') TO ('2020-09-01 00:00:00')"),
+        ('indicatorvalue_y2020m09', "FOR VALUES FROM ('2020-09-01 00:00:00') TO ('2020-10-01 00:00:00')"),
+    )
+
+    compacted = []
+    dropped = partitions.drop_expired_partitions(session, datetime.datetime(2020, 9, 1), compacted.append)
+
+    assert dropped == ['indicatorvalue_legacy', 'indicatorvalue_y2020m08']
+    assert [p.name for p in compacted] == dropped
+    assert executed(session) == [
+        'ALTER TABLE indicatorvalue DETACH PARTITION indicatorvalue_legacy',
+        'DROP TABLE indicatorvalue_legacy',
+        'ALTER TABLE indicatorvalue DETACH PARTITION indicatorvalue_y2020m08',
+        'DROP TABLE indicatorvalue_y2020m08',
+    ]
+    assert session.commit.call_count == 2
+
+
+def test_partitions_are_maintained_by_one_process_at_a_time():
+    session = session_with(
+        ('indicatorvalue_y2020m08', "FOR VALUES FROM ('2020-08-01 00:00:00') TO ('2020-09-01 00:00:00')"),
+        locked=False,
+    )
+
+    assert partitions.ensure_partitions(session, NOW) == []
+    assert partitions.drop_expired_partitions(session, datetime.datetime(2020, 9, 1)) == []
+    assert executed(session) == []
+    # Ending the transactions of the lock attempts
+    assert session.commit.call_count == 2
+
+
+def test_only_values_within_the_partitions_are_written(monkeypatch):
+    monkeypatch.setattr(partitions, 'INDICATORVALUE_PARTITIONS_AHEAD', 2)
+    monkeypatch.setattr(partitions, 'MAX_RETENTION_DAYS', 100)
+    values = {
+        datetime.datetime(2020, 8, 7, 12, 29): 1.0,
+        datetime.datetime(2020, 8, 7, 12, 30): 2.0,
+        datetime.datetime(2020, 12, 31, 23, 59): 3.0,
+        datetime.datetime(2021, 1, 1): 4.0,
+    }
+
+    assert partitions.writable_range(NOW) == (datetime.datetime(2020, 8, 7, 12, 30), datetime.datetime(2021, 1, 1))
+    assert partitions.writable_values(values, NOW) == {
+        datetime.datetime(2020, 8, 7, 12, 30): 2.0,
+        datetime.datetime(2020, 12, 31, 23, 59): 3.0,
+    }
+
+
+def test_expired_values_of_the_legacy_partition_are_deleted_in_batches(monkeypatch):
+    monkeypatch.setattr(retention, 'get_partitions', MagicMock(return_value=[
+        partitions.Partition('indicatorvalue_legacy', None, datetime.datetime(2020, 12, 1)),
+        partitions.Partition('indicatorvalue_y2020m12', datetime.datetime(2020, 12, 1), datetime.datetime(2021, 1, 1)),
+    ]))
+    db = MagicMock()
+    db.session.query.return_value.filter.return_value.scalar.return_value = datetime.datetime(2020, 8, 3, 7, 15)
+    monkeypatch.setattr(retention, 'db', db)
+    rebuild_rollups = MagicMock()
+    monkeypatch.setattr(retention, 'rebuild_rollups', rebuild_rollups)
+    delete_indicator_values = MagicMock(return_value=10)
+    monkeypatch.setattr(retention, 'delete_indicator_values', delete_indicator_values)
+
+    assert retention._trim_legacy_partition([1, 2], datetime.datetime(2020, 8, 10, 12, 30)) == 20
+
+    # Compacted into the rollups first, without dropping rollups of deleted minutes
+    cutoff = datetime.datetime(2020, 8, 10)
+    rebuild_rollups.assert_called_once_with(
+        db.session, [1, 2], datetime.datetime(2020, 8, 3, 7, 15), cutoff, drop_missing=False
+    )
+    assert [call[0][1:] for call in delete_indicator_values.call_args_list] == [
+        (1, datetime.datetime.min, cutoff), (2, datetime.datetime.min, cutoff)
+    ]
+
+
+def test_compacting_keeps_rollups_of_expired_archived_days(monkeypatch):
+    partition = partitions.Partition(
+        'indicatorvalue_y2020m09', datetime.datetime(2020, 9, 1), datetime.datetime(2020, 10, 1)
+    )
+
+    def drop_expired_partitions(session, retention, before_drop):
+        before_drop(partition)
+        return [partition.name]
+
+    monkeypatch.setattr(retention, 'ensure_partitions', MagicMock(return_value=[]))
+    monkeypatch.setattr(retention, 'drop_expired_partitions', drop_expired_partitions)
+    monkeypatch.setattr(retention, '_trim_legacy_partition', MagicMock(return_value=0))
+    monkeypatch.setattr(retention, 'delete_expired_rollups', MagicMock(return_value=0))
+    monkeypatch.setattr(retention, '_indicator_ids', MagicMock(return_value=[1]))
+    monkeypatch.setattr(retention.archive, 'delete_expired_days', MagicMock(return_value=30))
+    monkeypatch.setattr(retention.archive, 'archive_horizon', MagicMock(return_value=None))
+    monkeypatch.setattr(rollups.time, 'sleep', MagicMock())
+    db = MagicMock()
+    monkeypatch.setattr(retention, 'db', db)
+
+    # The minutes of the partition were archived, and the archived days deleted on expiry
+    retention.apply_retention(MagicMock())
+
+    # Rollups are refreshed from the remaining minutes, the ones of hours and days without are kept
+    statements = [call[0][0] for call in db.session.execute.call_args_list]
+    assert rollups._REFRESH_HOURLY_SQL in statements
+    assert rollups._DELETE_HOURLY_SQL not in statements
+    assert rollups._DELETE_DAILY_SQL not in statements
@@ -0,0 +1,83 @@
+import datetime
+from unittest.mock import MagicMock
+
+from app.resources.report.api import get_target_healthiness
+from app.resources.sli.sources import DatetimeRange, Resolution, rollups, zmon
+
+
+def day(d):
+    return datetime.datetime(2020, 1, d)
+
+
+def test_ranges_are_split_into_days_hours_and_minutes():
+    start, end = datetime.datetime(2020, 1, 1, 10, 30), datetime.datetime(2020, 1, 4, 2, 15)
+
+    assert rollups.segments(start, end) == [
+        (rollups.MINUTES, start, datetime.datetime(2020, 1, 1, 11)),
+        (rollups.HOURLY, datetime.datetime(2020, 1, 1, 11), day(2)),
+        (rollups.DAILY, day(2), day(4)),
+        (rollups.HOURLY, day(4), datetime.datetime(2020, 1, 4, 2)),
+        (rollups.MINUTES, datetime.datetime(2020, 1, 4, 2), end),
+    ]
+
+
+def test_short_ranges_read_minutes_only():
+    start, end = datetime.datetime(2020, 1, 1, 10, 30), datetime.datetime(2020, 1, 1, 10, 45)
+
+    assert rollups.segments(start, end) == [(rollups.MINUTES, start, end)]
+    assert rollups.segments(day(1), day(3)) == [(rollups.DAILY, day(1), day(3))]
+
+
+def test_aggregates_are_computed_from_daily_summaries(monkeypatch):
+    # Monday 2020-01-06 starts a new week
+    days = [
+        (day(4), 10.0, 10, 0.5, 2.0),
+        (day(5), 20.0, 10, 1.0, 3.0),
+        (day(6), 30.0, 10, 2.0, 4.0),
+    ]
+    monkeypatch.setattr(rollups, 'get_daily_summaries', MagicMock(return_value=days))
+    count_breaches = MagicMock(return_value=7)
+    monkeypatch.setattr(rollups, 'count_breaches', count_breaches)
+    monkeypatch.setattr(rollups, 'finest_table', MagicMock(return_value=rollups.MINUTES))
+
+    indicator = MagicMock(id=1, aggregation='average')
+    source = zmon.ZMON(indicator, check_id=1, keys=['key'], aggregation={'type': 'average'})
+    aggregates = source.get_indicator_value_aggregates(DatetimeRange(day(4), day(7)), Resolution.WEEKLY)
+
+    weeks = aggregates[Resolution.WEEKLY]
+    assert [(w.timestamp, w.sum, w.count, w.min, w.max, w.avg) for w in weeks] == [
+        (datetime.datetime(2019, 12, 30), 30.0, 20, 0.5, 3.0, 1.5),
+        (day(6), 30.0, 10, 2.0, 4.0, 3.0),
+    ]
+    total = aggregates[Resolution.TOTAL]
+    assert (total.aggregate, total.count, total.min, total.max) == (2.0, 30, 0.5, 4.0)
+
+    # Minutes are only counted if the values exceed the target
+    target = MagicMock(target_from=1.0, target_to=5.0)
+    assert get_target_healthiness(target, weeks[1], 'avg')['breaches'] == 0
+    count_breaches.assert_not_called()
+
+    assert get_target_healthiness(target, weeks[0], 'avg')['breaches'] == 7
+    assert count_breaches.call_args[0][1:] == (1, day(4), day(6), 1.0, 5.0)
+
+
+def test_finest_tier_covering_the_range(monkeypatch):
+    monkeypatch.setattr(rollups, 'HOURLY_RETENTION_DAYS', 400)
+    now = datetime.datetime(2021, 1, 1)
+
+    assert rollups.finest_table(now - datetime.timedelta(days=30), now) == rollups.MINUTES
+    assert rollups.finest_table(now - datetime.timedelta(days=200), now) == rollups.HOURLY
+    assert rollups.finest_table(now - datetime.timedelta(days=500), now) == rollups.DAILY
+
+    monkeypatch.setattr(rollups, 'HOURLY_RETENTION_DAYS', 0)
+    assert rollups.finest_table(now - datetime.timedelta(days=500), now) == rollups.HOURLY
+
+
+def test_rollups_are_returned_as_values_of_the_sli_aggregation():
+    hour = rollups.IndicatorValueHourly(timestamp=day(1), sum=30.0, count=60, min=0.1, max=2.0)
+
+    source = zmon.ZMON(MagicMock(aggregation='average'), check_id=1, keys=['key'], aggregation={'type': 'average'})
+    assert [(v.timestamp, v.value) for v in source._tier_values([hour])] == [(day(1), 0.5)]
+
+    source.indicator.aggregation = 'max'
+    assert [v.value for v in source._tier_values([hour])] == [2.0]
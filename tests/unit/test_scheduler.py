@@ -0,0 +1,108 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.resources.sli import scheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def source(indicator_id, batch_key=None, update_interval=None):
+    return MagicMock(
+        indicator=MagicMock(id=indicator_id),
+        batch_key=MagicMock(return_value=batch_key),
+        update_interval=update_interval,
+    )
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def updater(monkeypatch, clock):
+    monkeypatch.setattr(scheduler, 'UPDATER_INTERVAL', 600)
+    monkeypatch.setattr(scheduler, 'UPDATER_JITTER', 0)
+    monkeypatch.setattr(scheduler, 'UPDATER_MAX_BACKOFF', 3600)
+    return scheduler.UpdateScheduler(MagicMock(), pool=MagicMock(), clock=clock)
+
+
+def test_new_units_are_staggered_over_their_interval(updater, clock):
+    updater.refresh([[source(i)] for i in range(100)] + [[source(100, 17), source(101, 17, update_interval=300)]])
+
+    assert len(updater.pop_due()) == 0
+
+    clock.now += 300
+    first_half = updater.pop_due()
+    assert 20 < len(first_half) < 80
+    assert 'MagicMock:17' in {unit.key for unit in first_half}
+
+    clock.now += 300
+    assert len(first_half) + len(updater.pop_due()) == 101
+
+
+def test_failing_units_back_off_exponentially(monkeypatch, updater, clock):
+    monkeypatch.setattr(scheduler, 'update_sources', MagicMock(return_value=False))
+    updater.refresh([[source(1)]])
+    clock.now += 600
+    unit, = updater.pop_due()
+
+    delays = []
+    for _ in range(4):
+        updater.run_unit(unit)
+        due = updater._heap[0][0]
+        delays.append(due - clock.now)
+        clock.now = due
+        assert updater.pop_due() == [unit]
+
+    assert delays == [1200, 2400, 3600, 3600]
+
+    scheduler.update_sources.return_value = True
+    updater.run_unit(unit)
+    assert updater._heap[0][0] - clock.now == 600
+    assert unit.failures == 0
+
+
+def test_removed_units_are_not_rescheduled(monkeypatch, updater, clock):
+    monkeypatch.setattr(scheduler, 'update_sources', MagicMock(return_value=True))
+    updater.refresh([[source(1)], [source(2)]])
+    clock.now += 600
+    running = {unit.key: unit for unit in updater.pop_due()}
+
+    updater.refresh([[source(2)]])
+    for unit in running.values():
+        updater.run_unit(unit)
+
+    clock.now += 600
+    assert [unit.key for unit in updater.pop_due()] == ['indicator:2']
+
+
+def test_leased_units_are_claimed_and_released_through_the_store(monkeypatch, clock):
+    monkeypatch.setattr(scheduler, 'UPDATER_INTERVAL', 600)
+    monkeypatch.setattr(scheduler, 'UPDATER_JITTER', 0)
+    monkeypatch.setattr(scheduler, 'update_sources', MagicMock(return_value=False))
+    leases = MagicMock()
+    leases.claim.return_value = [('indicator:2', 1)]
+    pool = MagicMock()
+    pool.free_count.return_value = 5
+    updater = scheduler.UpdateScheduler(MagicMock(), pool=pool, clock=clock, leases=leases)
+
+    updater.refresh([[source(1)], [source(2)]])
+    delays = leases.sync.call_args[0][0]
+    assert sorted(delays) == ['indicator:1', 'indicator:2']
+    assert all(0 <= delay <= 600 for delay in delays.values())
+    assert updater._heap == []
+
+    unit, = updater.pop_due()
+    leases.claim.assert_called_once_with(['indicator:1', 'indicator:2'], 5)
+    assert unit.key == 'indicator:2' and unit.failures == 1
+
+    updater.run_unit(unit)
+    leases.release.assert_called_once_with('indicator:2', 2400, 2)
@@ -0,0 +1,137 @@
+import datetime
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy import exc
+
+from app.resources.sli.sources import spool, zmon
+
+# Recent, older values are dropped as expired
+MINUTE = datetime.datetime.utcnow().replace(second=0, microsecond=0) - datetime.timedelta(days=1)
+
+
+def values(count, offset=0, start=MINUTE):
+    return {start + datetime.timedelta(minutes=i): float(i + offset) + 0.25 for i in range(count)}
+
+
+def replayed(store_spool):
+    stored = {}
+    count = store_spool.replay(lambda indicator_id, v: stored.setdefault(indicator_id, {}).update(v))
+    return count, stored
+
+
+def test_records_roundtrip_and_ignore_torn_tail():
+    data = spool.pack(1, values(3)) + spool.pack(2, values(2)) + spool.pack(1, values(1, offset=10))
+
+    unpacked = spool.unpack(data + data[:7])
+
+    # Later records win
+    assert unpacked[1] == {**values(3), **values(1, offset=10)}
+    assert unpacked[2] == values(2)
+
+
+def test_replay_drains_all_segments(tmp_path):
+    store_spool = spool.Spool(str(tmp_path))
+    store_spool.append(1, values(60))
+    store_spool.append(2, values(5))
+
+    count, stored = replayed(store_spool)
+    assert count == 65
+    assert stored == {1: values(60), 2: values(5)}
+
+    # Appending after a replay starts a new segment
+    store_spool.append(1, values(1, offset=5))
+    assert replayed(store_spool) == (1, {1: values(1, offset=5)})
+    assert replayed(store_spool) == (0, {})
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_failed_replay_keeps_segment(tmp_path):
+    store_spool = spool.Spool(str(tmp_path))
+    store_spool.append(1, values(10))
+
+    def store(indicator_id, v):
+        raise exc.OperationalError('INSERT', {}, Exception('connection refused'))
+
+    with pytest.raises(exc.OperationalError):
+        store_spool.replay(store)
+
+    assert replayed(store_spool) == (10, {1: values(10)})
+
+
+def test_poison_segment_is_quarantined_without_blocking_others(tmp_path):
+    store_spool = spool.Spool(str(tmp_path), max_attempts=2)
+    store_spool.append(1, values(3))
+    store_spool._close_segment()
+    store_spool.append(2, values(4))
+
+    def store(indicator_id, v):
+        if indicator_id == 1:
+            raise exc.DataError('INSERT', {}, Exception('value out of range'))
+        stored.setdefault(indicator_id, {}).update(v)
+
+    stored = {}
+    assert store_spool.replay(store) == 4
+    assert stored == {2: values(4)}
+    # Retried until it is quarantined
+    assert store_spool.newest(1) == max(values(3))
+    assert store_spool.replay(store) == 0
+
+    assert [path.suffix for path in tmp_path.iterdir()] == ['.failed']
+    assert store_spool.newest(1) is None
+    assert replayed(store_spool) == (0, {})
+
+
+def test_replay_clears_newest_spooled_minutes(tmp_path):
+    store_spool = spool.Spool(str(tmp_path))
+    store_spool.append(1, values(3))
+    assert store_spool.newest(1) == max(values(3))
+
+    replayed(store_spool)
+
+    # Updates continue from the watermark again
+    assert store_spool.newest(1) is None
+
+
+def test_replay_skips_segments_of_other_writers(tmp_path):
+    writer = spool.Spool(str(tmp_path))
+    writer.append(1, values(3))
+
+    replayer = spool.Spool(str(tmp_path))
+    assert replayed(replayer) == (0, {})
+
+    writer.replay(lambda *args: None)
+    writer.append(2, values(3))
+    writer._close_segment()
+    assert replayed(replayer) == (3, {2: values(3)})
+
+
+def test_zmon_spools_values_when_database_is_unavailable(tmp_path, monkeypatch):
+    source = zmon.ZMON(MagicMock(id=7), check_id=1, keys=['key'], aggregation={'type': 'average'})
+    source.session = MagicMock()
+    source.spool = spool.Spool(str(tmp_path))
+    source.indicator.watermark = MagicMock(last_timestamp=MINUTE)
+
+    def unavailable(*args):
+        raise exc.OperationalError('SELECT', {}, Exception('server closed the connection'))
+
+    monkeypatch.setattr(source, '_insert_indicator_values', unavailable)
+
+    result = values(30, start=MINUTE + datetime.timedelta(minutes=1))
+    assert source._store_or_spool(result, None) == 0
+    source.session.rollback.assert_called_once_with()
+
+    # The next update continues after the spooled values
+    assert source._get_newest_timestamp() == max(result)
+    assert replayed(source.spool) == (30, {7: result})
+
+
+def test_zmon_raises_other_errors(tmp_path, monkeypatch):
+    source = zmon.ZMON(MagicMock(id=7), check_id=1, keys=['key'], aggregation={'type': 'average'})
+    source.spool = spool.Spool(str(tmp_path))
+    monkeypatch.setattr(source, '_insert_indicator_values', MagicMock(side_effect=ValueError))
+
+    with pytest.raises(ValueError):
+        source._store_or_spool(values(3), None)
+
+    assert replayed(source.spool) == (0, {})
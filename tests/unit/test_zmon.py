@@ -0,0 +1,274 @@
+import asyncio
+import datetime
+import fnmatch
+import json
+import os
+import random
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+
+from app.resources.sli.sources import SourceError, kairosdb, zmon
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data')
+
+
+def load_fixture(name):
+    with open(os.path.join(DATA_DIR, name)) as fd:
+        return json.load(fd)
+
+
+def zmon_source(aggregation_type, **kwargs):
+    return zmon.ZMON(
+        MagicMock(),
+        check_id=2017,
+        keys=['GET.latency.p99', 'POST.latency.p99'],
+        aggregation={'type': aggregation_type},
+        **kwargs
+    )
+
+
+class FakeKairosDBClient:
+    """Records the sent queries and answers them with ``response``."""
+
+    def __init__(self, response):
+        self.response = response
+        self.queries = []
+
+    def query_sliced(self, q, consume):
+        self.queries.append(q)
+        consume(kairosdb.iter_json_result_groups(self.response))
+
+
+@pytest.mark.parametrize('aggregation_type,aggregator', [
+    ('average', 'avg'),
+    ('sum', 'sum'),
+    ('min', 'min'),
+    ('maximum', 'max'),
+])
+def test_pushdown_queries_one_aggregated_series(monkeypatch, aggregation_type, aggregator):
+    monkeypatch.setattr(zmon, 'KAIROSDB_AGGREGATION_PUSHDOWN', True)
+    minute = datetime.datetime(2017, 7, 14, 2, 40)
+    ms = zmon._to_epoch_ms(minute)
+
+    # KairosDB groups aggregated series by type only
+    client = FakeKairosDBClient({'queries': [{'sample_size': 8, 'results': [{
+        'name': 'zmon.check.2017',
+        'group_by': [{'name': 'type', 'type': 'number'}],
+        'tags': {'entity': ['app-1', 'app-2'], 'key': ['GET.latency.p99', 'POST.latency.p99']},
+        'values': [[ms, 186.5], [ms + 60000, 0], [ms + 120000, 223.25]],
+    }]}]})
+    monkeypatch.setattr(kairosdb, 'get_client', lambda: client)
+
+    source = zmon_source(aggregation_type, tags={'application': 'app'})
+    result = source._query_kairosdb(30)
+
+    [q] = client.queries
+    assert q['end_absolute'] - q['start_absolute'] == pytest.approx(30 * 60000, abs=1000)
+    assert q['metrics'] == [{
+        'name': 'zmon.check.2017',
+        'tags': {'key': ['GET.latency.p99', 'POST.latency.p99'], 'application': 'app'},
+        'aggregators': [{
+            'name': aggregator,
+            'sampling': {'value': 1, 'unit': 'minutes'},
+            'align_sampling': True,
+            'align_start_time': True,
+        }],
+    }]
+
+    assert result == {
+        minute: 186.5,
+        minute + datetime.timedelta(minutes=1): 0,
+        minute + datetime.timedelta(minutes=2): 223.25,
+    }
+
+
+@pytest.mark.parametrize('aggregation_type,aggregator', [
+    ('average', 'avg'),
+    ('sum', 'sum'),
+    ('min', 'min'),
+    ('maximum', 'max'),
+])
+def test_pushdown_matches_python_aggregation(monkeypatch, aggregation_type, aggregator):
+    # Responses recorded for the same check and range, per entity and aggregated by KairosDB
+    def query(pushdown, response):
+        monkeypatch.setattr(zmon, 'KAIROSDB_AGGREGATION_PUSHDOWN', pushdown)
+        monkeypatch.setattr(kairosdb, 'get_client', lambda: FakeKairosDBClient(response))
+        return zmon_source(aggregation_type)._query_kairosdb(30)
+
+    expected = query(False, load_fixture('kairosdb-check-entities.json'))
+    result = query(True, load_fixture('kairosdb-check-pushdown.json')[aggregator])
+
+    assert expected
+    assert result.keys() == expected.keys()
+    for minute, value in expected.items():
+        assert result[minute] == pytest.approx(value)
+
+
+def test_pushdown_not_used_for_weighted_or_shared_prefixes(monkeypatch):
+    monkeypatch.setattr(zmon, 'KAIROSDB_AGGREGATION_PUSHDOWN', True)
+
+    weighted = zmon.ZMON(
+        MagicMock(), check_id=2017, keys=['GET.latency.p99'],
+        aggregation={'type': 'weighted', 'weight_keys': ['GET.rate']})
+    assert weighted._pushdown_keys() is None
+    assert weighted.batch_key() == 2017
+
+    shared_prefix = zmon.ZMON(
+        MagicMock(), check_id=2017, keys=['GET.latency.p99', 'GET.latency.p50'], aggregation={'type': 'average'})
+    assert shared_prefix._pushdown_keys() is None
+
+    excluded = zmon_source('sum', exclude_keys=['POST.*'])
+    assert excluded._pushdown_keys() == ['GET.latency.p99']
+    assert excluded.batch_key() is None
+
+
+@pytest.mark.parametrize('update_interval', [True, 59, 60.0, '300'])
+def test_invalid_update_interval(update_interval):
+    with pytest.raises(SourceError):
+        zmon.ZMON.validate_config({
+            'check_id': 2017, 'keys': ['GET.rate'], 'aggregation': {'type': 'sum'}, 'update_interval': update_interval,
+        })
+
+
+@pytest.mark.parametrize('key', ['GET.latency.p99', 'GET.latency.p50', 'internal.rate', 'POST.rate', 'x', ''])
+def test_key_matcher_matches_like_fnmatch(key):
+    patterns = ['*.p50', 'internal.*', 'POST.r?te', '[GP]*.latency.p9[0-9]']
+
+    assert zmon._KeyMatcher(patterns)(key) == any(fnmatch.fnmatch(key, pat) for pat in patterns)
+    assert not zmon._KeyMatcher([])(key)
+
+
+@pytest.mark.parametrize('aggregation_type', ['weighted', 'average', 'sum', 'min', 'minimum', 'max', 'maximum'])
+@pytest.mark.parametrize('since', [None, datetime.datetime(2020, 1, 1, 0, 2, 30)])
+def test_vectorized_aggregation_matches_dict_aggregation(aggregation_type, since):
+    rng = random.Random(aggregation_type)
+    start = 1577836800000  # 2020-01-01T00:00:00
+
+    results = []
+    for entity in range(50):
+        for key in ['GET.latency.p99', 'POST.latency.p99', 'GET.rate', 'POST.rate']:
+            # Several points per minute, the last one of a minute wins
+            points = [
+                [start + offset, rng.choice([rng.randint(0, 100), rng.uniform(0, 1000)])]
+                for offset in sorted(rng.sample(range(0, 10 * 60000, 1000), 30))
+            ]
+            results.append(([{'name': 'tag', 'group': {'entity': 'e-{}'.format(entity % 40), 'key': key}}], points))
+
+    source = zmon.ZMON(
+        MagicMock(), check_id=2017, keys=['GET.latency.p99', 'POST.latency.p99'],
+        aggregation={'type': aggregation_type, 'weight_keys': ['*.rate']})
+
+    aggregation = zmon._MinuteAggregation(source, since)
+    vectorized = zmon._VectorizedMinuteAggregation(source, since)
+    zmon._fold([aggregation, vectorized], ((group_by, iter(points)) for group_by, points in results))
+
+    expected = aggregation.result()
+    assert expected
+    assert vectorized.result() == expected
+
+
+def test_start_for_update_uses_watermark():
+    source = zmon_source('average')
+    now = datetime.datetime.utcnow()
+
+    source.indicator.watermark = MagicMock(last_timestamp=now - datetime.timedelta(minutes=30))
+    assert source._get_start_relative_for_update() in (35, 36)
+
+    source.indicator.watermark = MagicMock(last_timestamp=None)
+    assert source._get_start_relative_for_update() == zmon.MAX_QUERY_TIME_SLICE
+
+    source.indicator.watermark = MagicMock(last_timestamp=now - datetime.timedelta(days=7))
+    assert source._get_start_relative_for_update() == zmon.MAX_QUERY_TIME_SLICE
+
+
+def test_batch_is_split_by_start_of_update(monkeypatch):
+    batch = [zmon_source('average') for _ in range(3)]
+    for source, start in zip(batch, (6, 8, zmon.MAX_QUERY_TIME_SLICE)):
+        monkeypatch.setattr(source, '_get_start_relative_for_update', MagicMock(return_value=start))
+
+    requests = zmon.ZMON._batch_kairosdb_requests(batch)
+
+    # The source without a watermark does not widen the query of the others to a day
+    assert [sources for sources, _, _ in requests] == [batch[:2], batch[2:]]
+    first, second = [q for _, q, _ in requests]
+    assert first['start_absolute'] - second['start_absolute'] == pytest.approx(
+        (zmon.MAX_QUERY_TIME_SLICE - 8) * 60000, abs=1000
+    )
+
+
+def test_changed_values_skips_stored_minutes():
+    minute = datetime.datetime(2020, 1, 1)
+    minutes = [minute + datetime.timedelta(minutes=i) for i in range(5)]
+    values = {minutes[0]: 0.1, minutes[1]: 2, minutes[2]: 1e-20, minutes[3]: 3.5, minutes[4]: 7.25}
+    stored = {
+        minutes[0]: Decimal(repr(0.1)),
+        minutes[1]: Decimal('2'),
+        minutes[2]: Decimal(repr(zmon._clamp_value(1e-20))),
+        minutes[3]: Decimal('3.4'),
+    }
+
+    assert zmon.changed_values(values, stored) == {minutes[3]: 3.5, minutes[4]: 7.25}
+
+
+def test_only_the_overlap_with_stored_minutes_is_read(monkeypatch):
+    minute = datetime.datetime(2020, 1, 1)
+    values = {minute + datetime.timedelta(minutes=i): float(i) for i in range(1440)}
+    stored = {minute + datetime.timedelta(minutes=i): Decimal(i) for i in range(5)}
+
+    get_stored_values = MagicMock(return_value=stored)
+    insert_indicator_values = MagicMock(return_value=1435)
+    monkeypatch.setattr(zmon, 'get_stored_values', get_stored_values)
+    monkeypatch.setattr(zmon, 'insert_indicator_values', insert_indicator_values)
+    monkeypatch.setattr(zmon, 'BACKFILL_COPY_THRESHOLD', 10000)
+    for name in ('update_indicator_watermark', 'rollups', 'archive'):
+        monkeypatch.setattr(zmon, name, MagicMock())
+
+    source = zmon_source('average')
+    source.session = MagicMock()
+    source.indicator.watermark = MagicMock(last_timestamp=minute + datetime.timedelta(minutes=4))
+
+    # Fetched values are counted, whether they changed or not
+    assert source._insert_indicator_values(values, None) == 1440
+
+    get_stored_values.assert_called_once_with(
+        source.session, source.indicator.id, minute, minute + datetime.timedelta(minutes=4)
+    )
+    assert len(insert_indicator_values.call_args[0][2]) == 1435
+
+
+def test_values_are_deleted_in_committed_batches(monkeypatch):
+    sleep = MagicMock()
+    monkeypatch.setattr(zmon.time, 'sleep', sleep)
+
+    session = MagicMock()
+    session.execute.side_effect = [MagicMock(rowcount=count) for count in (100, 100, 30)]
+
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 2, 1)
+    assert zmon.delete_indicator_values(session, 7, start, end, batch_size=100, pause=0.5) == 230
+
+    assert session.execute.call_args[0][1] == {'indicator_id': 7, 'start': start, 'end': end, 'limit': 100}
+    assert session.commit.call_count == 3
+    # No pause after the last batch
+    assert sleep.call_count == 2
+
+
+def test_async_fetch_removes_the_updater_session_of_its_thread(monkeypatch):
+    updater_session = MagicMock()
+    monkeypatch.setattr(zmon, 'updater_session', updater_session)
+    aggregation = MagicMock(result=MagicMock(return_value={}))
+    monkeypatch.setattr(
+        zmon.ZMON, '_batch_kairosdb_requests', classmethod(lambda cls, batch: [(batch, None, [aggregation])])
+    )
+
+    source = zmon_source('average')
+    # E.g. a plain session, which cannot be removed
+    source.session = object()
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(zmon.ZMON.fetch_batch_indicator_values_async([source], http=None)) == [{}]
+    finally:
+        loop.close()
+    updater_session.remove.assert_called_once_with()